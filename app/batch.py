@@ -0,0 +1,237 @@
+import codecs
+import json
+import os
+import time
+from typing import AsyncIterator
+
+from starlette.responses import StreamingResponse
+
+from app.executor import ParseExecutor
+from app.metrics import REQUEST_BATCH_SIZE, REQUEST_DEDUPLICATED, REQUEST_DURATION
+from app.parser_manager import MAX_TRACKING_NUMBER_LENGTH, ParseBudgetExceeded, parse_deadline
+from app.serialization import dumps
+
+# Largest number of tracking numbers accepted in one batch request. Input past the limit is answered with a single
+#   error line and the rest of the body is ignored.
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 500_000))
+# Number of tracking numbers read from the body before they are handed to the ParseManager as one chunk.
+BATCH_CHUNK_SIZE = 1000
+
+_decoder = json.JSONDecoder()
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose body is produced while the request body is still being read. StreamingResponse listens
+    for a client disconnect by calling receive() alongside the body iterator, which would steal the request body
+    chunks the iterator is waiting on, so this response only streams. The body iterator is closed however the stream
+    ends, so the cleanup it does runs even when the client goes away mid-stream.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        finally:
+            if hasattr(self.body_iterator, "aclose"):
+                await self.body_iterator.aclose()
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_length: int = None) -> AsyncIterator[str]:
+    """
+    Split a streamed newline-delimited body into tracking numbers without holding the whole body in memory.
+    Blank lines are skipped.
+    :param chunks: Async iterator of body chunks, eg. request.stream().
+    :param max_length: Optional length in bytes no line may exceed.
+    :return: Async iterator of the non-blank lines.
+    :raises ValueError: If a line is longer than max_length.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if max_length is not None and max(len(buffer), max(map(len, lines), default=0)) > max_length:
+            raise ValueError(f"Line longer than {max_length} bytes")
+        for line in lines:
+            line = line.decode(errors="replace").strip()
+            if line:
+                yield line
+    line = buffer.decode(errors="replace").strip()
+    if line:
+        yield line
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator:
+    """
+    Incrementally decode a streamed JSON array, yielding each item as soon as it is complete.
+    :param chunks: Async iterator of body chunks, eg. request.stream().
+    :return: Async iterator of the decoded array items.
+    :raises ValueError: If the body is not a JSON array.
+    """
+    chunks = chunks.__aiter__()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    exhausted = False
+    started = False
+
+    async def fill():
+        nonlocal buffer, position, exhausted
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            exhausted = True
+            buffer = buffer[position:] + text.decode(b"", final=True)
+            position = 0
+            return
+        buffer = buffer[position:] + text.decode(chunk)
+        position = 0
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if exhausted:
+                raise ValueError("Unexpected end of JSON array")
+            await fill()
+            continue
+
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise ValueError("Body must be a JSON array")
+            started = True
+            position += 1
+            continue
+        if char == "]":
+            return
+        if char == ",":
+            position += 1
+            continue
+
+        try:
+            item, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if exhausted:
+                raise ValueError("Invalid JSON array item")
+            await fill()
+            continue
+        # A number or literal ending exactly at the end of the buffer may continue in the next chunk.
+        if end == len(buffer) and not exhausted:
+            await fill()
+            continue
+        position = end
+        yield item
+
+
+def batch_line(index: int, tracking_number, results: list or None = None, error: str = None,
+               duplicate: bool = False) -> bytes:
+    """
+    Serialize the outcome for one batch item as an NDJSON line.
+    :param index: Position of the item in the request body.
+    :param tracking_number: The item as it was sent.
+    :param results: List of parse results for the item.
+    :param error: Error message when the item could not be parsed.
+    :param duplicate: Whether the item repeats an earlier item of its chunk and shares its outcome.
+    :return: Bytes of the JSON object followed by a newline.
+    """
+    line = {"index": index, "tracking_number": tracking_number}
+    if error is None:
+        line["carriers"] = [x.carrier for x in results]
+        line["results"] = results
+    else:
+        line["error"] = error
+    if duplicate:
+        line["duplicate"] = True
+    return dumps(line) + b"\n"
+
+
+def batch_lines(items: list, start: int, parse_manager, deadline: float = None) -> tuple:
+    """
+    Parse a chunk of batch items and serialize the outcome for each as an NDJSON line.
+    :param items: The decoded batch items.
+    :param start: Position of the first item in the batch.
+    :param parse_manager: ParseManager used to parse the items.
+    :param deadline: Optional time.perf_counter() value parsing has to finish by, see parse_deadline.
+    :return: Tuple of the bytes of the lines, in input order, and the number of items that were found.
+    :raises ParseBudgetExceeded: If parsing runs past the deadline.
+    """
+    numbers = [item for item in items if isinstance(item, str) and len(item) <= MAX_TRACKING_NUMBER_LENGTH]
+    duplicates = []
+    parsed = enumerate(parse_manager.parse_batch(numbers, deadline, duplicates))
+    duplicates = set(duplicates)
+    lines = []
+    found = 0
+    for position, item in enumerate(items, start=start):
+        if not isinstance(item, str):
+            lines.append(batch_line(position, item, error="Tracking number must be a string"))
+            continue
+        if len(item) > MAX_TRACKING_NUMBER_LENGTH:
+            lines.append(batch_line(
+                position, item, error=f"Tracking number longer than {MAX_TRACKING_NUMBER_LENGTH} characters"
+            ))
+            continue
+        number, results = next(parsed)
+        duplicate = number in duplicates
+        if results:
+            found += 1
+            lines.append(batch_line(position, item, results, duplicate=duplicate))
+        else:
+            lines.append(batch_line(position, item, error="Tracking number not found", duplicate=duplicate))
+    if duplicates:
+        REQUEST_DEDUPLICATED.labels("batch").inc(len(duplicates))
+    return b"".join(lines), found
+
+
+async def stream_results(items: AsyncIterator, parse_manager, executor: ParseExecutor) -> AsyncIterator[bytes]:
+    """
+    Parse a stream of batch items in chunks and yield one NDJSON line per item, in input order. The chunks are parsed
+    on the executor's threads while the event loop keeps reading the body and serving other requests.
+    :param items: Async iterator of the decoded batch items.
+    :param parse_manager: ParseManager used to parse the items.
+    :param executor: ParseExecutor the chunks are parsed on.
+    :return: Async iterator of NDJSON lines.
+    """
+    index = 0
+    chunk = []
+    exceeded = False
+
+    def flush():
+        nonlocal exceeded
+        try:
+            lines, found = batch_lines(chunk, index - len(chunk), parse_manager, parse_deadline())
+        except ParseBudgetExceeded as e:
+            # The chunk that ran over is dropped whole, its first item is where the client has to resume from.
+            exceeded = True
+            return batch_line(index - len(chunk), None, error=str(e))
+        chunk.clear()
+        return lines
+
+    started = time.perf_counter()
+    try:
+        async for item in items:
+            if index == MAX_BATCH_SIZE:
+                if chunk:
+                    yield await executor.run(flush)
+                if not exceeded:
+                    yield batch_line(index, None, error=f"Batch size limit of {MAX_BATCH_SIZE} exceeded")
+                return
+            chunk.append(item)
+            index += 1
+            if len(chunk) == BATCH_CHUNK_SIZE:
+                yield await executor.run(flush)
+                if exceeded:
+                    return
+    except ValueError as e:
+        if chunk:
+            yield await executor.run(flush)
+        if not exceeded:
+            yield batch_line(index, None, error=str(e))
+    else:
+        if chunk:
+            yield await executor.run(flush)
+    finally:
+        REQUEST_DURATION.labels("batch").observe(time.perf_counter() - started)
+        REQUEST_BATCH_SIZE.labels("batch").observe(index)
@@ -0,0 +1,109 @@
+import hashlib
+import importlib
+import json
+import os
+import pkgutil
+import re
+
+from app import parsers as parsers_package
+from app.format_definitions import DEFINITIONS_DIRECTORY, load_definition
+from app.parsers.base_parser import BaseParser
+
+# Seconds clients and CDNs may cache the carrier metadata responses for, they only change with a deploy.
+CARRIER_CACHE_MAX_AGE = int(os.environ.get("CARRIER_CACHE_MAX_AGE", 3600))
+
+
+def load_parsers() -> list:
+    """
+    Compile every carrier definition of app/carriers, and import every parser module of the app.parsers package and
+    instantiate the parsers they define, for carriers that need code of their own. Both are found through the package
+    paths, so this works whatever the working directory is.
+    :return: List of parser instances, in file and module name order.
+    """
+    sources = [(path.stem, path) for path in DEFINITIONS_DIRECTORY.glob("*.json")]
+    sources.extend(
+        (name, None) for finder, name, ispkg in pkgutil.iter_modules(parsers_package.__path__)
+        if name != 'base_parser' and name != 'BaseParser'
+    )
+    parsers = []
+    for name, path in sorted(sources):
+        if path is not None:
+            parsers.append(load_definition(path))
+            continue
+        module = importlib.import_module(f'app.parsers.{name}')
+        for attr in dir(module):
+            parser_class = getattr(module, attr)
+            if isinstance(parser_class, type) and issubclass(parser_class, BaseParser) and attr != 'BaseParser':
+                parsers.append(parser_class())
+    return parsers
+
+
+def carrier_id(carrier_name: str) -> str:
+    """
+    URL friendly identifier of a carrier, eg. "united-states-postal-service".
+    :param carrier_name: Display name of the carrier.
+    :return: Lower case name with every run of other characters replaced by a hyphen.
+    """
+    return re.sub(r"[^a-z0-9]+", "-", carrier_name.lower()).strip("-")
+
+
+class StaticResource:
+    """
+    JSON document serialized once, along with the ETag identifying its content.
+    """
+    __slots__ = ("body", "etag")
+
+    def __init__(self, document):
+        self.body = json.dumps(document, separators=(",", ":")).encode()
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+
+class CarrierRegistry:
+    """
+    Metadata of every supported carrier, built once from the loaded parsers. The responses describing the carriers are
+    serialized up front, so serving them is a dictionary lookup.
+    """
+
+    def __init__(self, parsers: list):
+        self.carriers = {}
+        for parser in parsers:
+            metadata = self.describe(parser)
+            self.carriers[metadata["id"]] = metadata
+        self.aliases = {}
+        for metadata in self.carriers.values():
+            self.aliases[metadata["id"]] = metadata["id"]
+            self.aliases[metadata["name"].lower()] = metadata["id"]
+        self.names = StaticResource([metadata["name"] for metadata in self.carriers.values()])
+        self.resources = {carrier: StaticResource(metadata) for carrier, metadata in self.carriers.items()}
+
+    @staticmethod
+    def describe(parser: BaseParser) -> dict:
+        """
+        Describe a parser's carrier and the tracking number formats it accepts.
+        :param parser: The parser.
+        :return: Dictionary of the carrier's id, name, URL template, formats and their lengths and prefixes.
+        """
+        formats = []
+        for tracking_format in parser.formats:
+            formats.append({
+                "name": tracking_format.name,
+                "lengths": sorted({length for length, prefix in tracking_format.dispatch_keys}),
+                "prefixes": sorted({prefix for length, prefix in tracking_format.dispatch_keys if prefix}),
+            })
+        return {
+            "id": carrier_id(parser.carrier_name),
+            "name": parser.carrier_name,
+            "trackingUrlTemplate": parser.tracking_url_template or None,
+            "lengths": sorted({length for item in formats for length in item["lengths"]}),
+            "prefixes": sorted({prefix for item in formats for prefix in item["prefixes"]}),
+            "formats": formats,
+        }
+
+    def get(self, carrier: str) -> StaticResource or None:
+        """
+        Look up the serialized metadata of a carrier.
+        :param carrier: Id or name of the carrier, case insensitive.
+        :return: StaticResource of the carrier's metadata, or None if there is no such carrier.
+        """
+        carrier = self.aliases.get(carrier.lower())
+        return self.resources.get(carrier) if carrier is not None else None
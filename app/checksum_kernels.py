@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# numpy takes longer to import than the rest of the API together and is only needed once a batch has a group large
+#   enough for the kernels, so it is imported then rather than at startup.
+_numpy = None
+_numpy_lock = threading.Lock()
+
+
+def _import_numpy():
+    """
+    Import numpy on first use. The first batches to need it can arrive on several threads at once, so the import runs
+    under a lock and the module is only published once it is fully executed.
+    :return: The numpy module.
+    :raises ModuleNotFoundError: If numpy isn't installed.
+    """
+    global _numpy
+    if _numpy is None:
+        with _numpy_lock:
+            if _numpy is None:
+                import numpy
+                _numpy = numpy
+    return _numpy
+
+
+# Groups smaller than this are cheaper to validate with the scalar checksums than to pack into a digit matrix.
+MIN_KERNEL_BATCH = 32
+
+
+def digit_matrix(values: list) -> np.ndarray:
+    """
+    Pack equal length strings of digits into an (N x L) uint8 matrix.
+    :param values: List of digit strings, all of the same length.
+    :return: (N x L) uint8 array of the digits.
+    """
+    np = _import_numpy()
+    if not values:
+        return np.zeros((0, 0), dtype=np.uint8)
+    buffer = np.frombuffer("".join(values).encode("ascii"), dtype=np.uint8)
+    return (buffer - ord("0")).reshape(len(values), len(values[0]))
+
+
+def check_digit_vector(values: list) -> np.ndarray:
+    """
+    Convert single digit strings to a uint8 vector.
+    :param values: List of single digit strings.
+    :return: (N,) uint8 array of the digits.
+    """
+    np = _import_numpy()
+    return np.frombuffer("".join(values).encode("ascii"), dtype=np.uint8) - ord("0")
+
+
+def alternating_weights(length: int, evens_multiplier: int, odds_multiplier: int) -> np.ndarray:
+    """
+    Build the weight vector used by the mod 10 and mod 7 checksums.
+    :param length: Number of digits.
+    :param evens_multiplier: Multiplier for digits in even positions.
+    :param odds_multiplier: Multiplier for digits in odd positions.
+    :return: (L,) int64 array of the weights.
+    """
+    np = _import_numpy()
+    weights = np.full(length, odds_multiplier, dtype=np.int64)
+    weights[::2] = evens_multiplier
+    return weights
+
+
+def checksum_mod10(digits: np.ndarray, check_digits: np.ndarray, evens_multiplier: int,
+                   odds_multiplier: int) -> np.ndarray:
+    """
+    Vectorized BaseParser.calculate_checksum_mod10.
+    :param digits: (N x L) uint8 matrix of digits to process.
+    :param check_digits: (N,) array of the expected check digits.
+    :param evens_multiplier: Multiplier for digits in even positions.
+    :param odds_multiplier: Multiplier for digits in odd positions.
+    :return: (N,) bool array of whether each row's check digit is valid.
+    """
+    total = digits @ alternating_weights(digits.shape[1], evens_multiplier, odds_multiplier)
+    return (10 - total % 10) % 10 == check_digits
+
+
+def checksum_mod7(digits: np.ndarray, check_digits: np.ndarray, even_multiplier: int,
+                  odd_multiplier: int) -> np.ndarray:
+    """
+    Vectorized BaseParser.calculate_checksum_mod7.
+    :param digits: (N x L) uint8 matrix of digits to process.
+    :param check_digits: (N,) array of the expected check digits.
+    :param even_multiplier: Multiplier for digits in even positions.
+    :param odd_multiplier: Multiplier for digits in odd positions.
+    :return: (N,) bool array of whether each row's check digit is valid.
+    """
+    total = digits @ alternating_weights(digits.shape[1], even_multiplier, odd_multiplier)
+    return total % 7 == check_digits
+
+
+def sum_product_with_weightings_and_modulo(digits: np.ndarray, check_digits: np.ndarray, weightings: list,
+                                           modulo1: int, modulo2: int) -> np.ndarray:
+    """
+    Vectorized BaseParser.sum_product_with_weightings_and_modulo.
+    :param digits: (N x L) uint8 matrix of the serial numbers.
+    :param check_digits: (N,) array of the expected check digits.
+    :param weightings: List of weightings for the checksum calculation.
+    :param modulo1: First modulo value for checksum validation.
+    :param modulo2: Second modulo value for checksum validation.
+    :return: (N,) bool array of whether each row's check digit is valid.
+    """
+    if digits.shape[1] != len(weightings):
+        raise ValueError("Serial number length does not match the length of weightings list.")
+    np = _import_numpy()
+    weighted_sum = digits @ np.asarray(weightings, dtype=np.int64)
+    return weighted_sum % modulo1 % modulo2 == check_digits
+
+
+def s10_checksum(digits: np.ndarray, check_digits: np.ndarray) -> np.ndarray:
+    """
+    Vectorized BaseParser.s10_checksum.
+    :param digits: (N x 8) uint8 matrix of the serial numbers.
+    :param check_digits: (N,) array of the expected check digits.
+    :return: (N,) bool array of whether each row's check digit is valid.
+    """
+    np = _import_numpy()
+    check_digit_sum = 11 - (digits @ np.array([8, 6, 4, 2, 3, 5, 9, 7], dtype=np.int64)) % 11
+    check_digit_sum[check_digit_sum == 10] = 0
+    check_digit_sum[check_digit_sum == 11] = 5
+    return check_digit_sum == check_digits
+
+
+def validate_rows(serial_numbers: list, check_digits: list, kernel) -> np.ndarray:
+    """
+    Run a checksum kernel over serial numbers that may differ in length, calling it once per distinct length.
+    :param serial_numbers: List of digit strings.
+    :param check_digits: List of the matching single digit check digit strings.
+    :param kernel: Callable taking the (N x L) digit matrix and the (N,) check digit vector.
+    :return: (N,) bool array of whether each serial number's check digit is valid.
+    """
+    np = _import_numpy()
+    valid = np.zeros(len(serial_numbers), dtype=bool)
+    rows_by_length = {}
+    for row, serial_number in enumerate(serial_numbers):
+        rows_by_length.setdefault(len(serial_number), []).append(row)
+    for rows in rows_by_length.values():
+        valid[rows] = kernel(
+            digit_matrix([serial_numbers[row] for row in rows]),
+            check_digit_vector([check_digits[row] for row in rows])
+        )
+    return valid
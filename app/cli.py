@@ -0,0 +1,176 @@
+"""
+Bulk parse tracking numbers from files or stdin without going through HTTP.
+
+    python -m app.cli manifest.txt.gz -o results.jsonl
+    python -m app.cli orders.csv --csv --column tracking_number --format csv --workers 8 --progress
+    cat numbers.txt | python -m app.cli > results.jsonl
+
+Input is read as a stream, one tracking number per line or one column of a CSV, and may be gzip compressed. The
+numbers are parsed in fixed size chunks and written out as they are parsed, so memory use stays flat whatever the
+size of the input.
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import mmap
+import os
+import sys
+import time
+
+from app.parser_manager import ParseManager, PARSE_WORKERS
+from app.serialization import dumps
+
+GZIP_MAGIC = b"\x1f\x8b"
+CSV_FIELDS = ["tracking_number", "carrier", "service_type", "tracking_url"]
+
+
+def open_input(path: str, use_mmap: bool = False):
+    """
+    Open an input file, or stdin for "-", as a binary stream, transparently decompressing gzip.
+    :param path: Path of the file to read.
+    :param use_mmap: Memory map the file instead of reading it through a buffer.
+    :return: Binary file-like object.
+    """
+    if path == "-":
+        stream = sys.stdin.buffer
+    elif use_mmap and os.path.getsize(path):
+        with open(path, "rb") as file:
+            stream = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        stream = open(path, "rb")
+    head = stream[:2] if isinstance(stream, mmap.mmap) else stream.peek(2)[:2]
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def read_lines(stream):
+    """
+    Iterate over the decoded lines of a binary stream.
+    :param stream: Binary file-like object.
+    :return: Iterator of lines without their line endings.
+    """
+    for line in iter(stream.readline, b""):
+        yield line.decode(errors="replace").rstrip("\r\n")
+
+
+def read_tracking_numbers(paths: list, use_mmap: bool = False, csv_column: str = None):
+    """
+    Iterate over the tracking numbers of every input, skipping blank lines.
+    :param paths: List of input paths, "-" being stdin.
+    :param use_mmap: Memory map the input files.
+    :param csv_column: Read this column of a CSV instead of plain lines, either a header name or a 0 based index.
+    :return: Iterator of tracking number strings.
+    """
+    for path in paths:
+        lines = read_lines(open_input(path, use_mmap))
+        if csv_column is None:
+            values = lines
+        else:
+            rows = csv.reader(lines)
+            if csv_column.isdigit():
+                column = int(csv_column)
+            else:
+                header = next(rows, [])
+                if csv_column not in header:
+                    raise SystemExit(f"{path}: no column named {csv_column!r}")
+                column = header.index(csv_column)
+            values = (row[column] if len(row) > column else "" for row in rows)
+        for value in values:
+            value = value.strip()
+            if value:
+                yield value
+
+
+def write_jsonl(out, tracking_number: str, results: list):
+    """
+    Write the results for one tracking number as a JSON line.
+    :param out: Text file to write to.
+    :param tracking_number: The tracking number as it was read.
+    :param results: List of parse results for the tracking number.
+    :return: None
+    """
+    out.write(dumps({
+        "tracking_number": tracking_number,
+        "carriers": [x.carrier for x in results],
+        "results": results,
+    }).decode() + "\n")
+
+
+def write_csv(writer, tracking_number: str, results: list):
+    """
+    Write the results for one tracking number as CSV rows, one per carrier or a single empty row if none matched.
+    :param writer: csv.writer to write to.
+    :param tracking_number: The tracking number as it was read.
+    :param results: List of parse results for the tracking number.
+    :return: None
+    """
+    if not results:
+        writer.writerow([tracking_number, "", "", ""])
+    for result in results:
+        writer.writerow([
+            tracking_number, result.carrier, result.get("ServiceType", ""), result.tracking_url or ""
+        ])
+
+
+def main(argv: list = None):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m app.cli", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    arg_parser.add_argument("inputs", nargs="*", default=["-"], help="Input files, - or nothing reads stdin")
+    arg_parser.add_argument("-o", "--output", default="-", help="Output file, defaults to stdout")
+    arg_parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="Output format")
+    arg_parser.add_argument("--csv", action="store_true", help="Read the inputs as CSV instead of plain lines")
+    arg_parser.add_argument("--column", default="0", help="CSV column holding the tracking numbers, name or index")
+    arg_parser.add_argument("--mmap", action="store_true", help="Memory map the input files")
+    arg_parser.add_argument("--workers", type=int, default=PARSE_WORKERS, help="Number of worker processes")
+    arg_parser.add_argument("--chunk-size", type=int, default=20_000, help="Tracking numbers parsed at a time")
+    arg_parser.add_argument("--progress", action="store_true", help="Report progress and throughput on stderr")
+    args = arg_parser.parse_args(argv)
+
+    parse_manager = ParseManager(
+        workers=args.workers,
+        parallel_threshold=args.chunk_size,
+        chunk_size=max(1, args.chunk_size // max(1, args.workers)),
+    )
+    tracking_numbers = read_tracking_numbers(args.inputs, args.mmap, args.column if args.csv else None)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    writer = csv.writer(out) if args.format == "csv" else None
+    if writer is not None:
+        writer.writerow(CSV_FIELDS)
+
+    total = 0
+    matched = 0
+    started = last_report = time.perf_counter()
+    try:
+        while True:
+            chunk = list(itertools.islice(tracking_numbers, args.chunk_size))
+            if not chunk:
+                break
+            for tracking_number, results in zip(chunk, parse_manager.parse_batch(chunk)):
+                if writer is not None:
+                    write_csv(writer, tracking_number, results)
+                else:
+                    write_jsonl(out, tracking_number, results)
+                matched += bool(results)
+            total += len(chunk)
+            now = time.perf_counter()
+            if args.progress and now - last_report >= 1:
+                last_report = now
+                print(f"{total} parsed, {matched} matched, {total / (now - started):.0f} numbers/s", file=sys.stderr)
+    finally:
+        parse_manager.close()
+        if out is not sys.stdout:
+            out.close()
+    if args.progress:
+        elapsed = time.perf_counter() - started
+        print(
+            f"done: {total} parsed, {matched} matched in {elapsed:.2f}s, {total / elapsed if elapsed else 0:.0f} "
+            f"numbers/s",
+            file=sys.stderr
+        )
+
+
+if __name__ == "__main__":
+    main()
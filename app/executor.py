@@ -0,0 +1,147 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable
+
+from app.metrics import REQUEST_REJECTED
+
+# Number of threads parsing runs on, off the event loop. Parsing holds the GIL, so more threads don't parse faster: every
+#   extra thread takes a share of the GIL from the event loop, a second one only keeps a small request from queueing
+#   behind the chunk of a large batch.
+PARSE_THREADS = int(os.environ.get("PARSE_THREADS", 2))
+# Number of tracking requests that may be parsing or waiting for a parse thread at once, per process. Requests past
+#   the limit are answered with 429.
+MAX_CONCURRENT_PARSES = int(os.environ.get("MAX_CONCURRENT_PARSES", 64))
+# Seconds clients are told to wait before retrying a request answered with 429.
+PARSE_RETRY_AFTER = 1
+
+
+class ParseExecutor:
+    """
+    Bounded thread pool the tracking routes hand their parsing to, so the event loop stays free to serve other requests,
+    health checks included, while numbers are parsed. Admission is decided on the event loop: a request either gets one
+    of the max_pending slots straight away or is turned away, it never queues without bound.
+    """
+
+    def __init__(self, threads: int = PARSE_THREADS, max_pending: int = MAX_CONCURRENT_PARSES):
+        self.threads = threads
+        self.max_pending = max_pending
+        # Only ever touched from the event loop thread, so it needs no lock.
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="parse")
+
+    def try_acquire(self, endpoint: str) -> bool:
+        """
+        Take a slot for a request.
+        :param endpoint: Name of the endpoint the request is for, counted in the metrics when it is turned away.
+        :return: Whether a slot was free. The caller has to release it once the request is done.
+        """
+        if self.pending >= self.max_pending:
+            REQUEST_REJECTED.labels(endpoint).inc()
+            return False
+        self.pending += 1
+        return True
+
+    def release(self):
+        """
+        Give back a slot taken by try_acquire.
+        :return: None
+        """
+        self.pending -= 1
+
+    async def run(self, func: Callable, *args):
+        """
+        Run a function on the parse threads.
+        :param func: Callable to run.
+        :param args: Positional arguments for it.
+        :return: What the function returned.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def limit(self, stream: AsyncIterator) -> "LimitedStream":
+        """
+        Tie the slot a request holds to its streamed response body.
+        :param stream: Async iterator of the response body.
+        :return: LimitedStream releasing the slot once the stream ends or is closed.
+        """
+        return LimitedStream(stream, self)
+
+    def shutdown(self):
+        """
+        Wait for the running parses and stop the threads.
+        :return: None
+        """
+        self.executor.shutdown()
+
+
+class LimitedStream:
+    """
+    Streamed response body holding a ParseExecutor slot. The slot is released once, when the stream ends, fails or is
+    closed, including when it is closed without ever being started.
+    """
+
+    def __init__(self, stream: AsyncIterator, executor: ParseExecutor):
+        self.stream = stream
+        self.executor = executor
+        self.released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.stream.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if not self.released:
+            self.released = True
+            self.executor.release()
+            await self.stream.aclose()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent work: while a call for a key is in flight, further calls for the same key wait for
+    its outcome instead of doing the work again. Only used from the event loop thread, so it needs no lock.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    async def run(self, key, func: Callable[[], Awaitable]) -> tuple:
+        """
+        Do some work, or wait for the identical work already in flight.
+        :param key: Hashable key identifying the work.
+        :param func: Coroutine function doing the work, only called when no call for the key is in flight.
+        :return: Tuple of the outcome and whether it was shared by a call already in flight.
+        """
+        future = self.calls.get(key)
+        while future is not None:
+            try:
+                # Shielded so a caller going away doesn't cancel the work the others are waiting for.
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # The call in flight was cancelled along with its caller, which doesn't concern this one: take over.
+            future = self.calls.get(key)
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved, asyncio would log it when no other call was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self.calls[key]
@@ -0,0 +1,298 @@
+import codecs
+import re
+from typing import AsyncIterator, Iterable, Iterator
+
+from app.executor import ParseExecutor
+from app.parser_manager import ParseBudgetExceeded, ParseManager, check_deadline, parse_deadline
+from app.parsers.base_parser import SEPARATORS, FormatMatch, canonicalize, canonicalize_with_offsets
+from app.serialization import dumps
+
+# Characters kept back from the end of every streamed chunk, so a tracking number split across two chunks is matched
+#   once the next chunk arrives. Has to be longer than any tracking number including the separators inside it.
+STREAM_OVERLAP = 256
+
+# Separators that join the characters of a single word, eg. "1Z-999", and the spaces that can separate the groups of
+#   a tracking number written in groups. Line breaks never do.
+_JOINERS = "".join(char for char in SEPARATORS if not char.isspace())
+_LINE_BREAKS = "".join(char for char in SEPARATORS if len(f"a{char}a".splitlines()) > 1)
+_SPACES = "".join(char for char in SEPARATORS if char.isspace() and char not in _LINE_BREAKS)
+_TOKEN = f"[A-Za-z0-9]+(?:[{re.escape(_JOINERS)}]+[A-Za-z0-9]+)*"
+_DIGIT_TOKEN = f"(?=[A-Za-z0-9{re.escape(_JOINERS)}]*[0-9]){_TOKEN}"
+# The stretches of text a tracking number can be spread over: a word, or words that all hold a digit separated by
+#   single spaces, eg. "1Z 999 AA1 0123 4567 84". Joining plain words or separate lines would read numbers into prose,
+#   "shipped in 5761..." as a DHL number starting with IN. Every run starts and ends at a word boundary.
+_RUN = re.compile(f"{_DIGIT_TOKEN}(?:[{re.escape(_SPACES)}]{_DIGIT_TOKEN})*|{_TOKEN}")
+_WORD = re.compile(_TOKEN)
+# What can follow a run at the end of a streamed text when more of the run may still come.
+_OPEN_TAIL = re.compile(f"[{re.escape(_JOINERS)}]*|[{re.escape(_SPACES)}][A-Za-z0-9{re.escape(_JOINERS)}]*")
+_SPACE_SET = frozenset(_SPACES)
+_ALPHANUMERIC = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+
+
+class TrackingNumberScanner:
+    """
+    Finds every tracking number in free text, whether or not it is written with separators inside it.
+
+    The text is split into runs: words of letters and digits, possibly joined by hyphens, and groups of such words
+    holding digits separated by single spaces. A run of several words is a tracking number as a whole or not at all,
+    so "Totals: 100 200 300 400" doesn't hide one in its last groups. Within a word, a tracking number has to start
+    and end on a word boundary of the original text, so each word is canonicalized once with a map from every
+    canonical character back to its offset in the text, and only spans between boundaries whose canonical length some
+    format accepts are looked up in the ParseManager's dispatch index, longest first.
+    """
+
+    def __init__(self, parse_manager: ParseManager):
+        self.parse_manager = parse_manager
+        self.lengths = sorted(parse_manager.dispatch_index, reverse=True)
+        self.length_set = frozenset(self.lengths)
+        self.min_length = min(self.lengths, default=0)
+
+    def scan(self, text: str, start: int = 0, limit: int = None, deadline: float = None) -> Iterator[tuple]:
+        """
+        Find the validated tracking numbers in a text.
+        :param text: String to search.
+        :param start: Position to start searching from.
+        :param limit: Only return tracking numbers starting before this position.
+        :param deadline: Optional time.perf_counter() value scanning has to finish by, checked between words.
+        :return: Iterator of (start, end, FormatMatch) tuples, in order of appearance.
+        :raises ParseBudgetExceeded: If scanning runs past the deadline.
+        """
+        for match_start, match_end, format_match in self.scan_runs(text, start, limit, deadline):
+            if format_match is not None:
+                yield match_start, match_end, format_match
+
+    def scan_runs(self, text: str, start: int = 0, limit: int = None, deadline: float = None,
+                  continued: bool = False) -> Iterator[tuple]:
+        """
+        Find the validated tracking numbers in a text, reporting the runs scanned. Runs starting before limit are
+        scanned whole, except a run at the end of a text that continues past it (limit short of the end), which is
+        only scanned up to limit since more of it is still to come.
+        :param text: String to search.
+        :param start: Position to start searching from.
+        :param limit: Only scan runs starting before this position.
+        :param deadline: Optional time.perf_counter() value scanning has to finish by, checked between words.
+        :param continued: Whether the text at start continues a run scanned earlier, which can't be a tracking
+            number as a whole then.
+        :return: Iterator of (start, end, FormatMatch) tuples for the tracking numbers, in order of appearance,
+            followed by a (start, end, None) tuple at the end of every run, with None as the end for a run left open.
+        :raises ParseBudgetExceeded: If scanning runs past the deadline.
+        """
+        limit = len(text) if limit is None else limit
+        first = True
+        for run in _RUN.finditer(text, start):
+            check_deadline(deadline)
+            run_start, run_end = run.span()
+            if run_start >= limit:
+                return
+            # The first run found continues the earlier one when only the space joining them lies in between.
+            resumed = first and continued and (
+                run_start == start or (run_start == start + 1 and text[start] in _SPACE_SET)
+            )
+            first = False
+            open_run = limit < len(text) and _OPEN_TAIL.fullmatch(text, run_end) is not None
+            if run_end - run_start < self.min_length and not open_run:
+                yield run_start, run_end, None
+                continue
+            words = [word.span() for word in _WORD.finditer(text, run_start, run_end)]
+            if len(words) > 1 and not open_run and not resumed:
+                canonical = canonicalize(run.group())
+                format_match = self.__validate(canonical) if len(canonical) in self.length_set else None
+                if format_match is not None:
+                    yield run_start, run_end, format_match
+                    yield run_start, run_end, None
+                    continue
+            # A run found right at the start position can be the tail of a word that began before it.
+            glued = run_start == start and start > 0 and text[start - 1] in _ALPHANUMERIC
+            for index, (word_start, word_end) in enumerate(words):
+                if open_run and word_start >= limit:
+                    break
+                yield from self.__scan_word(
+                    text, word_start, word_end, glued and index == 0, limit if open_run else None, deadline
+                )
+            if open_run:
+                yield run_start, None, None
+                return
+            yield run_start, run_end, None
+
+    def __scan_word(self, text: str, word_start: int, word_end: int, glued: bool, limit: int or None,
+                    deadline: float = None) -> Iterator[tuple]:
+        """
+        Find the tracking numbers within one word of a run, between the boundaries its joiners leave.
+        :param text: String searched.
+        :param word_start: Position of the word in the text.
+        :param word_end: Position just past the word.
+        :param glued: Whether the word continues text before it, so its first part can't start a tracking number.
+        :param limit: Only return tracking numbers starting before this position, None for no limit.
+        :param deadline: Optional time.perf_counter() value scanning has to finish by.
+        :return: Iterator of (start, end, FormatMatch) tuples.
+        :raises ParseBudgetExceeded: If scanning runs past the deadline.
+        """
+        if word_end - word_start < self.min_length:
+            return
+        canonical, offsets = canonicalize_with_offsets(text[word_start:word_end])
+        # Canonical positions that fall on a boundary of the original text.
+        boundaries = [0]
+        boundaries.extend(index for index in range(1, len(offsets)) if offsets[index] != offsets[index - 1] + 1)
+        boundaries.append(len(canonical))
+        part_ends = set(boundaries)
+        consumed = 1 if glued else 0
+        for part_start in boundaries[:-1]:
+            # A single word of digits and hyphens can be arbitrarily long, every candidate start counts.
+            check_deadline(deadline)
+            if part_start < consumed:
+                continue
+            match_start = word_start + offsets[part_start]
+            if limit is not None and match_start >= limit:
+                return
+            for length in self.lengths:
+                part_end = part_start + length
+                if part_end not in part_ends:
+                    continue
+                format_match = self.__validate(canonical[part_start:part_end])
+                if format_match is not None:
+                    yield match_start, word_start + offsets[part_end - 1] + 1, format_match
+                    consumed = part_end
+                    break
+
+    def __validate(self, candidate: str) -> FormatMatch or None:
+        """
+        Check a canonical span against the formats dispatched for it.
+        :param candidate: Canonical span of text.
+        :return: FormatMatch of the first parser that accepts the span, or None.
+        """
+        for parser, formats in self.parse_manager.candidate_formats(candidate):
+            format_match = parser.match_canonical(candidate, formats)
+            if format_match is not None:
+                return format_match
+        return None
+
+    def extract(self, text: str) -> list:
+        """
+        Find every tracking number in a text.
+        :param text: String to search.
+        :return: List of result dictionaries with the start and end offsets of each tracking number in the text.
+        """
+        return [extraction_result(start, end, format_match) for start, end, format_match in self.scan(text)]
+
+    def extract_stream(self, chunks: Iterable[str]) -> Iterator[dict]:
+        """
+        Find every tracking number in a text that arrives in chunks.
+        :param chunks: Iterable of strings that concatenated make up the text.
+        :return: Iterator of result dictionaries with offsets into the whole text.
+        """
+        extractor = StreamExtractor(self)
+        for chunk in chunks:
+            yield from extractor.feed(chunk)
+        yield from extractor.close()
+
+
+class StreamExtractor:
+    """
+    Incremental extraction over a text fed in chunks. Only the tail of the text that could still be part of a
+    tracking number continuing into the next chunk is kept between calls.
+    """
+
+    def __init__(self, scanner: TrackingNumberScanner, overlap: int = STREAM_OVERLAP):
+        self.scanner = scanner
+        self.overlap = overlap
+        self.buffer = ""
+        # Offset of the start of the buffer in the whole text.
+        self.offset = 0
+        # Position in the buffer to scan from. The character before it is kept so the scanner can tell whether a
+        #   tracking number is glued to the text that came before.
+        self.start = 0
+        # Whether the text at start continues a run, longer than the overlap, that was scanned up to there.
+        self.continued = False
+
+    def feed(self, text: str, deadline: float = None) -> list:
+        """
+        Add a chunk of text and return the tracking numbers that can no longer be affected by text still to come.
+        :param text: The next chunk of text.
+        :param deadline: Optional time.perf_counter() value scanning the chunk has to finish by.
+        :return: List of result dictionaries with offsets into the whole text.
+        """
+        self.buffer += text
+        limit = len(self.buffer) - self.overlap
+        if limit <= self.start:
+            return []
+        return self.__extract(limit, deadline)
+
+    def close(self, deadline: float = None) -> list:
+        """
+        Signal the end of the text and return the tracking numbers left in the buffer.
+        :param deadline: Optional time.perf_counter() value scanning the rest of the text has to finish by.
+        :return: List of result dictionaries with offsets into the whole text.
+        """
+        return self.__extract(len(self.buffer), deadline)
+
+    def __extract(self, limit: int, deadline: float = None) -> list:
+        """
+        Extract the tracking numbers of the runs starting before limit and drop the text they no longer need from the
+        buffer. Runs are scanned whole, so a run crossing limit moves the scan position past it, except one still
+        open at the end of the buffer, which is picked up again from limit.
+        :param limit: Position in the buffer past which runs are left for a later call.
+        :param deadline: Optional time.perf_counter() value scanning has to finish by.
+        :return: List of result dictionaries with offsets into the whole text.
+        """
+        results = []
+        consumed = limit
+        continued = False
+        for start, end, format_match in self.scanner.scan_runs(self.buffer, self.start, limit, deadline,
+                                                               self.continued):
+            if format_match is not None:
+                results.append(extraction_result(self.offset + start, self.offset + end, format_match))
+            if end is None:
+                continued = True
+            else:
+                consumed = max(consumed, end)
+        keep_from = max(consumed - 1, 0)
+        self.buffer = self.buffer[keep_from:]
+        self.offset += keep_from
+        self.start = consumed - keep_from
+        self.continued = continued
+        return results
+
+
+def extraction_result(start: int, end: int, format_match: FormatMatch) -> dict:
+    """
+    Build the response dictionary for a tracking number found in a text.
+    :param start: Offset of the first character of the tracking number.
+    :param end: Offset just past the last character of the tracking number.
+    :param format_match: The validated match of the tracking number.
+    :return: Dictionary with the offsets and everything parsed from the tracking number.
+    """
+    return {"start": start, "end": end, **format_match.parser.build_result(format_match).to_dict()}
+
+
+async def stream_extraction(chunks: AsyncIterator[bytes], scanner: TrackingNumberScanner,
+                            executor: ParseExecutor) -> AsyncIterator[bytes]:
+    """
+    Extract the tracking numbers from a streamed UTF-8 body, yielding each one as an NDJSON line as soon as it is found.
+    Every chunk is scanned on the executor's threads and has to be scanned within the parse time budget, otherwise the
+    stream ends with an error line.
+    :param chunks: Async iterator of body chunks, eg. request.stream().
+    :param scanner: Scanner used to find the tracking numbers.
+    :param executor: ParseExecutor the chunks are scanned on.
+    :return: Async iterator of NDJSON lines.
+    """
+    text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    extractor = StreamExtractor(scanner)
+
+    def feed(chunk: str) -> list:
+        return extractor.feed(chunk, parse_deadline())
+
+    def finish() -> list:
+        deadline = parse_deadline()
+        return extractor.feed(text.decode(b"", final=True), deadline) + extractor.close(deadline)
+
+    try:
+        async for chunk in chunks:
+            results = await executor.run(feed, text.decode(chunk))
+            if results:
+                yield b"".join(dumps(result) + b"\n" for result in results)
+        results = await executor.run(finish)
+    except ParseBudgetExceeded as e:
+        yield dumps({"error": str(e)}) + b"\n"
+        return
+    if results:
+        yield b"".join(dumps(result) + b"\n" for result in results)
@@ -0,0 +1,262 @@
+"""
+Carriers described as data instead of code. Every JSON file in app/carriers defines one carrier and is compiled at
+startup into a DefinitionParser, so adding a carrier means adding a file:
+
+    {
+        "parser": "FedEx",                   name reported in the metrics and benchmarks
+        "carrier": "FedEx",                  carrier name returned with every result
+        "trackingUrlTemplate": "...%s",      optional, %s is replaced with the tracking number
+        "fields": ["SerialNumber", ...],     named groups copied into the results when they matched
+        "formats": [
+            {
+                "name": "FedEx Ground",
+                "pattern": "(?P<SerialNumber>[0-9]{14})(?P<CheckDigit>[0-9])",
+                "dispatch": [{"lengths": [15]}],
+                "checksum": {"algorithm": "mod10", "evensMultiplier": 1, "oddsMultiplier": 3}
+            }
+        ],
+        "lookups": [
+            {"group": "ServiceTypeCode", "field": "ServiceType", "table": {"01": "Next Day Air"}}
+        ]
+    }
+
+Patterns are matched against the canonical form of the tracking number, see canonicalize. Each dispatch entry lists
+canonical lengths, either as "lengths" or as "minLength" and "maxLength", combined with "prefixes" (default no prefix)
+or with "prefixAlphabets", one string of allowed characters per prefix position. A format without a "checksum" is
+decided by its pattern alone. Checksums validate the "CheckDigit" group against the digits of the group named by
+"digits" (default "SerialNumber"), or against every character before the check digit when "digits" is "preceding".
+"prefixDigits" maps the first character of the number to digits put in front of them. A lookup adds "field" to the
+result with the value "table" gives the "group"'s value. With "match": "pattern" the keys of the table are regexes
+searched in order, which are expanded at startup over every value "keyAlphabets" allows, one string of characters per
+position. The lookups of a group are merged into one table at startup, so decoding a group is a single dictionary
+access whatever the number of fields it adds. Formats and lookups may carry a free text "description".
+"""
+import json
+import re
+from functools import partial
+from itertools import product
+from pathlib import Path
+from typing import Callable, Tuple
+
+from app import checksum_kernels
+from app.parsers.base_parser import BaseParser
+
+# Directory the carrier definitions are loaded from.
+DEFINITIONS_DIRECTORY = Path(__file__).parent / "carriers"
+
+
+def _scalar_mod10(evens_multiplier: int, odds_multiplier: int, digits: str, check_digit: str) -> bool:
+    return BaseParser.calculate_checksum_mod10(
+        BaseParser.digits(digits), int(check_digit), evens_multiplier, odds_multiplier
+    )
+
+
+def _scalar_mod7(evens_multiplier: int, odds_multiplier: int, digits: str, check_digit: str) -> bool:
+    return BaseParser.calculate_checksum_mod7(
+        BaseParser.digits(digits), int(check_digit), evens_multiplier, odds_multiplier
+    )
+
+
+def _scalar_s10(digits: str, check_digit: str) -> bool:
+    return BaseParser.s10_checksum(int(digits), int(check_digit))
+
+
+def _mod10(spec: dict) -> Tuple[Callable, Callable]:
+    evens_multiplier, odds_multiplier = spec["evensMultiplier"], spec["oddsMultiplier"]
+    return (
+        partial(_scalar_mod10, evens_multiplier, odds_multiplier),
+        partial(checksum_kernels.checksum_mod10, evens_multiplier=evens_multiplier, odds_multiplier=odds_multiplier)
+    )
+
+
+def _mod7(spec: dict) -> Tuple[Callable, Callable]:
+    evens_multiplier, odds_multiplier = spec["evensMultiplier"], spec["oddsMultiplier"]
+    return (
+        partial(_scalar_mod7, evens_multiplier, odds_multiplier),
+        partial(checksum_kernels.checksum_mod7, even_multiplier=evens_multiplier, odd_multiplier=odds_multiplier)
+    )
+
+
+def _weighted(spec: dict) -> Tuple[Callable, Callable]:
+    weightings, modulo1, modulo2 = list(spec["weightings"]), spec["modulo1"], spec["modulo2"]
+    return (
+        partial(BaseParser.sum_product_with_weightings_and_modulo, weightings=weightings, modulo1=modulo1,
+                modulo2=modulo2),
+        partial(checksum_kernels.sum_product_with_weightings_and_modulo, weightings=weightings, modulo1=modulo1,
+                modulo2=modulo2)
+    )
+
+
+def _s10(spec: dict) -> Tuple[Callable, Callable]:
+    return _scalar_s10, checksum_kernels.s10_checksum
+
+
+# Checksum algorithms a format can name, each building the scalar checksum, taking the digits and the check digit as
+#   strings, and the matching vectorized kernel from the format's parameters.
+CHECKSUM_ALGORITHMS = {
+    "mod10": _mod10,
+    "mod7": _mod7,
+    "weighted": _weighted,
+    "s10": _s10,
+}
+
+
+# The checksums are built from partials of module level functions rather than closures, so compiled parsers can be
+#   pickled into an engine snapshot.
+def _group_digits(group: str, match) -> str:
+    return match.group(group)
+
+
+def _preceding_digits(match) -> str:
+    return match.string[:match.start("CheckDigit")]
+
+
+def _prefixed_digits(prefix_digits: dict, source: Callable, match) -> str:
+    return prefix_digits.get(match.string[0], "") + source(match)
+
+
+def _checksum(scalar: Callable, source: Callable, match) -> bool:
+    return scalar(source(match), match.group("CheckDigit"))
+
+
+def _batch_checksum(kernel: Callable, source: Callable, matches: list):
+    return checksum_kernels.validate_rows(
+        [source(match) for match in matches], [match.group("CheckDigit") for match in matches], kernel
+    )
+
+
+def compile_checksum(spec: dict) -> Tuple[Callable, Callable]:
+    """
+    Build the checksum and the batch checksum of a format from its definition.
+    :param spec: The "checksum" object of the format.
+    :return: Tuple of the checksum, taking a match object, and the batch checksum, taking a list of them.
+    :raises ValueError: If the algorithm is unknown.
+    """
+    if spec["algorithm"] not in CHECKSUM_ALGORITHMS:
+        raise ValueError(f"Unknown checksum algorithm {spec['algorithm']!r}")
+    scalar, kernel = CHECKSUM_ALGORITHMS[spec["algorithm"]](spec)
+    digits = spec.get("digits", "SerialNumber")
+    if digits == "preceding":
+        source = _preceding_digits
+    else:
+        source = partial(_group_digits, digits)
+    prefix_digits = spec.get("prefixDigits")
+    if prefix_digits:
+        source = partial(_prefixed_digits, prefix_digits, source)
+    return partial(_checksum, scalar, source), partial(_batch_checksum, kernel, source)
+
+
+def compile_dispatch_keys(entries: list) -> list:
+    """
+    Expand the dispatch entries of a format into its (length, prefix) dispatch keys.
+    :param entries: The "dispatch" list of the format.
+    :return: List of (length, prefix) tuples.
+    """
+    keys = []
+    for entry in entries:
+        if "lengths" in entry:
+            lengths = entry["lengths"]
+        else:
+            lengths = range(entry["minLength"], entry["maxLength"] + 1)
+        if "prefixAlphabets" in entry:
+            prefixes = ["".join(chars) for chars in product(*entry["prefixAlphabets"])]
+        else:
+            prefixes = entry.get("prefixes", [""])
+        keys.extend((length, prefix) for length in lengths for prefix in prefixes)
+    return keys
+
+
+def compile_lookup(spec: dict) -> dict:
+    """
+    Build the table of a lookup, expanding pattern tables into a table of every value they match.
+    :param spec: The lookup object.
+    :return: Dictionary mapping the group's values to the field's value.
+    :raises ValueError: If a pattern table has no keyAlphabets.
+    """
+    table = spec["table"]
+    if spec.get("match", "exact") == "exact":
+        return dict(table)
+    if "keyAlphabets" not in spec:
+        raise ValueError(f"Pattern lookup of {spec['group']} needs keyAlphabets")
+    patterns = [(re.compile(pattern), value) for pattern, value in table.items()]
+    expanded = {}
+    for chars in product(*spec["keyAlphabets"]):
+        code = "".join(chars)
+        for pattern, value in patterns:
+            if pattern.search(code):
+                expanded[code] = value
+                break
+    return expanded
+
+
+def compile_lookups(specs: list) -> list:
+    """
+    Merge the lookups of a carrier by group.
+    :param specs: The "lookups" list of the carrier.
+    :return: List of (group, table) tuples, the table mapping each value of the group to the tuple of the names and
+        the tuple of the values of the fields it decodes to.
+    """
+    tables = {}
+    for spec in specs:
+        table = tables.setdefault(spec["group"], {})
+        for code, value in compile_lookup(spec).items():
+            table.setdefault(code, {})[spec["field"]] = value
+    return [
+        (group, {code: (tuple(fields), tuple(fields.values())) for code, fields in table.items()})
+        for group, table in tables.items()
+    ]
+
+
+class DefinitionParser(BaseParser):
+    """
+    Parser of a carrier defined in a data file, see the module documentation for the format of the definition.
+    """
+
+    def __init__(self, definition: dict):
+        super().__init__()
+        self.name = definition["parser"]
+        self.carrier_name = definition["carrier"]
+        self.tracking_url_template = definition.get("trackingUrlTemplate", "")
+        self.constructors = list(definition.get("fields", []))
+        for tracking_format in definition["formats"]:
+            checksum, batch_checksum = None, None
+            if "checksum" in tracking_format:
+                checksum, batch_checksum = compile_checksum(tracking_format["checksum"])
+            self.add_format(
+                tracking_format["name"],
+                tracking_format["pattern"],
+                compile_dispatch_keys(tracking_format["dispatch"]),
+                checksum,
+                batch_checksum
+            )
+        self.lookups = compile_lookups(definition.get("lookups", []))
+
+    def decode_fields(self, format_match) -> Tuple[tuple, tuple]:
+        """
+        Decode the fields of a matched tracking number, adding the fields of the lookup tables.
+        :param format_match: The validated match to extract fields from.
+        :return: Tuple of the field names and their values.
+        """
+        names, values = super().decode_fields(format_match)
+        for group, table in self.lookups:
+            if group in names:
+                decoded = table.get(values[names.index(group)])
+                if decoded:
+                    names += decoded[0]
+                    values += decoded[1]
+        return names, values
+
+
+def load_definition(path: Path) -> DefinitionParser:
+    """
+    Load and compile a carrier definition file.
+    :param path: Path of the JSON file.
+    :return: The compiled parser.
+    :raises ValueError: If the definition is invalid.
+    """
+    with open(path, encoding="utf-8") as file:
+        definition = json.load(file)
+    try:
+        return DefinitionParser(definition)
+    except (KeyError, TypeError, ValueError, re.error) as e:
+        raise ValueError(f"Invalid carrier definition {path.name}: {e!r}") from e
@@ -0,0 +1,550 @@
+"""
+Bulk tracking jobs, for batches too large for one request. A job's tracking numbers are uploaded once, split into
+chunks and queued in a local SQLite database, job worker processes claim the chunks and parse them with a
+ParseManager, and the NDJSON result lines of every chunk are stored next to it until the job is fetched or expires.
+
+Everything a job needs lives in the database, so jobs outlive the processes working on them: a chunk a worker was
+parsing when it stopped is claimed again once its lease runs out, and finished chunks are never parsed twice. Workers
+run on their own against the same database, or are started with the API when JOB_WORKERS is set:
+
+    python -m app.jobs [--workers 2]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from typing import AsyncIterator, List, NamedTuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.batch import batch_lines, iter_lines
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+from app.snapshot import load_snapshot
+
+# Path of the SQLite database the job queue and the job results are kept in.
+JOB_DATABASE = os.environ.get("JOB_DATABASE", "jobs.sqlite3")
+# Number of tracking numbers per chunk, the unit jobs are parsed, stored and resumed in.
+JOB_CHUNK_SIZE = int(os.environ.get("JOB_CHUNK_SIZE", 10_000))
+# Number of job worker processes the API starts, by default 0, which leaves jobs to workers started with
+#   `python -m app.jobs`. Every API process started with uvicorn starts its own, the pre-fork server starts them once.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 0))
+# Largest number of tracking numbers accepted in one job.
+JOB_MAX_SIZE = int(os.environ.get("JOB_MAX_SIZE", 10_000_000))
+# Seconds a worker may hold a chunk before another worker takes it over, as happens when a worker is killed mid-chunk.
+JOB_LEASE = float(os.environ.get("JOB_LEASE", 60))
+# Seconds finished and failed jobs are kept before they are deleted along with their results.
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 7 * 24 * 3600))
+# Longest line, in bytes, accepted in an uploaded job.
+JOB_MAX_LINE_LENGTH = 4096
+# Seconds an idle worker waits before looking for work again.
+JOB_POLL_INTERVAL = 1.0
+# Seconds between two deletions of expired jobs by a worker.
+JOB_PURGE_INTERVAL = 600
+# Seconds a stopping worker gets to finish its chunk before it is terminated.
+JOB_STOP_TIMEOUT = 10
+
+_GZIP_MAGIC = b"\x1f\x8b"
+# Size of the pieces a gzip body is decompressed in, so a small body can't expand into one huge buffer.
+_DECOMPRESS_SIZE = 1 << 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    uploaded_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    total INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0,
+    found INTEGER NOT NULL DEFAULT 0,
+    parse_seconds REAL NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    job_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    claimed_at REAL,
+    numbers BLOB,
+    results BLOB,
+    PRIMARY KEY (job_id, chunk)
+);
+CREATE INDEX IF NOT EXISTS chunks_status ON chunks (status, claimed_at);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class JobTooLarge(ValueError):
+    pass
+
+
+class ChunkClaim(NamedTuple):
+    """
+    A chunk a worker claimed, see JobStore.claim_chunk.
+    """
+    job_id: str
+    chunk: int
+    start: int
+    numbers: List[str]
+
+
+class ChunkInfo(NamedTuple):
+    """
+    Position and status of a stored chunk, see JobStore.chunk_infos.
+    """
+    chunk: int
+    start: int
+    size: int
+    status: str
+
+
+class JobStore:
+    """
+    The job queue and result store, kept in SQLite. Every operation opens its own connection, so one store can be used
+    from any thread, and any number of processes can share the database.
+    """
+
+    def __init__(self, path: str = JOB_DATABASE):
+        self.path = path
+        with self.__connect() as connection:
+            # Only takes effect on a new database, it has to precede the tables.
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def __connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA synchronous = NORMAL")
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def __transaction(self):
+        with self.__connect() as connection:
+            # Taking the write lock upfront keeps two workers from claiming the same chunk.
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def create_job(self) -> str:
+        """
+        Create a job to upload tracking numbers to.
+        :return: Id of the job.
+        """
+        job_id = uuid.uuid4().hex
+        with self.__transaction() as connection:
+            connection.execute("INSERT INTO jobs (id, created_at) VALUES (?, ?)", (job_id, time.time()))
+        return job_id
+
+    def add_chunk(self, job_id: str, chunk: int, start: int, numbers: List[str]):
+        """
+        Queue a chunk of a job's tracking numbers. Workers may start on it while the rest of the job is uploaded.
+        :param job_id: Id of the job.
+        :param chunk: Position of the chunk in the job.
+        :param start: Position of the chunk's first tracking number in the job.
+        :param numbers: The tracking numbers.
+        :return: None
+        """
+        data = zlib.compress("\n".join(numbers).encode(), 1)
+        with self.__transaction() as connection:
+            connection.execute(
+                "INSERT INTO chunks (job_id, chunk, start, size, numbers) VALUES (?, ?, ?, ?, ?)",
+                (job_id, chunk, start, len(numbers), data)
+            )
+            connection.execute("UPDATE jobs SET total = total + ? WHERE id = ?", (len(numbers), job_id))
+
+    def finish_upload(self, job_id: str):
+        """
+        Mark a job as completely uploaded.
+        :param job_id: Id of the job.
+        :return: None
+        """
+        now = time.time()
+        with self.__transaction() as connection:
+            connection.execute("UPDATE jobs SET uploaded_at = ? WHERE id = ?", (now, job_id))
+            self.__finish_job(connection, job_id, now)
+
+    def claim_chunk(self, worker: str) -> ChunkClaim or None:
+        """
+        Claim the oldest chunk waiting to be parsed, or one whose worker's lease ran out.
+        :param worker: Id of the claiming worker.
+        :return: ChunkClaim, or None when there is nothing to parse.
+        """
+        now = time.time()
+        with self.__transaction() as connection:
+            row = connection.execute(
+                "SELECT job_id, chunk, start, numbers FROM chunks WHERE status = 'pending' ORDER BY rowid LIMIT 1"
+            ).fetchone()
+            if row is None:
+                row = connection.execute(
+                    "SELECT job_id, chunk, start, numbers FROM chunks WHERE status = 'running' AND claimed_at < ? "
+                    "ORDER BY rowid LIMIT 1", (now - JOB_LEASE,)
+                ).fetchone()
+                if row is None:
+                    return None
+                logger.warning("Taking over chunk %d of job %s, its lease ran out", row["chunk"], row["job_id"])
+            connection.execute(
+                "UPDATE chunks SET status = 'running', worker = ?, claimed_at = ? WHERE job_id = ? AND chunk = ?",
+                (worker, now, row["job_id"], row["chunk"])
+            )
+            connection.execute(
+                "UPDATE jobs SET started_at = ? WHERE id = ? AND started_at IS NULL", (now, row["job_id"])
+            )
+        numbers = zlib.decompress(row["numbers"]).decode().split("\n")
+        return ChunkClaim(row["job_id"], row["chunk"], row["start"], numbers)
+
+    def complete_chunk(self, claim: ChunkClaim, worker: str, results: bytes, found: int, duration: float) -> bool:
+        """
+        Store the results of a claimed chunk, finishing the job when it was the last one.
+        :param claim: The claimed chunk.
+        :param worker: Id of the worker that claimed it.
+        :param results: NDJSON result lines of the chunk's tracking numbers, in order.
+        :param found: Number of tracking numbers of the chunk that were found.
+        :param duration: Seconds parsing the chunk took.
+        :return: Whether the results were stored, False when the chunk was taken over by another worker in the
+            meantime or its job was deleted.
+        """
+        now = time.time()
+        data = zlib.compress(results, 1)
+        with self.__transaction() as connection:
+            stored = connection.execute(
+                "UPDATE chunks SET status = 'done', results = ?, numbers = NULL "
+                "WHERE job_id = ? AND chunk = ? AND status = 'running' AND worker = ?",
+                (data, claim.job_id, claim.chunk, worker)
+            ).rowcount
+            if not stored:
+                return False
+            connection.execute(
+                "UPDATE jobs SET processed = processed + ?, found = found + ?, parse_seconds = parse_seconds + ? "
+                "WHERE id = ?", (len(claim.numbers), found, duration, claim.job_id)
+            )
+            self.__finish_job(connection, claim.job_id, now)
+        return True
+
+    @staticmethod
+    def __finish_job(connection: sqlite3.Connection, job_id: str, now: float):
+        connection.execute(
+            "UPDATE jobs SET finished_at = ? "
+            "WHERE id = ? AND uploaded_at IS NOT NULL AND finished_at IS NULL AND processed = total",
+            (now, job_id)
+        )
+
+    def fail_job(self, job_id: str, error: str):
+        """
+        Give up on a job, its unparsed chunks are dropped.
+        :param job_id: Id of the job.
+        :param error: Why the job failed.
+        :return: None
+        """
+        with self.__transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET error = ?, finished_at = ? WHERE id = ? AND error IS NULL",
+                (error, time.time(), job_id)
+            )
+            connection.execute(
+                "UPDATE chunks SET status = 'failed', numbers = NULL WHERE job_id = ? AND status != 'done'", (job_id,)
+            )
+
+    def delete_job(self, job_id: str) -> bool:
+        """
+        Delete a job along with its results.
+        :param job_id: Id of the job.
+        :return: Whether the job existed.
+        """
+        with self.__transaction() as connection:
+            connection.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+            return connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+
+    def purge(self, before: float) -> int:
+        """
+        Delete the jobs that finished or failed before some time, and release the space they took.
+        :param before: time.time() value.
+        :return: Number of jobs deleted.
+        """
+        with self.__transaction() as connection:
+            expired = [row[0] for row in connection.execute("SELECT id FROM jobs WHERE finished_at < ?", (before,))]
+            for job_id in expired:
+                connection.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+                connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if expired:
+            with self.__connect() as connection:
+                # execute() would only step through the pragma once, freeing a single page.
+                connection.executescript("PRAGMA incremental_vacuum;")
+        return len(expired)
+
+    def get_job(self, job_id: str) -> dict or None:
+        """
+        Describe a job and its progress.
+        :param job_id: Id of the job.
+        :return: Dictionary of the job status, see job_status, or None when there is no such job.
+        """
+        with self.__connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return job_status(row, time.time()) if row is not None else None
+
+    def chunk_infos(self, job_id: str) -> List[ChunkInfo]:
+        """
+        List the chunks of a job.
+        :param job_id: Id of the job.
+        :return: List of ChunkInfo, in job order.
+        """
+        with self.__connect() as connection:
+            return [ChunkInfo(*row) for row in connection.execute(
+                "SELECT chunk, start, size, status FROM chunks WHERE job_id = ? ORDER BY chunk", (job_id,)
+            )]
+
+    def chunk_results(self, job_id: str, chunk: int) -> bytes or None:
+        """
+        Read the results of a parsed chunk.
+        :param job_id: Id of the job.
+        :param chunk: Position of the chunk in the job.
+        :return: NDJSON result lines of the chunk, or None when it isn't parsed or doesn't exist.
+        """
+        with self.__connect() as connection:
+            row = connection.execute(
+                "SELECT results FROM chunks WHERE job_id = ? AND chunk = ? AND status = 'done'", (job_id, chunk)
+            ).fetchone()
+        return zlib.decompress(row[0]) if row is not None else None
+
+    def pending_numbers(self) -> int:
+        """
+        Count the tracking numbers waiting to be parsed or being parsed, across all jobs.
+        :return: The count.
+        """
+        with self.__connect() as connection:
+            return connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM chunks WHERE status IN ('pending', 'running')"
+            ).fetchone()[0]
+
+
+def job_status(row: sqlite3.Row, now: float) -> dict:
+    """
+    Describe a job from its database row.
+    :param row: Row of the jobs table.
+    :param now: time.time() value the job's progress is measured at.
+    :return: Dictionary of the job's id, status, progress and throughput.
+    """
+    if row["error"] is not None:
+        status = "failed"
+    elif row["finished_at"] is not None:
+        status = "done"
+    elif row["uploaded_at"] is None:
+        status = "uploading"
+    elif row["started_at"] is not None:
+        status = "running"
+    else:
+        status = "queued"
+    total, processed = row["total"], row["processed"]
+    elapsed = (row["finished_at"] or now) - row["started_at"] if row["started_at"] is not None else 0
+    throughput = processed / elapsed if processed and elapsed > 0 else None
+    return {
+        "id": row["id"],
+        "status": status,
+        "total": total,
+        "processed": processed,
+        "found": row["found"],
+        "progress": processed / total if total else float(status == "done"),
+        "numbersPerSecond": throughput,
+        "parseNumbersPerSecond": processed / row["parse_seconds"] if row["parse_seconds"] > 0 else None,
+        "etaSeconds": (total - processed) / throughput if status == "running" and throughput else None,
+        "createdAt": row["created_at"],
+        "startedAt": row["started_at"],
+        "finishedAt": row["finished_at"],
+        "error": row["error"],
+    }
+
+
+async def iter_decompressed(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Decompress a streamed body if it is gzip, recognised by its magic bytes, and pass it through as is otherwise.
+    Concatenated gzip members are decompressed one after the other, like gunzip does.
+    :param chunks: Async iterator of body chunks, eg. request.stream().
+    :return: Async iterator of the decompressed chunks.
+    :raises zlib.error: If the gzip data is corrupt or truncated.
+    """
+    chunks = chunks.__aiter__()
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= len(_GZIP_MAGIC):
+            break
+    if not head.startswith(_GZIP_MAGIC):
+        if head:
+            yield head
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    started = False
+    data = head
+    while True:
+        while data:
+            started = True
+            output = decompressor.decompress(data, _DECOMPRESS_SIZE)
+            if output:
+                yield output
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                started = False
+            else:
+                data = decompressor.unconsumed_tail
+        try:
+            data = await chunks.__anext__()
+        except StopAsyncIteration:
+            break
+    if started:
+        raise zlib.error("Truncated gzip body")
+
+
+async def upload_job(store: JobStore, chunks: AsyncIterator[bytes]) -> str:
+    """
+    Create a job from a streamed body of tracking numbers, one per line and optionally gzip compressed. The numbers are
+    queued chunk by chunk as they arrive, the body is never held in memory as a whole.
+    :param store: JobStore to queue the job in.
+    :param chunks: Async iterator of body chunks, eg. request.stream().
+    :return: Id of the job.
+    :raises JobTooLarge: If the body holds more than JOB_MAX_SIZE tracking numbers.
+    :raises ValueError: If a line is longer than JOB_MAX_LINE_LENGTH.
+    :raises zlib.error: If the gzip data is corrupt or truncated.
+    """
+    job_id = await run_in_threadpool(store.create_job)
+    try:
+        numbers = []
+        chunk = 0
+        total = 0
+        async for line in iter_lines(iter_decompressed(chunks), JOB_MAX_LINE_LENGTH):
+            if total == JOB_MAX_SIZE:
+                raise JobTooLarge(f"Job size limit of {JOB_MAX_SIZE} tracking numbers exceeded")
+            numbers.append(line)
+            total += 1
+            if len(numbers) == JOB_CHUNK_SIZE:
+                await run_in_threadpool(store.add_chunk, job_id, chunk, total - len(numbers), numbers)
+                chunk += 1
+                numbers = []
+        if numbers:
+            await run_in_threadpool(store.add_chunk, job_id, chunk, total - len(numbers), numbers)
+        await run_in_threadpool(store.finish_upload, job_id)
+    except BaseException:
+        # The client never learns the id of a job whose upload failed, so it is dropped whole.
+        await run_in_threadpool(store.delete_job, job_id)
+        raise
+    return job_id
+
+
+def run_worker(path: str, stop):
+    """
+    Claim and parse job chunks until stopped, deleting expired jobs when there is nothing to parse.
+    :param path: Path of the job database.
+    :param stop: multiprocessing.Event set to stop the worker, it finishes the chunk at hand first.
+    :return: None
+    """
+    # Stopping is up to the process that started the worker, a Ctrl-C in the terminal reaches it too.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    store = JobStore(path)
+    # Job numbers are parsed once each, caching them would only evict the shared cache of the API workers.
+    parse_manager = ParseManager(snapshot=load_snapshot(), workers=1, cache=ResultCache(0))
+    worker = uuid.uuid4().hex
+    purged_at = 0
+    while not stop.is_set():
+        claim = store.claim_chunk(worker)
+        if claim is None:
+            if time.monotonic() - purged_at > JOB_PURGE_INTERVAL:
+                store.purge(time.time() - JOB_RETENTION)
+                purged_at = time.monotonic()
+            stop.wait(JOB_POLL_INTERVAL)
+            continue
+        started = time.perf_counter()
+        try:
+            results, found = batch_lines(claim.numbers, claim.start, parse_manager)
+        except Exception as e:
+            logger.exception("Chunk %d of job %s failed", claim.chunk, claim.job_id)
+            store.fail_job(claim.job_id, f"Chunk {claim.chunk} failed: {e!r}")
+            continue
+        store.complete_chunk(claim, worker, results, found, time.perf_counter() - started)
+
+
+class JobWorkers:
+    """
+    Job worker processes. They are spawned rather than forked, so they start clean of the parent's threads and event
+    loop, and build their own parse engine.
+    """
+
+    def __init__(self, count: int = JOB_WORKERS, path: str = JOB_DATABASE):
+        context = multiprocessing.get_context("spawn")
+        self.stop_event = context.Event()
+        self.processes = [
+            context.Process(target=run_worker, args=(path, self.stop_event), name=f"job-worker-{index}", daemon=True)
+            for index in range(count)
+        ]
+
+    def start(self):
+        """
+        Start the workers.
+        :return: None
+        """
+        for process in self.processes:
+            process.start()
+
+    def stop(self, timeout: float = JOB_STOP_TIMEOUT):
+        """
+        Stop the workers, terminating the ones that don't finish their chunk in time. Their chunks are taken over
+        once the lease runs out.
+        :param timeout: Seconds the workers get to stop.
+        :return: None
+        """
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process.pid is None:
+                continue
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def main(argv: list = None):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m app.jobs", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    arg_parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1), help="Worker processes to run")
+    arg_parser.add_argument("--database", default=JOB_DATABASE, help="Job database")
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    workers = JobWorkers(args.workers, args.database)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    workers.start()
+    try:
+        while not stopping and any(process.is_alive() for process in workers.processes):
+            time.sleep(JOB_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        workers.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,98 @@
-import pkgutil
-from fastapi import FastAPI
-from app.routers import tracking
+import os
+from contextlib import asynccontextmanager
 
-app = FastAPI(version="v0.1")
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from app import metrics
+from app.carrier_registry import CARRIER_CACHE_MAX_AGE, CarrierRegistry, StaticResource
+from app.jobs import JOB_WORKERS, JobWorkers
+from app.result_cache import ResultCache
+from app.routers import jobs, tracking
+
+
+# Whether the lifespan starts the bulk job workers. The pre-fork server starts them once in its master instead, see
+#   gunicorn.conf.py.
+start_job_workers = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Run the bulk job workers alongside the API, when JOB_WORKERS asks for them, and publish the metrics of the process
+    when it is one of several serving the API, see METRICS_DIR.
+    """
+    publisher = metrics.MetricsPublisher() if metrics.METRICS_DIR else None
+    workers = JobWorkers(JOB_WORKERS) if start_job_workers and JOB_WORKERS else None
+    if publisher is not None:
+        publisher.start()
+    if workers is not None:
+        workers.start()
+    try:
+        yield
+    finally:
+        if workers is not None:
+            workers.stop()
+        if publisher is not None:
+            publisher.stop()
+
+
+app = FastAPI(version="v0.1", lifespan=lifespan)
+if tracking.engine_snapshot is not None:
+    registry = tracking.engine_snapshot.registry
+else:
+    registry = CarrierRegistry(tracking.parse_manager.parsers)
 
 @app.get("/status")
 async def status():
     """
     Endpoint to check the status of the API.
 
-    - **results** A JSON object containing the version of the application and its operational status.
+    - **results** A JSON object containing the version of the application, its operational status, the process id of
+    the worker that answered and its parse result cache statistics. Under the multi-worker server every worker has
+    statistics of its own.
     Example response:
     {
         "version": "1.0.0",
-        "status": true
+        "status": true,
+        "worker": 8,
+        "cache": {
+            "hits": 120,
+            "misses": 30,
+            "evictions": 0,
+            "hitRate": 0.8,
+            "size": 30,
+            "capacity": 100000
+        }
     }
     """
     return {
         "version": app.version,
         "status": True,
+        "worker": os.getpid(),
+        "cache": tracking.parse_manager.cache.stats(),
     }
 
 
+def static_json(request: Request, resource: StaticResource) -> Response:
+    """
+    Serve a precomputed JSON document with caching headers, answering 304 when the client already has it.
+    :param request: The incoming request.
+    :param resource: The document to serve.
+    :return: The response.
+    """
+    headers = {"ETag": resource.etag, "Cache-Control": f"public, max-age={CARRIER_CACHE_MAX_AGE}"}
+    if resource.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(resource.body, media_type="application/json", headers=headers)
+
+
 @app.get("/carriers")
-async def carriers():
+async def carriers(request: Request):
     """
     Endpoint to retrieve the list of all carriers that currently have their own parsers and are supported.
 
-    - **results** A list of strings representing the names of all carriers with implemented parsers.
+    - **results** A list of strings representing the names of all carriers with implemented parsers. The response
+    carries an ETag and Cache-Control header and is answered with 304 Not Modified when If-None-Match matches.
     Example response:
     [
         "FedEx",
@@ -35,11 +100,77 @@ async def carriers():
         "UPS"
     ]
     """
-    ret = []
-    for finder, name, ispkg in pkgutil.iter_modules(['app/parsers']):
-        if name != 'base_parser' and name != 'BaseParser':
-            ret.append(name)
-    return ret
+    return static_json(request, registry.names)
+
+
+@app.get("/carriers/{carrier}")
+async def carrier(carrier: str, request: Request):
+    """
+    Endpoint to retrieve what a carrier's tracking numbers look like.
+
+    - **carrier**: Id or name of the carrier, case insensitive, eg. `fedex` or `united-states-postal-service`.
+
+    - **results** A JSON object describing the carrier, cached like /carriers.
+    Example response:
+    {
+        "id": "amazon",
+        "name": "Amazon",
+        "trackingUrlTemplate": "https://track.amazon.com/tracking/0?trackingId=%s",
+        "lengths": [15],
+        "prefixes": ["TBA"],
+        "formats": [{"name": "Amazon", "lengths": [15], "prefixes": ["TBA"]}]
+    }
+    """
+    resource = registry.get(carrier)
+    if resource is None:
+        raise HTTPException(status_code=404, detail="Carrier not found")
+    return static_json(request, resource)
+
+
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "tracking_cache_hits_total", "Parse result cache hits.", "counter",
+    lambda: tracking.parse_manager.cache.stats()["hits"]
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "tracking_cache_misses_total", "Parse result cache misses.", "counter",
+    lambda: tracking.parse_manager.cache.stats()["misses"]
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "tracking_cache_evictions_total", "Parse results evicted from the cache.", "counter",
+    lambda: tracking.parse_manager.cache.stats()["evictions"]
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "tracking_parse_requests_in_flight", "Tracking requests being parsed or waiting for a parse thread.", "gauge",
+    lambda: tracking.parse_executor.pending
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "tracking_job_numbers_pending", "Tracking numbers of bulk jobs waiting to be parsed or being parsed.", "gauge",
+    # No bulk job was touched by this process while the store doesn't exist, reading it would create the database.
+    lambda: jobs.job_store.pending_numbers() if jobs.job_store is not None else 0,
+    shared=True
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "tracking_cache_size", "Parse results currently held in the cache.", "gauge",
+    lambda: len(tracking.parse_manager.cache),
+    shared=not isinstance(tracking.parse_manager.cache, ResultCache)
+))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Endpoint exposing the API's metrics in the Prometheus text format.
+
+    - **results** Per parser call, match, reject and exception counters and latency histograms, request latency and
+    batch size histograms per tracking endpoint, and the parse result cache counters. Under the multi-worker server the
+    metrics of all the workers are added up, those of the other workers as of a few seconds ago.
+    Example response:
+    # HELP tracking_parser_matches_total Tracking numbers a parser recognised.
+    # TYPE tracking_parser_matches_total counter
+    tracking_parser_matches_total{parser="UPSParser"} 42
+    """
+    return PlainTextResponse(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
 
 
+app.include_router(jobs.router, prefix="/track/jobs", tags=["Jobs"])
 app.include_router(tracking.router, prefix="/track", tags=["Tracking"])
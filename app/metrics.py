@@ -0,0 +1,459 @@
+"""
+Minimal in-process metrics exported in the Prometheus text exposition format.
+
+Metrics with labels hand out a child per label combination through labels(). Hot paths should look their children up
+once and keep them around, updating a child is a lock and an addition.
+
+Under the pre-fork server every worker process keeps its own metrics and publishes them to a file of METRICS_DIR, so
+whichever worker answers GET /metrics can render the metrics of all of them, see render_metrics.
+"""
+import abc
+import bisect
+import glob
+import os
+import threading
+import time
+from typing import Callable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Directory the worker processes of the pre-fork server publish their metrics to, empty when the process serves alone.
+#   gunicorn.conf.py sets it.
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+# Seconds between two publications of a worker's metrics, the delay with which the other workers see them.
+METRICS_PUBLISH_INTERVAL = float(os.environ.get("METRICS_PUBLISH_INTERVAL", 5))
+
+# Latency buckets in seconds, from a microsecond up to a few seconds.
+LATENCY_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# Batch size buckets, in tracking numbers.
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        Get the child metric for a combination of label values, creating it on first use.
+        :param values: One value per label name.
+        :return: The child metric.
+        """
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        pass
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    @abc.abstractmethod
+    def _render_child(self, values: tuple, child) -> list:
+        pass
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def values(self) -> dict:
+        """
+        Read the counter of every label combination.
+        :return: Dictionary of label values to count.
+        """
+        return {values: child.value for values, child in list(self._children.items())}
+
+    def _render_child(self, values: tuple, child) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket, not cumulative until rendered.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values: tuple, child) -> list:
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(float(bound))}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Metric whose value is read from a callback when the metrics are rendered, eg. statistics another object keeps.
+    A shared metric reads a value every process sees the same, eg. from a database, which is reported once instead of
+    summed over the processes.
+    """
+
+    def __init__(self, name: str, documentation: str, type_name: str, callback: Callable[[], float],
+                 shared: bool = False):
+        self.name = name
+        self.documentation = documentation
+        self.type_name = type_name
+        self.callback = callback
+        self.shared = shared
+
+    def render(self) -> list:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            f"{self.name} {_format_value(self.callback())}",
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """
+        Register a metric, replacing any previous metric of the same name.
+        :param metric: The metric to register.
+        :return: The metric.
+        """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every registered metric in the Prometheus text exposition format.
+        :return: String of the exposition.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+PARSER_CALLS = REGISTRY.register(Counter(
+    "tracking_parser_calls_total", "Tracking numbers handed to a parser by the dispatch index.", ("parser",)
+))
+PARSER_MATCHES = REGISTRY.register(Counter(
+    "tracking_parser_matches_total", "Tracking numbers a parser recognised.", ("parser",)
+))
+PARSER_REJECTS = REGISTRY.register(Counter(
+    "tracking_parser_rejects_total", "Tracking numbers a parser was handed but did not recognise, or raised on.",
+    ("parser",)
+))
+PARSER_EXCEPTIONS = REGISTRY.register(Counter(
+    "tracking_parser_exceptions_total", "Exceptions raised by a parser while parsing a tracking number.",
+    ("parser", "exception")
+))
+PARSER_DURATION = REGISTRY.register(Histogram(
+    "tracking_parser_duration_seconds", "Time a parser took to parse a single tracking number.", ("parser",)
+))
+BATCH_DURATION = REGISTRY.register(Histogram(
+    "tracking_parse_batch_duration_seconds", "Time ParseManager.parse_batch spent parsing the uncached tracking numbers of a batch."
+))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "tracking_request_duration_seconds", "End to end time of tracking requests.", ("endpoint",)
+))
+REQUEST_REJECTED = REGISTRY.register(Counter(
+    "tracking_requests_rejected_total", "Tracking requests answered 429 because parsing was saturated.", ("endpoint",)
+))
+REQUEST_BATCH_SIZE = REGISTRY.register(Histogram(
+    "tracking_request_batch_size", "Tracking numbers per tracking request.", ("endpoint",), BATCH_SIZE_BUCKETS
+))
+REQUEST_DEDUPLICATED = REGISTRY.register(Counter(
+    "tracking_request_deduplicated_total",
+    "Tracking numbers answered with the results of an identical number earlier in the same request.", ("endpoint",)
+))
+REQUEST_COALESCED = REGISTRY.register(Counter(
+    "tracking_requests_coalesced_total",
+    "Tracking requests answered with the results of an identical request that was already being parsed.", ("endpoint",)
+))
+
+
+class ParserMetrics:
+    """
+    The metric children of one parser, looked up once so recording an outcome doesn't touch the label dictionaries.
+    The counters are only ever updated through this object, so a single lock covers the three of them and every
+    tracking number handed to the parser is a match or a reject: calls = matches + rejects. The latency histogram is
+    read when rendered, so it is updated under its own lock.
+    """
+    __slots__ = ("calls", "matches", "rejects", "duration", "parser_name", "_lock")
+
+    def __init__(self, parser_name: str):
+        self.parser_name = parser_name
+        self.calls = PARSER_CALLS.labels(parser_name)
+        self.matches = PARSER_MATCHES.labels(parser_name)
+        self.rejects = PARSER_REJECTS.labels(parser_name)
+        self.duration = PARSER_DURATION.labels(parser_name)
+        self._lock = threading.Lock()
+
+    def record(self, matched: bool, seconds: float = None, count: int = 1):
+        """
+        Record the outcome of handing tracking numbers to the parser.
+        :param matched: Whether the parser recognised the tracking numbers.
+        :param seconds: Time the parser took for a single tracking number, None when it wasn't timed.
+        :param count: Number of tracking numbers with this outcome.
+        :return: None
+        """
+        duration = self.duration
+        index = bisect.bisect_left(duration.buckets, seconds) if seconds is not None else None
+        with self._lock:
+            self.calls.value += count
+            if matched:
+                self.matches.value += count
+            else:
+                self.rejects.value += count
+        if index is not None:
+            with duration._lock:
+                duration.counts[index] += 1
+                duration.sum += seconds
+
+    def exception(self, error: Exception):
+        """
+        Record an exception raised by the parser, which the ParseManager otherwise swallows. The tracking number
+        counts as rejected.
+        :param error: The exception.
+        :return: None
+        """
+        with self._lock:
+            self.calls.value += 1
+            self.rejects.value += 1
+        PARSER_EXCEPTIONS.labels(self.parser_name, type(error).__name__).inc()
+
+    def counts(self) -> tuple:
+        """
+        Read the parser's counters.
+        :return: Tuple of the call, match and reject counts.
+        """
+        with self._lock:
+            return self.calls.value, self.matches.value, self.rejects.value
+
+    def merge(self, calls: int, matches: int, rejects: int):
+        """
+        Add counts recorded elsewhere, eg. by a worker process of the ParseManager's pool. Their latency isn't timed.
+        :param calls: Number of tracking numbers handed to the parser.
+        :param matches: Number of them the parser recognised.
+        :param rejects: Number of them the parser rejected or raised on.
+        :return: None
+        """
+        with self._lock:
+            self.calls.value += calls
+            self.matches.value += matches
+            self.rejects.value += rejects
+
+
+class Timer:
+    """
+    Context manager observing the time spent inside it on a histogram child.
+    """
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+def _parse_exposition(text: str) -> dict:
+    """
+    Read the samples back from a rendered exposition.
+    :param text: String rendered by Registry.render.
+    :return: Dictionary of the metric names to their type and a dictionary of their series to the sample values.
+    """
+    metrics = {}
+    samples = None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, type_name = line.split(" ", 3)
+            samples = {}
+            metrics[name] = (type_name, samples)
+        elif line and not line.startswith("#") and samples is not None:
+            series, value = line.rsplit(" ", 1)
+            try:
+                samples[series] = int(value)
+            except ValueError:
+                samples[series] = float(value)
+    return metrics
+
+
+def publish_metrics(registry: Registry = REGISTRY, directory: str = METRICS_DIR, exiting: bool = False):
+    """
+    Write the metrics of this process to its file of the metrics directory, replacing the file atomically.
+    :param registry: Registry of the metrics.
+    :param directory: The metrics directory.
+    :param exiting: Whether the process is exiting, its gauges are left out then and only its counts remain.
+    :return: None
+    """
+    text = registry.render()
+    if exiting:
+        text = "\n".join(
+            f"# TYPE {name} {type_name}\n" + "\n".join(f"{series} {value}" for series, value in samples.items())
+            for name, (type_name, samples) in _parse_exposition(text).items() if type_name != "gauge"
+        )
+    path = os.path.join(directory, f"{os.getpid()}.prom")
+    with open(f"{path}.tmp", "w") as file:
+        file.write(text)
+    os.replace(f"{path}.tmp", path)
+
+
+class MetricsPublisher:
+    """
+    Thread publishing the metrics of a worker process every METRICS_PUBLISH_INTERVAL seconds, and once more when the
+    worker stops.
+    """
+
+    def __init__(self, registry: Registry = REGISTRY, directory: str = METRICS_DIR,
+                 interval: float = METRICS_PUBLISH_INTERVAL):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name="metrics-publisher", daemon=True)
+
+    def start(self):
+        """
+        Start publishing.
+        :return: None
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop publishing, leaving the counts of the process for the other processes to report.
+        :return: None
+        """
+        self.stop_event.set()
+        self.thread.join()
+        publish_metrics(self.registry, self.directory, exiting=True)
+
+    def __run(self):
+        while not self.stop_event.is_set():
+            publish_metrics(self.registry, self.directory)
+            self.stop_event.wait(self.interval)
+
+
+def render_metrics(registry: Registry = REGISTRY, directory: str = METRICS_DIR) -> str:
+    """
+    Render the metrics of every process publishing to the metrics directory, or of this process alone without one.
+    The samples of this process are read live and the published samples of the other processes are added to them.
+    Counters and histograms of processes that exited still count, so the totals never go down. Gauges only count for
+    the processes still publishing, and shared metrics are reported once.
+    :param registry: Registry of the metrics.
+    :param directory: The metrics directory, empty for none.
+    :return: String of the exposition.
+    """
+    if not directory:
+        return registry.render()
+    metrics = _parse_exposition(registry.render())
+    own = os.path.join(directory, f"{os.getpid()}.prom")
+    for path in glob.glob(os.path.join(directory, "*.prom")):
+        if path == own:
+            continue
+        try:
+            with open(path) as file:
+                text = file.read()
+            # A worker that was killed stops refreshing its file.
+            live = time.time() - os.stat(path).st_mtime < 3 * METRICS_PUBLISH_INTERVAL
+        except OSError:
+            continue
+        for name, (type_name, samples) in _parse_exposition(text).items():
+            metric = registry.metrics.get(name)
+            if metric is None or getattr(metric, "shared", False) or (type_name == "gauge" and not live):
+                continue
+            merged = metrics[name][1]
+            for series, value in samples.items():
+                merged[series] = merged.get(series, 0) + value
+    lines = []
+    for name, (type_name, samples) in metrics.items():
+        lines.append(f"# HELP {name} {registry.metrics[name].documentation}")
+        lines.append(f"# TYPE {name} {type_name}")
+        lines.extend(f"{series} {_format_value(value)}" for series, value in samples.items())
+    return "\n".join(lines) + "\n"
@@ -7,6 +7,7 @@ class TrackingResponse(BaseModel):
     carriers: List[str]
     results: list
     trackingUrl: Optional[List[str]]
+    deduplicated: int = 0
 
 class StatusResponse(BaseModel):
     status: str
@@ -1,35 +1,535 @@
-import importlib
-import pkgutil
-from app.parsers.base_parser import BaseParser
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError
+from typing import TYPE_CHECKING, Optional
+
+from app.carrier_registry import carrier_id, load_parsers
+from app.metrics import BATCH_DURATION, PARSER_EXCEPTIONS, ParserMetrics, Timer
+from app.parsers.base_parser import FormatMatch, canonicalize
+from app.result_cache import ResultCache, create_result_cache
+
+if TYPE_CHECKING:
+    from app.snapshot import EngineSnapshot
+
+# Number of worker processes large batches are spread across, 1 keeps all parsing in-process.
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 1))
+# Batches with fewer uncached tracking numbers than this are parsed in-process.
+PARALLEL_BATCH_THRESHOLD = int(os.environ.get("PARALLEL_BATCH_THRESHOLD", 20_000))
+# Number of tracking numbers sent to a worker process at a time.
+PARALLEL_CHUNK_SIZE = int(os.environ.get("PARALLEL_CHUNK_SIZE", 5_000))
+# Longest tracking number accepted, separators included. Longer input is never handed to the patterns, the longest
+#   format is 41 characters once canonicalized.
+MAX_TRACKING_NUMBER_LENGTH = int(os.environ.get("MAX_TRACKING_NUMBER_LENGTH", 128))
+# Seconds a request may spend parsing before it is rejected, 0 disables the budget. Streaming endpoints apply it to
+#   every chunk they parse.
+PARSE_TIME_BUDGET = float(os.environ.get("PARSE_TIME_BUDGET", 1.0))
+# Number of first match parses between two re-rankings of the parsers by their observed hit rate.
+PARSER_REORDER_INTERVAL = int(os.environ.get("PARSER_REORDER_INTERVAL", 10_000))
+
+# Parse modes: every carrier that recognises a tracking number, or only the most likely one.
+MODE_ALL = "all"
+MODE_FIRST = "first"
+PARSE_MODES = (MODE_ALL, MODE_FIRST)
+# Carriers tried first in first match mode, by canonical length, for the lengths where formats of several carriers
+#   overlap. Precedence decides the answer when a number is valid for more than one of them, the observed hit rates
+#   only order the carriers it doesn't list.
+#   12: FedEx Express ahead of DHL eCommerce, whose numbers of this length carry a two letter prefix.
+#   22: USPS IMpb (91 to 95) ahead of FedEx Ground (96).
+#   24, 26 and 34: FedEx SmartPost ahead of USPS IMpb. SmartPost numbers are IMpb numbers with service type 29 and
+#   FedEx's check digit, so the more specific format wins.
+CARRIER_PRECEDENCE = {
+    12: ("fedex", "dhl"),
+    22: ("united-states-postal-service", "fedex"),
+    24: ("fedex", "united-states-postal-service"),
+    26: ("fedex", "united-states-postal-service"),
+    34: ("fedex", "united-states-postal-service"),
+}
+
+# ParseManager preloaded by each worker process of the pool.
+_worker_manager = None
+
+
+class ParseBudgetExceeded(Exception):
+    """
+    Raised when parsing runs past the deadline it was given.
+    """
+
+
+def parse_deadline(budget: float = PARSE_TIME_BUDGET) -> float or None:
+    """
+    Turn a parse time budget into a deadline for the ParseManager.
+    :param budget: Seconds parsing may take, 0 for no limit.
+    :return: time.perf_counter() value parsing has to finish by, or None for no limit.
+    """
+    return time.perf_counter() + budget if budget > 0 else None
+
+
+def check_deadline(deadline: float or None):
+    """
+    Raise if a deadline has passed.
+    :param deadline: time.perf_counter() value, or None for no limit.
+    :return: None
+    :raises ParseBudgetExceeded: If the deadline has passed.
+    """
+    if deadline is not None and time.perf_counter() > deadline:
+        raise ParseBudgetExceeded("Parse time budget exceeded")
+
+
+def _init_worker(snapshot=None):
+    """
+    Process pool initializer, loads the parsers once per worker process.
+    :param snapshot: Optional EngineSnapshot the parent process was started from.
+    :return: None
+    """
+    global _worker_manager
+    # The parent caches the results, a worker only ever sees the chunks that missed its cache.
+    _worker_manager = ParseManager(workers=1, snapshot=snapshot, cache=ResultCache(0))
+
+
+def _parse_chunk(tracking_numbers: list) -> tuple:
+    """
+    Parse a chunk of a batch inside a worker process.
+    :param tracking_numbers: List of tracking number strings.
+    :return: Tuple of the list with the list of results for each tracking number, in input order, and the parser
+        counters parsing the chunk added, see ParseManager.merge_counters.
+    """
+    before = _worker_manager.counters()
+    response = _worker_manager.parse_batch(tracking_numbers)
+    added = {key: count - before.get(key, 0) for key, count in _worker_manager.counters().items()}
+    return response, {key: count for key, count in added.items() if count}
 
 
 class ParseManager:
-    def __init__(self):
+    def __init__(self, cache: ResultCache = None, workers: int = PARSE_WORKERS,
+                 parallel_threshold: int = PARALLEL_BATCH_THRESHOLD, chunk_size: int = PARALLEL_CHUNK_SIZE,
+                 max_length: int = MAX_TRACKING_NUMBER_LENGTH, reorder_interval: int = PARSER_REORDER_INTERVAL,
+                 snapshot: Optional["EngineSnapshot"] = None):
+        self.cache = cache if cache is not None else create_result_cache()
+        self.max_length = max_length
+        self.reorder_interval = reorder_interval
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.pool_lock = threading.Lock()
         self.parsers = []
-        self.__load_parsers()
+        self.dispatch_index = {}
+        self.prefix_lengths = {}
+        # EngineSnapshot the parsers and the dispatch index were taken from, see app.snapshot, None when they were
+        #   built from the carrier definitions.
+        self.snapshot = snapshot
+        if snapshot is None:
+            self.__load_parsers()
+            self.__build_dispatch_index()
+        else:
+            self.parsers.extend(snapshot.parsers)
+            self.dispatch_index = snapshot.dispatch_index
+            self.prefix_lengths = snapshot.prefix_lengths
+        self.parser_metrics = {parser: ParserMetrics(parser.name) for parser in self.parsers}
+        # Position of each parser in first match mode, updated from the hit rates every reorder_interval parses.
+        self.parser_rank = {parser: rank for rank, parser in enumerate(self.parsers)}
+        self.precedence = {
+            length: {
+                parser: carriers.index(carrier_id(parser.carrier_name))
+                for parser in self.parsers if carrier_id(parser.carrier_name) in carriers
+            }
+            for length, carriers in CARRIER_PRECEDENCE.items()
+        }
+        # Formats whose match alone is conclusive: the check digit was verified, or the number carries one of the
+        #   carrier's own prefixes. First match mode keeps looking when a number only matched other formats.
+        self.confident_formats = {
+            id(tracking_format)
+            for parser in self.parsers for tracking_format in parser.formats
+            if tracking_format.checksum is not None or all(prefix for length, prefix in tracking_format.dispatch_keys)
+        }
+        self.__first_parses = 0
+        # Parses run on several threads, the count and the re-ranking it triggers are shared.
+        self.__reorder_lock = threading.Lock()
 
     def __load_parsers(self):
         """
         Set up the engine with all the current parsers currently available
         :return: None
         """
-        for finder, name, ispkg in pkgutil.iter_modules(['app/parsers']):
-            if name != 'base_parser' and name != 'BaseParser':
-                module = importlib.import_module(f'app.parsers.{name}')
-                for attr in dir(module):
-                    parser_class = getattr(module, attr)
-                    if isinstance(parser_class, type) and issubclass(parser_class, BaseParser) and attr != 'BaseParser':
-                        parser_instance = parser_class()
-                        self.parsers.append(parser_instance)
+        self.parsers.extend(load_parsers())
+
+    def __build_dispatch_index(self):
+        """
+        Index every format of the loaded parsers by the canonical length and leading characters of the numbers it can
+        match. The index maps length -> prefix -> (parser, format) pairs, along with the distinct prefix lengths
+        registered for each length so a lookup only slices the number a handful of times.
+        :return: None
+        """
+        for parser in self.parsers:
+            for tracking_format in parser.formats:
+                for length, prefix in tracking_format.dispatch_keys:
+                    prefixes = self.dispatch_index.setdefault(length, {})
+                    candidates = prefixes.setdefault(prefix, [])
+                    if (parser, tracking_format) not in candidates:
+                        candidates.append((parser, tracking_format))
+        self.prefix_lengths = {
+            length: sorted({len(prefix) for prefix in prefixes})
+            for length, prefixes in self.dispatch_index.items()
+        }
+
+    def candidate_formats(self, tracking_number: str) -> list:
+        """
+        Look up the formats that could accept a tracking number, grouped by parser in the order they were loaded.
+        :param tracking_number: String of the tracking number to dispatch.
+        :return: List of (parser, formats) tuples whose patterns can match the tracking number's length and prefix.
+        """
+        return self.__dispatch(canonicalize(tracking_number))
+
+    def __dispatch(self, key: str) -> list:
+        """
+        Look up the candidate formats of a tracking number already in canonical form, see candidate_formats.
+        :param key: Canonical tracking number.
+        :return: List of (parser, formats) tuples.
+        """
+        prefixes = self.dispatch_index.get(len(key))
+        if not prefixes:
+            return []
+        candidates = {}
+        for prefix_length in self.prefix_lengths[len(key)]:
+            for parser, tracking_format in prefixes.get(key[:prefix_length], ()):
+                candidates.setdefault(parser, []).append(tracking_format)
+        return [
+            (parser, sorted(formats, key=parser.formats.index))
+            for parser, formats in sorted(candidates.items(), key=lambda item: self.parsers.index(item[0]))
+        ]
+
+    def parse(self, tracking_number: str, mode: str = MODE_ALL) -> list:
+        """
+        Parse a single tracking number with every parser that could accept it. The number is canonicalized once up
+        front, and results are served from the cache when the same canonical number was parsed before, so callers must
+        not modify the lists. Numbers longer than max_length aren't parsed at all.
+        :param tracking_number: String of the tracking number to parse.
+        :param mode: MODE_ALL for every carrier that recognises the number, MODE_FIRST to stop at the first confident
+            match, trying the parsers in the order given by CARRIER_PRECEDENCE and their observed hit rates.
+        :return: List of ParseResult objects, one per carrier that recognised the number, at most one in MODE_FIRST.
+        :raises ValueError: If the mode is unknown.
+        """
+        if mode not in PARSE_MODES:
+            raise ValueError(f"Unknown parse mode {mode!r}")
+        if len(tracking_number) > self.max_length:
+            return []
+        return self.__parse_cached(canonicalize(tracking_number), mode)
+
+    def __parse_cached(self, key: str, mode: str) -> list:
+        """
+        Parse a canonical tracking number unless its results are cached, see parse.
+        :param key: Canonical tracking number.
+        :param mode: MODE_ALL or MODE_FIRST.
+        :return: List of ParseResult objects.
+        """
+        cache_key = key if mode == MODE_ALL else (mode, key)
+        response = self.cache.get(cache_key)
+        if response is None:
+            response = self.__parse(key) if mode == MODE_ALL else self.__parse_first(key)
+            self.cache.put(cache_key, response)
+        return response
+
+    def first_match_order(self, tracking_number: str, candidates: list) -> list:
+        """
+        Order the candidate parsers of a tracking number for first match mode: the carriers CARRIER_PRECEDENCE lists for
+        the number's length come first, in that order, then the others by observed hit rate.
+        :param tracking_number: Canonical tracking number.
+        :param candidates: List of (parser, formats) tuples as returned by candidate_formats.
+        :return: The candidates, reordered.
+        """
+        if len(candidates) < 2:
+            return candidates
+        rank = self.parser_rank
+        precedence = self.precedence.get(len(tracking_number))
+        if precedence:
+            return sorted(candidates, key=lambda item: (precedence.get(item[0], len(precedence)), rank[item[0]]))
+        return sorted(candidates, key=lambda item: rank[item[0]])
+
+    def update_parser_order(self):
+        """
+        Rank the parsers by their observed hit rate, the share of the tracking numbers handed to them that they
+        recognised, so first match mode tries the likeliest carrier first. The rates are smoothed so a parser that has
+        seen little traffic sits in the middle, ties keep the load order.
+        :return: None
+        """
+        def hit_rate(parser):
+            parser_metrics = self.parser_metrics[parser]
+            return (parser_metrics.matches.value + 1) / (parser_metrics.calls.value + 2)
+
+        ranked = sorted(self.parsers, key=hit_rate, reverse=True)
+        self.parser_rank = {parser: rank for rank, parser in enumerate(ranked)}
 
-    def get_parsers(self, tracking_numbers):
+    def parse_batch(self, tracking_numbers, deadline: float = None, duplicates: list = None) -> list:
+        """
+        Parse a batch of tracking numbers, only parsing the ones missing from the cache. Numbers that canonicalize to
+        the same number are looked up and parsed once, their results are shared by every occurrence. When enough
+        numbers are missing the batch is split into chunks and spread across the worker process pool. Numbers longer
+        than max_length get no results without being parsed.
+        :param tracking_numbers: List of tracking number strings.
+        :param deadline: Optional time.perf_counter() value parsing has to finish by, see parse_deadline.
+        :param duplicates: Optional list the positions of the numbers answered with the results of an identical number
+            earlier in the batch are appended to.
+        :return: List with the list of results for each tracking number, in input order.
+        :raises ParseBudgetExceeded: If parsing runs past the deadline.
+        """
+        keys = [
+            canonicalize(tracking_number) if len(tracking_number) <= self.max_length else None
+            for tracking_number in tracking_numbers
+        ]
+        first = {}
+        for position, key in enumerate(keys):
+            if key is not None and first.setdefault(key, position) != position and duplicates is not None:
+                duplicates.append(position)
+        response = [[] for _ in keys]
+        for key, position in first.items():
+            response[position] = self.cache.get(key)
+        misses = [position for position in first.values() if response[position] is None]
+        with Timer(BATCH_DURATION.labels()):
+            if self.workers > 1 and len(misses) >= self.parallel_threshold:
+                parsed = self.__parse_parallel([keys[position] for position in misses], deadline)
+            else:
+                parsed = self.__parse_batch([keys[position] for position in misses], deadline)
+        for position, results in zip(misses, parsed):
+            response[position] = results
+            self.cache.put(keys[position], results)
+        if len(first) < len(keys):
+            for position, key in enumerate(keys):
+                if key is not None:
+                    response[position] = response[first[key]]
+        return response
+
+    def __parse_parallel(self, tracking_numbers: list, deadline: float = None) -> list:
+        """
+        Parse a batch of tracking numbers across the worker process pool, bypassing the cache. The parser counters of
+        the workers are merged into this manager's as the chunks come back.
+        :param tracking_numbers: List of tracking number strings.
+        :param deadline: Optional time.perf_counter() value parsing has to finish by.
+        :return: List with the list of results for each tracking number, in input order.
+        :raises ParseBudgetExceeded: If parsing runs past the deadline, the pool is recycled, see __recycle_pool.
+        """
+        with self.pool_lock:
+            if self.pool is None:
+                # The pool is started from a parse thread, with the event loop and other threads running. Forking
+                #   there could copy a lock another thread holds into the workers and deadlock them, so the workers are
+                #   forked from a clean forkserver process instead, or spawned where there is none.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                # Looked up on the package, which only imports the process pool module once it is first used.
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context, initializer=_init_worker, initargs=(self.snapshot,)
+                )
+            # Submitted under the lock, so another batch timing out can't retire the pool in between.
+            pool = self.pool
+            futures = [
+                pool.submit(_parse_chunk, tracking_numbers[start:start + self.chunk_size])
+                for start in range(0, len(tracking_numbers), self.chunk_size)
+            ]
+        response = []
+        try:
+            for future in futures:
+                timeout = max(0.0, deadline - time.perf_counter()) if deadline is not None else None
+                results, counters = future.result(timeout=timeout)
+                response.extend(results)
+                self.merge_counters(counters)
+        except TimeoutError:
+            for future in futures:
+                future.cancel()
+            self.__recycle_pool(pool)
+            raise ParseBudgetExceeded("Parse time budget exceeded")
+        return response
+
+    def __recycle_pool(self, pool: concurrent.futures.ProcessPoolExecutor):
+        """
+        Retire a pool whose chunks ran past their deadline. Chunks a worker already started can't be cancelled, the
+        retired pool finishes them in the background, along with the chunks of other batches it was given, and its
+        workers exit after. The next batch starts a new pool rather than queueing behind work nobody will read.
+        :param pool: The pool the timed out batch was submitted to.
+        :return: None
+        """
+        with self.pool_lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False)
+
+    def counters(self) -> dict:
+        """
+        Read the parsers' counters, to carry the counts of a worker process over to its parent, see merge_counters.
+        :return: Dictionary of ("calls" | "matches" | "rejects", parser name) and ("exceptions", parser name,
+            exception type name) keys to counts.
+        """
+        counters = {}
+        for parser_metrics in self.parser_metrics.values():
+            calls, matches, rejects = parser_metrics.counts()
+            counters[("calls", parser_metrics.parser_name)] = calls
+            counters[("matches", parser_metrics.parser_name)] = matches
+            counters[("rejects", parser_metrics.parser_name)] = rejects
+        for (parser_name, error), count in PARSER_EXCEPTIONS.values().items():
+            counters[("exceptions", parser_name, error)] = count
+        return counters
+
+    def merge_counters(self, counters: dict):
+        """
+        Add the parser counts of a worker process to this manager's metrics, so parallel batches show in /metrics and
+        in the hit rates of first match mode.
+        :param counters: Counters as returned by counters, usually the difference of two readings.
+        :return: None
+        """
+        for parser_metrics in self.parser_metrics.values():
+            name = parser_metrics.parser_name
+            parser_metrics.merge(
+                counters.get(("calls", name), 0), counters.get(("matches", name), 0), counters.get(("rejects", name), 0)
+            )
+        for key, count in counters.items():
+            if key[0] == "exceptions":
+                PARSER_EXCEPTIONS.labels(*key[1:]).inc(count)
+
+    def close(self):
+        """
+        Shut down the worker process pool, if it was started.
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __parse(self, tracking_number: str) -> list:
+        """
+        Parse a single tracking number, bypassing the cache.
+        :param tracking_number: Canonical tracking number to parse.
+        :return: List of ParseResult objects, one per carrier that recognised the number.
+        """
+        response = []
+        for parser, formats in self.__dispatch(tracking_number):
+            format_match, data = self.__run_parser(parser, formats, tracking_number)
+            if data:
+                response.append(data)
+        return response
+
+    def __parse_first(self, tracking_number: str) -> list:
+        """
+        Parse a single tracking number in first match mode, bypassing the cache. Parsers are tried in first_match_order
+        and parsing stops at the first match of a confident format. A match of any other format is only returned when
+        no confident match follows.
+        :param tracking_number: Canonical tracking number to parse.
+        :return: List with the ParseResult of the first carrier that recognised the number, or an empty list.
+        """
+        with self.__reorder_lock:
+            self.__first_parses += 1
+            if self.__first_parses >= self.reorder_interval:
+                self.__first_parses = 0
+                self.update_parser_order()
+        fallback = []
+        for parser, formats in self.first_match_order(tracking_number, self.__dispatch(tracking_number)):
+            format_match, data = self.__run_parser(parser, formats, tracking_number)
+            if data:
+                if id(format_match.format) in self.confident_formats:
+                    return [data]
+                if not fallback:
+                    fallback = [data]
+        return fallback
+
+    def __run_parser(self, parser, formats: list, tracking_number: str) -> tuple:
+        """
+        Match a tracking number against some of a parser's formats and build its result, timing the parser and
+        recording any exception it raises.
+        :param parser: The parser.
+        :param formats: The parser's candidate formats for the number.
+        :param tracking_number: Canonical tracking number.
+        :return: Tuple of the FormatMatch and the ParseResult, both None when the parser didn't recognise the
+            number.
+        """
+        parser_metrics = self.parser_metrics[parser]
+        started = time.perf_counter()
+        try:
+            format_match = parser.match_canonical(tracking_number, formats)
+            data = parser.build_result(format_match) if format_match is not None else None
+        except Exception as e:
+            parser_metrics.exception(e)
+            return None, None
+        parser_metrics.record(bool(data), time.perf_counter() - started)
+        return format_match, data
+
+    def __parse_batch(self, tracking_numbers, deadline: float = None) -> list:
+        """
+        Parse a batch of tracking numbers, bypassing the cache. Every number is matched against its candidate formats
+        first, then the matches are grouped by format so each format's checksum runs once over its whole group. The
+        parsers' call and match counters are updated once per batch, their latency is only timed by __parse.
+        :param tracking_numbers: List of canonical tracking numbers.
+        :param deadline: Optional time.perf_counter() value parsing has to finish by, checked between numbers.
+        :return: List with the list of results for each tracking number, in input order.
+        """
+        response = [[] for _ in tracking_numbers]
+        pending = []
+        matches_by_format = {}
+        calls = dict.fromkeys(self.parsers, 0)
+        hits = dict.fromkeys(self.parsers, 0)
+        for index, tracking_number in enumerate(tracking_numbers):
+            check_deadline(deadline)
+            for parser, formats in self.__dispatch(tracking_number):
+                calls[parser] += 1
+                matched = []
+                for tracking_format in formats:
+                    match = tracking_format.regex.fullmatch(tracking_number)
+                    if match:
+                        group = matches_by_format.setdefault(id(tracking_format), (parser, tracking_format, []))[2]
+                        matched.append((tracking_format, match, len(group)))
+                        group.append(match)
+                if matched:
+                    pending.append((index, parser, matched))
+
+        valid = {
+            format_id: parser.validate_matches(tracking_format, matches)
+            for format_id, (parser, tracking_format, matches) in matches_by_format.items()
+        }
+        for index, parser, matched in pending:
+            for tracking_format, match, position in matched:
+                if valid[id(tracking_format)][position]:
+                    try:
+                        data = parser.build_result(FormatMatch(parser, tracking_format, match))
+                    except Exception as e:
+                        calls[parser] -= 1
+                        self.parser_metrics[parser].exception(e)
+                        break
+                    if data:
+                        response[index].append(data)
+                        hits[parser] += 1
+                    break
+        for parser, count in calls.items():
+            if count:
+                self.parser_metrics[parser].record(True, count=hits[parser])
+                self.parser_metrics[parser].record(False, count=count - hits[parser])
+        return response
+
+    def get_parsers(self, tracking_numbers, deadline: float = None, mode: str = MODE_ALL,
+                    duplicates: list = None) -> list:
+        """
+        Parse the tracking numbers of a request, see parse. Numbers that canonicalize to the same number are parsed
+        once.
+        :param tracking_numbers: List of tracking number strings.
+        :param deadline: Optional time.perf_counter() value parsing has to finish by, see parse_deadline.
+        :param mode: MODE_ALL or MODE_FIRST.
+        :param duplicates: Optional list the positions of the numbers answered with the results of an identical number
+            earlier in the request are appended to.
+        :return: List of the results of every tracking number, in input order.
+        :raises ValueError: If the mode is unknown.
+        :raises ParseBudgetExceeded: If parsing runs past the deadline.
+        """
+        if mode not in PARSE_MODES:
+            raise ValueError(f"Unknown parse mode {mode!r}")
         response = []
-        for tracking_number in tracking_numbers:
-            for parser in self.parsers:
-                try:
-                    data = parser.parse(tracking_number)
-                except Exception as e:
-                    continue
-                if data:
-                    response.append(data)
-            return response
\ No newline at end of file
+        parsed = {}
+        for position, tracking_number in enumerate(tracking_numbers):
+            if len(tracking_number) > self.max_length:
+                continue
+            key = canonicalize(tracking_number)
+            results = parsed.get(key)
+            if results is None:
+                check_deadline(deadline)
+                results = parsed[key] = self.__parse_cached(key, mode)
+            elif duplicates is not None:
+                duplicates.append(position)
+            response.extend(results)
+        return response
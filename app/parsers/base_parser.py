@@ -1,17 +1,264 @@
-from abc import ABC, abstractmethod
+import re
+from abc import ABC
+from typing import Callable, List, NamedTuple, Optional, Pattern, Match, Sequence, Tuple
+
+from app import checksum_kernels
+
+# Characters people and systems put between the characters of a tracking number: whitespace, hyphens and dashes, and
+#   the invisible characters copy and paste tends to carry along. Every whitespace character is below U+3001.
+SEPARATORS = (
+    "".join(chr(code) for code in range(0x3001) if chr(code).isspace())
+    + "-\u00ad\u2010\u2011\u2012\u2013\u2014\u2015\u2212\ufe63\uff0d"
+    + "\u200b\u200c\u200d\u2060\ufeff"
+)
+# str.translate table producing the canonical form of a tracking number: separators removed, ASCII letters uppercased.
+CANONICAL_TABLE = str.maketrans(
+    "abcdefghijklmnopqrstuvwxyz", "ABCDEFGHIJKLMNOPQRSTUVWXYZ", SEPARATORS
+)
+_SEPARATOR_SET = frozenset(SEPARATORS)
+# The same translation for ASCII input, which bytes.translate does several times faster than str.translate.
+_ASCII_UPPERCASE = bytes.maketrans(b"abcdefghijklmnopqrstuvwxyz", b"ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_ASCII_SEPARATORS = "".join(char for char in SEPARATORS if char.isascii()).encode()
+
+
+def canonicalize(tracking_number: str) -> str:
+    """
+    Reduce a tracking number to the canonical form every format pattern is written against, in a single pass.
+    :param tracking_number: String of the tracking number as it was received.
+    :return: The tracking number without separators and in upper case.
+    """
+    if tracking_number.isascii():
+        return tracking_number.encode().translate(_ASCII_UPPERCASE, _ASCII_SEPARATORS).decode()
+    return tracking_number.translate(CANONICAL_TABLE)
+
+
+def canonicalize_with_offsets(text: str) -> Tuple[str, list]:
+    """
+    Canonicalize a string, keeping track of where each canonical character came from.
+    :param text: String to canonicalize.
+    :return: Tuple of the canonical string and a list with the offset in text of each of its characters.
+    """
+    offsets = [index for index, char in enumerate(text) if char not in _SEPARATOR_SET]
+    return canonicalize(text), offsets
+
+
+class TrackingFormat(NamedTuple):
+    """
+    A single tracking number format a parser recognises, with its pattern compiled once at startup.
+    """
+    name: str
+    regex: Pattern
+    # List of (length, prefix) tuples describing every canonical tracking number the pattern can match. The
+    #   ParseManager indexes formats on these so a number is only tried against formats that could accept it.
+    dispatch_keys: list
+    # Called with the match object, returns whether the check digit is valid. None when the format has no checksum.
+    checksum: Optional[Callable[[Match], bool]] = None
+    # Vectorized checksum called with a list of match objects, returns a bool array with the validity of each.
+    batch_checksum: Optional[Callable[[List[Match]], Sequence[bool]]] = None
+    # Names of the parser's constructors the pattern has a group for, in the order of the constructors.
+    fields: tuple = ()
+
+
+class FormatMatch(NamedTuple):
+    """
+    A tracking number that matched one of a parser's formats and passed its checksum.
+    """
+    parser: "BaseParser"
+    format: TrackingFormat
+    match: Match
+
+
+class ParseResult(NamedTuple):
+    """
+    Immutable result of a parser recognising a tracking number. The carrier, the URL template and the tuple of field
+    names are shared by the results of a parser, so a result only holds references and the decoded values, and the
+    tracking URL is formatted when it is asked for.
+    """
+    carrier: str
+    tracking_number: str
+    tracking_url_template: str
+    field_names: tuple
+    field_values: tuple
+
+    @property
+    def tracking_url(self) -> str or None:
+        if not self.tracking_url_template:
+            return None
+        return self.tracking_url_template % self.tracking_number
+
+    @property
+    def fields(self) -> dict:
+        return dict(zip(self.field_names, self.field_values))
+
+    def get(self, field: str, default=None):
+        """
+        Look up a decoded field.
+        :param field: Name of the field, eg. "ServiceType".
+        :param default: Value returned when the field wasn't decoded.
+        :return: The field's value or default.
+        """
+        try:
+            return self.field_values[self.field_names.index(field)]
+        except ValueError:
+            return default
+
+    def to_dict(self) -> dict:
+        """
+        Build the JSON object of the result.
+        :return: Dictionary with the carrier, the tracking number, the tracking URL when the carrier has one and every
+            decoded field.
+        """
+        ret = {
+            "carrier": self.carrier,
+            "trackingNumber": self.tracking_number,
+        }
+        if self.tracking_url_template:
+            ret["trackingUrl"] = self.tracking_url_template % self.tracking_number
+        ret.update(zip(self.field_names, self.field_values))
+        return ret
+
 
 class BaseParser(ABC):
-    @abstractmethod
-    def parse(self, tracking_number: str) -> dict:
-        pass
+    carrier_name = ""
+    tracking_url_template = ""
+    constructors = []
+
+    def __init__(self):
+        # Name the parser is reported under in the metrics and benchmarks.
+        self.name = type(self).__name__
+        self.formats: List[TrackingFormat] = []
+        # Every distinct tuple of field names the parser's results have, so their results share one instance each.
+        self.field_names = {}
+
+    @property
+    def dispatch_keys(self) -> list:
+        return [key for tracking_format in self.formats for key in tracking_format.dispatch_keys]
+
+    def add_format(self, name: str, pattern: str, dispatch_keys: list, checksum: Callable[[Match], bool] = None,
+                   batch_checksum: Callable[[List[Match]], Sequence[bool]] = None):
+        """
+        Compile and register a tracking number format for this parser.
+        :param name: Name of the format, eg. "FedEx Ground".
+        :param pattern: Regex the whole canonical tracking number has to match, see canonicalize.
+        :param dispatch_keys: List of (length, prefix) tuples of the canonical numbers the pattern can match.
+        :param checksum: Optional callable taking the match object and returning whether the check digit is valid.
+        :param batch_checksum: Optional vectorized version of checksum, taking a list of match objects.
+        :return: None
+        """
+        regex = re.compile(pattern)
+        fields = tuple(constructor for constructor in self.constructors if constructor in regex.groupindex)
+        self.formats.append(TrackingFormat(name, regex, tuple(dispatch_keys), checksum, batch_checksum, fields))
+
+    def match(self, tracking_number: str, formats: list = None) -> FormatMatch or None:
+        """
+        Match a tracking number against the parser's formats, running each pattern once and handing the resulting
+        match object straight to the format's checksum. The patterns run against the canonical form of the number.
+        :param tracking_number: String of the tracking number to match.
+        :param formats: Optional subset of the parser's formats to try, as picked by the ParseManager's dispatch index.
+        :return: FormatMatch for the first format that matches with a valid checksum, otherwise None.
+        """
+        return self.match_canonical(canonicalize(tracking_number), formats)
+
+    def match_canonical(self, tracking_number: str, formats: list = None) -> FormatMatch or None:
+        """
+        Same as match, for a tracking number the caller already canonicalized.
+        :param tracking_number: Canonical tracking number to match.
+        :param formats: Optional subset of the parser's formats to try.
+        :return: FormatMatch for the first format that matches with a valid checksum, otherwise None.
+        """
+        for tracking_format in self.formats if formats is None else formats:
+            match = tracking_format.regex.fullmatch(tracking_number)
+            if match and (tracking_format.checksum is None or tracking_format.checksum(match)):
+                return FormatMatch(self, tracking_format, match)
+        return None
 
-    @abstractmethod
     def validate(self, tracking_number: str) -> bool:
-        pass
+        """
+        Validate a tracking number as belonging to this parser's carrier.
+        :param tracking_number: String of the tracking number to check.
+        :return: Bool of whether the string is a valid tracking number for this carrier.
+        """
+        return self.match(tracking_number) is not None
+
+    def parse(self, tracking_number: str, formats: list = None) -> ParseResult or None:
+        """
+        Parse a tracking number of the information that is available from the tracking number
+        :param tracking_number: String of the tracking number to parse.
+        :param formats: Optional subset of the parser's formats to try.
+        :return: ParseResult with all information that could be parsed from the tracking number
+        """
+        format_match = self.match(tracking_number, formats)
+        if format_match is None:
+            return
+        return self.build_result(format_match)
+
+    def build_result(self, format_match: FormatMatch) -> ParseResult:
+        """
+        Build the result for a matched tracking number.
+        :param format_match: The validated match to extract fields from.
+        :return: ParseResult with all information that could be parsed from the tracking number
+        """
+        names, values = self.decode_fields(format_match)
+        return ParseResult(
+            self.carrier_name,
+            format_match.match.string,
+            self.tracking_url_template,
+            self.field_names.setdefault(names, names),
+            values
+        )
+
+    def decode_fields(self, format_match: FormatMatch) -> Tuple[tuple, tuple]:
+        """
+        Decode the fields of a matched tracking number. Parsers override this to decode extra fields.
+        :param format_match: The validated match to extract fields from.
+        :return: Tuple of the field names and their values, for the constructors whose group matched something.
+        """
+        names = format_match.format.fields
+        values = tuple(map(format_match.match.group, names))
+        if not all(values):
+            decoded = [(name, value) for name, value in zip(names, values) if value]
+            names, values = tuple(zip(*decoded)) if decoded else ((), ())
+        return names, values
+
+    def validate_matches(self, tracking_format: TrackingFormat, matches: list) -> Sequence[bool]:
+        """
+        Run a format's checksum over a group of its matches at once, using the vectorized checksum for large groups.
+        :param tracking_format: The format every match belongs to.
+        :param matches: List of match objects of the format's pattern.
+        :return: Sequence of bools of whether each match's check digit is valid.
+        """
+        if tracking_format.checksum is None:
+            return [True] * len(matches)
+        if tracking_format.batch_checksum is not None and len(matches) >= checksum_kernels.MIN_KERNEL_BATCH:
+            try:
+                return tracking_format.batch_checksum(matches)
+            except Exception:
+                return [False] * len(matches)
+        valid = []
+        for match in matches:
+            try:
+                valid.append(tracking_format.checksum(match))
+            except Exception:
+                valid.append(False)
+        return valid
+
+    @staticmethod
+    def digits(text: str) -> list:
+        """
+        Convert the digits of a matched group to a list of ints.
+        :param text: String of the matched group.
+        :return: List of ints.
+        """
+        return [int(char) for char in text]
 
     @staticmethod
-    def normalize(self, tracking_number: str) -> str:
-        return tracking_number.replace(' ', '').upper()
+    def normalize(tracking_number: str) -> str:
+        """
+        Reduce a tracking number to its canonical form, see canonicalize.
+        :param tracking_number: String of the tracking number to normalize.
+        :return: The normalized tracking number.
+        """
+        return canonicalize(tracking_number)
 
     @staticmethod
     def calculate_checksum_mod10(digits: list, check_digit: int, evens_multiplier: int, odds_multiplier: int) -> bool:
@@ -72,3 +319,25 @@ class BaseParser(ABC):
         weighted_sum = sum(digit * weight for digit, weight in zip(digits, weightings))
         checksum = weighted_sum % modulo1 % modulo2
         return int(check_digit) == checksum
+
+    @staticmethod
+    def s10_checksum(serial_number, check_digit) -> bool:
+        """
+        Checksum algorithm specifically made for the S10 standard, using the version from the wikipedia article linked
+        below.
+        https://en.wikipedia.org/wiki/S10_(UPU_standard)
+        :param serial_number: Int serial number to be parsed from
+        :param check_digit: Digit for the sum of the parsed serial number to check against
+        :return: Bool of whether the checksum is valid or not
+        """
+        # Checksum algo from wikipedia https://en.wikipedia.org/wiki/S10_(UPU_standard)
+        weights = [8, 6, 4, 2, 3, 5, 9, 7]
+        check_digit_sum = 0
+        for i, digit in enumerate(f"{serial_number:08}"):
+            check_digit_sum += weights[i] * int(digit)
+        check_digit_sum = 11 - (check_digit_sum % 11)
+        if check_digit_sum == 10:
+            check_digit_sum = 0
+        elif check_digit_sum == 11:
+            check_digit_sum = 5
+        return check_digit_sum == check_digit
@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from app.shared_cache import SharedResultCache
+
+# Number of tracking numbers whose results are kept in memory, 0 disables the cache.
+PARSE_CACHE_SIZE = int(os.environ.get("PARSE_CACHE_SIZE", 100_000))
+# Seconds a cached result stays valid, 0 keeps results until they are evicted.
+PARSE_CACHE_TTL = float(os.environ.get("PARSE_CACHE_TTL", 0))
+# Path of a file the parse result cache is shared through by every process on the host, eg. /dev/shm/tracking-cache,
+#   see app.shared_cache. Empty keeps a cache per process.
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "")
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class ResultCache:
+    """
+    Size bounded LRU cache of parse results with an optional TTL. Every operation holds a lock, so one cache can be
+    shared by the threads FastAPI runs sync work on.
+    """
+
+    def __init__(self, capacity: int = PARSE_CACHE_SIZE, ttl: float = PARSE_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        """
+        Look up a cached value, marking it as the most recently used.
+        :param key: The cache key.
+        :param default: Value to return when the key is missing or expired.
+        :return: The cached value or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: str, value):
+        """
+        Store a value, evicting the least recently used entries when the cache is full.
+        :param key: The cache key.
+        :param value: The value to cache.
+        :return: None
+        """
+        if self.capacity <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drop every cached entry, keeping the statistics.
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the cache statistics.
+        :return: Dictionary with the hits, misses, evictions, hit rate, current size and capacity of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "capacity": self.capacity,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def create_result_cache(path: str = SHARED_CACHE_PATH) -> Union[ResultCache, "SharedResultCache"]:
+    """
+    Create the parse result cache of a ParseManager.
+    :param path: Path of the shared cache file, empty for a cache per process.
+    :return: SharedResultCache when a path is given and the file can be mapped, ResultCache otherwise.
+    """
+    if path and PARSE_CACHE_SIZE > 0:
+        # Imported here, app.shared_cache depends on the engine this module is part of.
+        from app.shared_cache import SharedResultCache
+        try:
+            return SharedResultCache(path)
+        except OSError as e:
+            logger.warning("Shared parse cache %s could not be opened (%r), caching results per process", path, e)
+    return ResultCache()
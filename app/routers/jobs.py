@@ -0,0 +1,155 @@
+import threading
+import zlib
+from typing import AsyncIterator, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from app.jobs import ChunkInfo, JobStore, JobTooLarge, upload_job
+
+router = APIRouter()
+# The JobStore, created by the first request for a job rather than on import, so importing the app doesn't create the
+#   job database.
+job_store: Optional[JobStore] = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """
+    Get the JobStore, creating the job database on first use. A sync dependency, so FastAPI runs it in the threadpool.
+    :return: The JobStore.
+    """
+    global job_store
+    with _job_store_lock:
+        if job_store is None:
+            job_store = JobStore()
+        return job_store
+
+
+async def get_job_or_404(store: JobStore, job_id: str) -> dict:
+    """
+    Look up a job for a request.
+    :param store: The JobStore.
+    :param job_id: Id of the job.
+    :return: Dictionary of the job status.
+    :raises HTTPException: 404 when there is no such job.
+    """
+    job = await run_in_threadpool(store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("", status_code=202, tags=["Jobs"])
+async def create_job(request: Request, response: Response, store: JobStore = Depends(get_job_store)):
+    """
+    Upload a bulk tracking job, for batches too large for `POST /track/batch`.
+
+    The body is one tracking number per line, optionally gzip compressed (eg. `curl --data-binary @numbers.txt.gz`),
+    and is queued as it is read, so files of any size can be sent. Workers start parsing the first chunks while the
+    rest is still uploading.
+
+    - **Maximum job size**: 10,000,000 tracking numbers by default, configurable with the `JOB_MAX_SIZE` environment
+      variable. Larger jobs are rejected with 413, malformed bodies with 400.
+
+    Returns the job status, see `GET /track/jobs/{job_id}`, with a `Location` header pointing at it.
+    """
+    try:
+        job_id = await upload_job(store, request.stream())
+    except JobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["Location"] = f"{request.url.path.rstrip('/')}/{job_id}"
+    return await get_job_or_404(store, job_id)
+
+
+@router.get("/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str, store: JobStore = Depends(get_job_store)):
+    """
+    Get the status and progress of a bulk tracking job.
+
+    Returns a JSON object containing:
+    - **id**: Id of the job.
+    - **status**: `uploading`, `queued`, `running`, `done` or `failed`.
+    - **total**: Number of tracking numbers in the job, still growing while it is uploading.
+    - **processed**: Number of tracking numbers parsed so far.
+    - **found**: Number of the parsed tracking numbers that were recognised.
+    - **progress**: Fraction of the tracking numbers parsed, from 0 to 1.
+    - **numbersPerSecond**: Tracking numbers parsed per second since the first chunk was picked up.
+    - **parseNumbersPerSecond**: Tracking numbers parsed per second spent parsing, across the workers.
+    - **etaSeconds**: Estimated seconds until a running job is done.
+    - **createdAt**, **startedAt**, **finishedAt**: Unix times the job was uploaded, started and finished.
+    - **error**: Why the job failed.
+    """
+    return await get_job_or_404(store, job_id)
+
+
+async def stream_job_results(store: JobStore, job_id: str, chunks: List[ChunkInfo], offset: int,
+                             end: int) -> AsyncIterator[bytes]:
+    """
+    Read the result lines of a job from its parsed chunks.
+    :param store: The JobStore.
+    :param job_id: Id of the job.
+    :param chunks: ChunkInfo of every chunk of the job, in order.
+    :param offset: Position of the first line to read.
+    :param end: Position just past the last line to read.
+    :return: Async iterator of NDJSON lines.
+    """
+    for chunk in chunks:
+        if chunk.start + chunk.size <= offset:
+            continue
+        if chunk.start >= end:
+            break
+        results = await run_in_threadpool(store.chunk_results, job_id, chunk.chunk)
+        if results is None:
+            # Deleted since the request started.
+            break
+        if offset <= chunk.start and chunk.start + chunk.size <= end:
+            yield results
+        else:
+            lines = results.split(b"\n")[max(offset - chunk.start, 0):min(end - chunk.start, chunk.size)]
+            yield b"\n".join(lines) + b"\n"
+
+
+@router.get("/{job_id}/results", tags=["Jobs"])
+async def get_job_results(job_id: str, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1),
+                          store: JobStore = Depends(get_job_store)):
+    """
+    Stream the results of a bulk tracking job, as far as it is parsed.
+
+    - **offset**: Position in the job of the first result to return.
+    - **limit**: Largest number of results to return, all the available ones if omitted.
+
+    Returns `application/x-ndjson` in the `POST /track/batch` format, one line per tracking number in upload order,
+    starting at `offset`. Results are returned up to the first chunk that isn't parsed yet. As long as there are more
+    results to come the response carries an `X-Next-Offset` header with the offset to continue from, once a job is done
+    the last page has none.
+    """
+    job = await get_job_or_404(store, job_id)
+    chunks = await run_in_threadpool(store.chunk_infos, job_id)
+    available = 0
+    for chunk in chunks:
+        if chunk.status != "done":
+            break
+        available = chunk.start + chunk.size
+    end = available if limit is None else min(available, offset + limit)
+    end = max(end, offset)
+    headers = {"X-Job-Status": job["status"]}
+    if job["status"] not in ("done", "failed") or end < available:
+        headers["X-Next-Offset"] = str(end)
+    return StreamingResponse(
+        stream_job_results(store, job_id, chunks, offset, end), media_type="application/x-ndjson", headers=headers
+    )
+
+
+@router.delete("/{job_id}", status_code=204, tags=["Jobs"])
+async def delete_job(job_id: str, store: JobStore = Depends(get_job_store)):
+    """
+    Delete a bulk tracking job and its results, stopping it if it is still running. Jobs are otherwise deleted
+    `JOB_RETENTION` seconds after they finish, a week by default.
+    """
+    if not await run_in_threadpool(store.delete_job, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Response(status_code=204)
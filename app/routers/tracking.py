@@ -1,34 +1,191 @@
-from typing import List
+from typing import List, Literal
 
-from fastapi import HTTPException, APIRouter, Query
+from fastapi import HTTPException, APIRouter, Query, Request, Response
 
+from app.batch import NDJSONStreamingResponse, iter_json_array, iter_lines, stream_results
+from app.carrier_registry import CARRIER_CACHE_MAX_AGE
+from app.executor import PARSE_RETRY_AFTER, ParseExecutor, SingleFlight
+from app.extraction import TrackingNumberScanner, stream_extraction
+from app.metrics import REQUEST_BATCH_SIZE, REQUEST_COALESCED, REQUEST_DEDUPLICATED, REQUEST_DURATION, Timer
 from app.models import TrackingResponse
-from app.parser_manager import ParseManager
+from app.parser_manager import (
+    MAX_TRACKING_NUMBER_LENGTH, MODE_ALL, ParseBudgetExceeded, ParseManager, parse_deadline
+)
+from app.parsers.base_parser import canonicalize
+from app.serialization import dumps
+from app.snapshot import load_snapshot
+from app.suggest import SuggestIndex
 
 router = APIRouter()
-parse_manager = ParseManager()
+# Prebuilt engine from ENGINE_SNAPSHOT, None to build it from the carrier definitions.
+engine_snapshot = load_snapshot()
+parse_manager = ParseManager(snapshot=engine_snapshot)
+scanner = TrackingNumberScanner(parse_manager)
+parse_executor = ParseExecutor()
+# Built lazily as it is used when the engine wasn't loaded from a snapshot.
+suggest_index = engine_snapshot.suggest_index if engine_snapshot is not None else SuggestIndex(parse_manager.parsers)
+# /track requests being parsed, by tracking numbers and mode, so identical concurrent requests share one parse.
+track_flights = SingleFlight()
+
+
+def acquire_parse_slot(endpoint: str):
+    """
+    Take a parse slot for a request, or turn it away when parsing is saturated.
+    :param endpoint: Name of the endpoint, for the metrics.
+    :return: None
+    :raises HTTPException: 429 when every slot is taken.
+    """
+    if not parse_executor.try_acquire(endpoint):
+        raise HTTPException(
+            status_code=429, detail="Too many concurrent parse requests",
+            headers={"Retry-After": str(PARSE_RETRY_AFTER)}
+        )
+
+
+def parse_tracking_numbers(tracking_numbers: List[str], mode: str) -> tuple:
+    """
+    Parse the tracking numbers of a /track request, on a parse thread.
+    :param tracking_numbers: The tracking numbers.
+    :param mode: MODE_ALL or MODE_FIRST.
+    :return: Tuple of the list of results and the number of tracking numbers that were duplicates of an earlier one.
+    :raises ParseBudgetExceeded: If parsing runs past the parse time budget.
+    """
+    duplicates = []
+    results = parse_manager.get_parsers(tracking_numbers, parse_deadline(), mode, duplicates)
+    return results, len(duplicates)
 
 
 @router.post("/", response_model=TrackingResponse, tags=["Tracking"])
-async def get_tracking_number(tracking_number: List[str] = Query(...)):
+async def get_tracking_number(tracking_number: List[str] = Query(...),
+                              mode: Literal["all", "first"] = Query(MODE_ALL)):
     """
     Parse and retrieve information from a given tracking number.
 
-    - **tracking_number**: The tracking number to parse.
+    - **tracking_number**: The tracking number to parse, at most 128 characters by default (`MAX_TRACKING_NUMBER_LENGTH`).
+    - **mode**: `all` (default) returns every carrier that recognises the tracking number. `first` returns only the
+      most likely carrier: parsers are tried in order of their observed hit rate, with a fixed carrier precedence for
+      the lengths several carriers share, and parsing stops at the first confident match.
+
+    Longer tracking numbers are rejected with 422, and a request that takes longer to parse than the parse time budget
+    (`PARSE_TIME_BUDGET`, one second by default) is rejected with 503. Parsing runs on a bounded thread pool, when more
+    than `MAX_CONCURRENT_PARSES` requests are being parsed the request is rejected with 429. Repeated tracking numbers
+    are parsed once, and concurrent requests for the same tracking numbers and mode share a single parse.
 
     Returns a list of TrackingResult objects containing:
     - **tracking_number**: The tracking number.
     - **carrier**: The carrier or carriers of the tracking number.
     - **results**: The full results of the tracking number parsing.
+    - **deduplicated**: How many of the tracking numbers repeated an earlier one and shared its results.
     """
-    results = parse_manager.get_parsers(tracking_number)
+    REQUEST_BATCH_SIZE.labels("track").observe(len(tracking_number))
+    if any(len(number) > MAX_TRACKING_NUMBER_LENGTH for number in tracking_number):
+        raise HTTPException(
+            status_code=422, detail=f"Tracking number longer than {MAX_TRACKING_NUMBER_LENGTH} characters"
+        )
+    acquire_parse_slot("track")
+    with Timer(REQUEST_DURATION.labels("track")):
+        try:
+            (results, deduplicated), coalesced = await track_flights.run(
+                (tuple(tracking_number), mode),
+                lambda: parse_executor.run(parse_tracking_numbers, tracking_number, mode)
+            )
+        except ParseBudgetExceeded:
+            raise HTTPException(status_code=503, detail="Parse time budget exceeded")
+        finally:
+            parse_executor.release()
+    if coalesced:
+        REQUEST_COALESCED.labels("track").inc()
+    if deduplicated:
+        REQUEST_DEDUPLICATED.labels("track").inc(deduplicated)
     if len(results) == 0:
         raise HTTPException(status_code=404, detail="Tracking number not found")
     else:
-        return {
+        # Encoded straight from the results, TrackingResponse only documents the schema and isn't validated against.
+        return Response(dumps({
             "detail": "Tracking number parsed successfully",
             "tracking_number": tracking_number,
-            "carriers": [x["carrier"] for x in results],
+            "carriers": [x.carrier for x in results],
             "results": results,
-            "trackingUrl": [x["trackingUrl"] for x in results if "trackingUrl" in x]
-        }
+            "trackingUrl": [x.tracking_url for x in results if x.tracking_url_template],
+            "deduplicated": deduplicated,
+        }), media_type="application/json")
+
+
+@router.post("/batch", tags=["Tracking"])
+async def get_tracking_number_batch(request: Request):
+    """
+    Parse a large batch of tracking numbers, streaming the results back as they are parsed.
+
+    The body is either a JSON array of tracking number strings (`Content-Type: application/json`) or one tracking
+    number per line (any other content type). Neither the request nor the response is held in memory as a whole.
+
+    - **Maximum batch size**: 500,000 tracking numbers by default, configurable with the `MAX_BATCH_SIZE` environment
+      variable. Anything past the limit is answered with a single error line.
+    - **Throughput target**: 25,000 tracking numbers per second per worker process.
+    - **Limits**: Tracking numbers longer than `MAX_TRACKING_NUMBER_LENGTH` get an error line. Every chunk of the batch
+      has to parse within `PARSE_TIME_BUDGET`, otherwise the stream ends with an error line. Batches count towards
+      `MAX_CONCURRENT_PARSES` until their stream ends, past it the request is rejected with 429.
+
+    Returns `application/x-ndjson`, one JSON object per input line in input order containing:
+    - **index**: Position of the tracking number in the request body.
+    - **tracking_number**: The tracking number as it was sent.
+    - **carriers**: The carrier or carriers of the tracking number.
+    - **results**: The full results of the tracking number parsing.
+    - **error**: Instead of carriers and results, why the tracking number could not be parsed.
+    - **duplicate**: Only present, and true, when the tracking number repeats an earlier one of its chunk of 1,000
+      numbers and was answered with its outcome instead of being parsed again.
+    """
+    acquire_parse_slot("batch")
+    if request.headers.get("content-type", "").startswith("application/json"):
+        items = iter_json_array(request.stream())
+    else:
+        items = iter_lines(request.stream())
+    return NDJSONStreamingResponse(parse_executor.limit(stream_results(items, parse_manager, parse_executor)))
+
+
+@router.post("/extract", tags=["Tracking"])
+async def extract_tracking_numbers(request: Request):
+    """
+    Find every tracking number in a free text body, such as an order confirmation email, OCR output of a label or a
+    chat transcript.
+
+    The body is read as UTF-8 text and scanned chunk by chunk as it arrives, so documents of any size can be sent.
+    Every chunk has to be scanned within `PARSE_TIME_BUDGET`, otherwise the stream ends with an `error` line. Requests
+    count towards `MAX_CONCURRENT_PARSES` until their stream ends, past it the request is rejected with 429.
+
+    Returns `application/x-ndjson`, one JSON object per tracking number found in order of appearance containing:
+    - **start**: Offset of the first character of the tracking number in the text.
+    - **end**: Offset just past the last character of the tracking number.
+    - **carrier**: The carrier of the tracking number.
+    - Every other field that could be parsed from the tracking number.
+    """
+    acquire_parse_slot("extract")
+    return NDJSONStreamingResponse(parse_executor.limit(stream_extraction(request.stream(), scanner, parse_executor)))
+
+
+@router.get("/suggest", tags=["Tracking"])
+async def suggest_carriers(tracking_number: str = Query("", max_length=MAX_TRACKING_NUMBER_LENGTH)):
+    """
+    Suggest the carriers of a tracking number while it is being typed, eg. for a search box calling it on every
+    keystroke.
+
+    - **tracking_number**: The tracking number typed so far, separators and case don't matter.
+
+    The partial number is run through an automaton built from every carrier's patterns, without parsing it, so it
+    answers in microseconds. Responses only change with a deploy and are sent with a Cache-Control header.
+
+    Returns a JSON object containing:
+    - **tracking_number**: The canonical form of the partial tracking number.
+    - **carriers**: The carriers the tracking number could still belong to.
+    - **candidates**: One object per format the tracking number could still be completed into, with its `carrier`,
+      its `format` name, the `lengths` it can be complete at and whether it is `complete` already, in which case it
+      can be sent to `POST /track` to be validated.
+    """
+    with Timer(REQUEST_DURATION.labels("suggest")):
+        key = canonicalize(tracking_number)
+        suggestion = suggest_index.suggest(key)
+        return Response(dumps({
+            "tracking_number": key,
+            "carriers": suggestion.carriers,
+            "candidates": suggestion.candidates,
+        }), media_type="application/json", headers={"Cache-Control": f"public, max-age={CARRIER_CACHE_MAX_AGE}"})
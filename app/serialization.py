@@ -0,0 +1,40 @@
+"""
+JSON encoding of tracking responses. Responses are encoded straight from the ParseResult objects with orjson, without
+building a dictionary per result or validating the response against its pydantic model first.
+"""
+import json
+
+import orjson
+
+from app.parsers.base_parser import ParseResult
+
+
+def _default(obj):
+    if isinstance(obj, ParseResult):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _plain(obj):
+    if isinstance(obj, ParseResult):
+        return obj.to_dict()
+    if isinstance(obj, dict):
+        return {key: _plain(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(item) for item in obj]
+    return obj
+
+
+def dumps(obj) -> bytes:
+    """
+    Encode an object to JSON.
+    :param obj: Object to encode, ParseResult objects are encoded as their to_dict().
+    :return: Bytes of the UTF-8 JSON text.
+    """
+    try:
+        return orjson.dumps(obj, default=_default)
+    except orjson.JSONEncodeError:
+        # orjson refuses strings that aren't valid UTF-8, such as the lone surrogates a JSON batch item may carry
+        #   escaped, the standard encoder escapes them. It encodes tuples as arrays without calling default, so the
+        #   results are converted up front.
+        return json.dumps(_plain(obj), separators=(",", ":")).encode()
@@ -0,0 +1,59 @@
+"""
+Pieces of the pre-fork server mode, see gunicorn.conf.py: the gunicorn worker running the app, and the worker count
+sizing.
+"""
+import asyncio
+import os
+
+from uvicorn_worker import UvicornWorker
+
+
+def available_cpus() -> int:
+    """
+    Count the CPUs the process may use: the CPUs it is pinned to, capped by the cgroup CPU quota of its container.
+    :return: Number of CPUs, at least 1.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not on Linux
+        return os.cpu_count() or 1
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            limit, period = file.read().split()
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+                limit = int(file.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+                period = int(file.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, int(quota + 0.5))
+    return max(cpus, 1)
+
+
+class TrackingWorker(UvicornWorker):
+    """
+    Uvicorn worker that keeps its heartbeat going while it drains. The stock worker only reports to the gunicorn
+    master while it accepts connections, so a worker finishing a long streamed batch after a reload or shutdown would be
+    killed as hung once the timeout passes, well before graceful_timeout. The heartbeat runs on the event loop, a
+    worker whose loop is blocked is still killed.
+    """
+
+    async def _serve(self):
+        heartbeat = asyncio.get_running_loop().create_task(self.__heartbeat())
+        try:
+            await super()._serve()
+        finally:
+            heartbeat.cancel()
+
+    async def __heartbeat(self):
+        while True:
+            self.notify()
+            await asyncio.sleep(self.timeout / 2)
@@ -0,0 +1,353 @@
+"""
+Parse result cache shared by every process on a host, such as the API workers and the bulk job workers. Results are
+kept in a fixed size hash table in a memory mapped file, ideally on a tmpfs like /dev/shm, so a number parsed by one
+worker is a hit in all of them and the memory the cache takes doesn't grow with the number of workers:
+
+- The table is set associative: a key hashes to a bucket of WAYS slots, and a full bucket evicts its oldest entry.
+  Slots have a fixed size, results that don't fit in one are simply not shared.
+- Reads take no lock. Every slot has a sequence number a writer makes odd while it rewrites the slot and even again
+  once it is done, a reader that sees it odd or changed while it copied the slot treats the lookup as a miss.
+- Writes lock the stripe of buckets they touch, with a record lock on the file so writers in other processes are
+  excluded, and a thread lock since record locks don't exclude the threads of one process.
+- The file header records the engine's source digest, see app.snapshot, so processes running another version of the
+  carrier definitions start over from an empty table instead of reading results they wouldn't have produced.
+- A small ResultCache in front of the table keeps the most requested results of each process unpickled, a hit in the
+  table costs about half a parse, one in the front cache a dictionary lookup.
+"""
+import errno
+import fcntl
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from app.result_cache import PARSE_CACHE_SIZE, PARSE_CACHE_TTL, ResultCache
+from app.snapshot import source_digest
+
+# Number of results each process also keeps in a cache of its own, in front of the shared one, 0 disables it.
+SHARED_CACHE_LOCAL_SIZE = int(os.environ.get("SHARED_CACHE_LOCAL_SIZE", 10_000))
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"TNPCACHE"
+_LAYOUT_VERSION = 1
+# Slots per bucket.
+WAYS = 8
+# Bytes per slot: the key and value lengths, the key and the pickled results. Fits the results of all but about one
+#   tracking number in 2,000, those matching several formats with long field values.
+SLOT_SIZE = 576
+# Number of lock stripes the buckets are spread over.
+STRIPES = 64
+# Times a read is retried when a write to the slot is in progress.
+_READ_RETRIES = 3
+
+# Magic, layout version, bucket count, ways, slot size, engine digest, then the occupied slot count of every stripe.
+_HEADER = struct.Struct(f"=8sIIII64s{STRIPES}Q")
+_HEADER_SIZE = (_HEADER.size + 63) // 64 * 64
+_STRIPE_COUNTS_OFFSET = struct.calcsize("=8sIIII64s")
+# Per bucket: the fingerprint of every way, 0 for an empty one, their sequence numbers and the times they were written.
+_FINGERPRINTS = struct.Struct(f"={WAYS}I")
+_FINGERPRINT = struct.Struct("=I")
+_SEQUENCE = struct.Struct("=I")
+_WRITTEN_AT = struct.Struct("=d")
+_COUNT = struct.Struct("=Q")
+_LENGTHS = struct.Struct("=HH")
+_SEQUENCES_OFFSET = _FINGERPRINTS.size
+_WRITTEN_AT_OFFSET = _SEQUENCES_OFFSET + WAYS * _SEQUENCE.size
+_SLOTS_OFFSET = _WRITTEN_AT_OFFSET + WAYS * _WRITTEN_AT.size
+_BUCKET_SIZE = _SLOTS_OFFSET + WAYS * SLOT_SIZE
+_SLOT_PAYLOAD = SLOT_SIZE - _LENGTHS.size
+
+_MISSING = object()
+
+
+def _encode_key(key) -> bytes:
+    """
+    Encode a cache key of the ParseManager: a canonical tracking number, or a (mode, number) tuple.
+    :param key: The cache key.
+    :return: Its bytes, the parts of a tuple joined by NUL characters, which canonical numbers never contain.
+    """
+    if isinstance(key, tuple):
+        key = "\0".join(key)
+    return key.encode()
+
+
+class SharedResultCache:
+    """
+    Size bounded cache of parse results shared between processes through a memory mapped file, a drop in replacement
+    for ResultCache. Buckets evict their oldest entry rather than their least recently used one, so reads never write
+    to the table. Hits, misses and evictions are counted per process, without a lock, the size is the table's.
+    """
+
+    def __init__(self, path: str, capacity: int = PARSE_CACHE_SIZE, ttl: float = PARSE_CACHE_TTL,
+                 local_capacity: int = SHARED_CACHE_LOCAL_SIZE, generation: str = None):
+        """
+        Open the table, creating it when the file is missing or was written for another layout or engine.
+        :param path: Path of the file, eg. /dev/shm/tracking-cache. Every process opening it shares the cache.
+        :param capacity: Number of results the table holds, rounded up to a whole number of buckets.
+        :param ttl: Seconds a cached result stays valid, 0 keeps results until they are evicted. A result copied to the
+            front cache is kept there for up to ttl seconds more.
+        :param local_capacity: Capacity of the process's front cache, 0 disables it.
+        :param generation: Identifier of the engine the results come from, the engine's source digest by default.
+        :raises OSError: If the file can't be created or mapped.
+        """
+        self.path = path
+        self.buckets = max(1, -(-capacity // WAYS))
+        self.capacity = self.buckets * WAYS
+        self.ttl = ttl
+        self.generation = (generation or source_digest()).encode()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Results too large for a slot, which every process parses again.
+        self.oversized = 0
+        self.local = ResultCache(local_capacity, ttl)
+        # One thread lock per stripe, so the threads of a process only wait for each other on the same stripe, like
+        #   processes do on the stripe's record lock.
+        self._locks = [threading.Lock() for _ in range(STRIPES)]
+        self._file = self.__open()
+        self._memory = mmap.mmap(self._file.fileno(), _HEADER_SIZE + self.buckets * _BUCKET_SIZE)
+
+    def __header(self) -> bytes:
+        return _HEADER.pack(
+            _MAGIC, _LAYOUT_VERSION, self.buckets, WAYS, SLOT_SIZE, self.generation, *([0] * STRIPES)
+        )
+
+    def __open(self):
+        """
+        Open the file, replacing it when its header doesn't match. Processes starting together serialize on a lock
+        file, so the table is only created once and no process maps a file another one is about to replace.
+        :return: The open file.
+        """
+        expected = self.__header()[:_STRIPE_COUNTS_OFFSET]
+        size = _HEADER_SIZE + self.buckets * _BUCKET_SIZE
+        with open(self.path + ".lock", "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                file = open(self.path, "r+b")
+            except FileNotFoundError:
+                file = None
+            if file is not None:
+                if file.read(_STRIPE_COUNTS_OFFSET) == expected and os.fstat(file.fileno()).st_size == size:
+                    return file
+                file.close()
+                logger.info("Shared parse cache %s was written for another engine or size, starting over", self.path)
+            # Created aside and renamed into place, processes that still map the old file keep their own copy.
+            directory, name = os.path.split(os.path.abspath(self.path))
+            descriptor, temporary_path = tempfile.mkstemp(prefix=name + ".", dir=directory)
+            try:
+                file = os.fdopen(descriptor, "r+b")
+                # Allocated up front: writing to a page of the mapping that can't be allocated, once the tmpfs is full,
+                #   would kill the process with SIGBUS.
+                os.posix_fallocate(descriptor, 0, size)
+                file.write(self.__header())
+                file.flush()
+                os.replace(temporary_path, self.path)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+            return file
+
+    @staticmethod
+    def __locate(encoded: bytes) -> tuple:
+        """
+        Hash an encoded key.
+        :param encoded: The key, see _encode_key.
+        :return: Tuple of the key's fingerprint, never 0, and its bucket number before the modulo.
+        """
+        digest = zlib.crc32(encoded)
+        return digest or 1, digest
+
+    def get(self, key, default=None):
+        """
+        Look up a cached value in the front cache, then in the table without taking a lock.
+        :param key: The cache key.
+        :param default: Value to return when the key is missing, expired or being written.
+        :return: The cached value or default.
+        """
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        encoded = _encode_key(key)
+        fingerprint, digest = self.__locate(encoded)
+        memory = self._memory
+        base = _HEADER_SIZE + digest % self.buckets * _BUCKET_SIZE
+        fingerprints = _FINGERPRINTS.unpack_from(memory, base)
+        if fingerprint in fingerprints:
+            for way, candidate in enumerate(fingerprints):
+                if candidate == fingerprint:
+                    value = self.__read(base, way, encoded)
+                    if value is not _MISSING:
+                        value = pickle.loads(value)
+                        self.local.put(key, value)
+                        self.hits += 1
+                        return value
+        self.misses += 1
+        return default
+
+    def __read(self, base: int, way: int, encoded: bytes):
+        """
+        Copy a slot, checking it wasn't written to meanwhile.
+        :param base: Offset of the bucket.
+        :param way: Slot in the bucket.
+        :param encoded: Key the slot should hold.
+        :return: The pickled value, or _MISSING when the slot holds another key, has expired or is being written.
+        """
+        memory = self._memory
+        sequence_offset = base + _SEQUENCES_OFFSET + way * _SEQUENCE.size
+        slot = base + _SLOTS_OFFSET + way * SLOT_SIZE
+        for _ in range(_READ_RETRIES):
+            sequence = _SEQUENCE.unpack_from(memory, sequence_offset)[0]
+            if sequence & 1:
+                continue
+            key_length, value_length = _LENGTHS.unpack_from(memory, slot)
+            start = slot + _LENGTHS.size
+            stored_key = memory[start:start + key_length]
+            value = memory[start + key_length:start + key_length + value_length]
+            written_at = _WRITTEN_AT.unpack_from(memory, base + _WRITTEN_AT_OFFSET + way * _WRITTEN_AT.size)[0]
+            if _SEQUENCE.unpack_from(memory, sequence_offset)[0] != sequence:
+                continue
+            if stored_key != encoded or (self.ttl > 0 and written_at + self.ttl <= time.time()):
+                return _MISSING
+            return value
+        return _MISSING
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the bucket's oldest entry when it is full.
+        :param key: The cache key.
+        :param value: The value to cache, picklable.
+        :return: None
+        """
+        self.local.put(key, value)
+        encoded = _encode_key(key)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(encoded) + len(data) > _SLOT_PAYLOAD:
+            self.oversized += 1
+            return
+        fingerprint, digest = self.__locate(encoded)
+        bucket = digest % self.buckets
+        base = _HEADER_SIZE + bucket * _BUCKET_SIZE
+        memory = self._memory
+        stripe = bucket % STRIPES
+        with _StripeLock(self._file.fileno(), self._locks[stripe:stripe + 1], stripe, 1):
+            fingerprints = _FINGERPRINTS.unpack_from(memory, base)
+            way = self.__find(base, fingerprints, fingerprint, encoded) if fingerprint in fingerprints else None
+            if way is None and 0 in fingerprints:
+                way = fingerprints.index(0)
+                count_offset = _STRIPE_COUNTS_OFFSET + stripe * _COUNT.size
+                _COUNT.pack_into(memory, count_offset, _COUNT.unpack_from(memory, count_offset)[0] + 1)
+            elif way is None:
+                way = min(
+                    range(WAYS),
+                    key=lambda way: _WRITTEN_AT.unpack_from(memory, base + _WRITTEN_AT_OFFSET + way * _WRITTEN_AT.size)
+                )
+                self.evictions += 1
+            sequence_offset = base + _SEQUENCES_OFFSET + way * _SEQUENCE.size
+            # Odd while the slot is rewritten. A writer that died halfway left it odd already.
+            sequence = _SEQUENCE.unpack_from(memory, sequence_offset)[0] | 1
+            _SEQUENCE.pack_into(memory, sequence_offset, sequence)
+            slot = base + _SLOTS_OFFSET + way * SLOT_SIZE
+            _LENGTHS.pack_into(memory, slot, len(encoded), len(data))
+            start = slot + _LENGTHS.size
+            memory[start:start + len(encoded) + len(data)] = encoded + data
+            _WRITTEN_AT.pack_into(memory, base + _WRITTEN_AT_OFFSET + way * _WRITTEN_AT.size, time.time())
+            _FINGERPRINT.pack_into(memory, base + way * _FINGERPRINT.size, fingerprint)
+            _SEQUENCE.pack_into(memory, sequence_offset, (sequence + 1) & 0xFFFFFFFF)
+
+    def __find(self, base: int, fingerprints: tuple, fingerprint: int, encoded: bytes) -> int or None:
+        """
+        Find the slot already holding a key, with the stripe locked.
+        :return: The slot's way, or None when the key isn't in the bucket.
+        """
+        for way, candidate in enumerate(fingerprints):
+            if candidate == fingerprint:
+                slot = base + _SLOTS_OFFSET + way * SLOT_SIZE
+                key_length = _LENGTHS.unpack_from(self._memory, slot)[0]
+                if self._memory[slot + _LENGTHS.size:slot + _LENGTHS.size + key_length] == encoded:
+                    return way
+        return None
+
+    def clear(self):
+        """
+        Drop every cached entry of the table and of this process's front cache, keeping the statistics. The other
+        processes keep their front caches.
+        :return: None
+        """
+        self.local.clear()
+        memory = self._memory
+        empty = bytes(_FINGERPRINTS.size)
+        with _StripeLock(self._file.fileno(), self._locks, 0, STRIPES):
+            for bucket in range(self.buckets):
+                memory[_HEADER_SIZE + bucket * _BUCKET_SIZE:_HEADER_SIZE + bucket * _BUCKET_SIZE + len(empty)] = empty
+            memory[_STRIPE_COUNTS_OFFSET:_STRIPE_COUNTS_OFFSET + STRIPES * _COUNT.size] = bytes(STRIPES * _COUNT.size)
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the cache statistics.
+        :return: Dictionary with the hits, misses, evictions, hit rate, current size and capacity of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "size": len(self),
+            "capacity": self.capacity,
+        }
+
+    def __len__(self):
+        return sum(struct.unpack_from(f"={STRIPES}Q", self._memory, _STRIPE_COUNTS_OFFSET))
+
+
+class _StripeLock:
+    """
+    Context manager locking a range of stripes against the other threads and processes. The record lock is taken on
+    the header's bytes, which only serve as lock names: the table itself is never accessed through the file. Record
+    locks belong to the process, not the thread, so the stripes' thread locks are taken first: they keep the threads of
+    a process from sharing, or releasing, each other's record locks.
+    """
+    __slots__ = ("descriptor", "thread_locks", "start", "length")
+
+    def __init__(self, descriptor: int, thread_locks: list, start: int, length: int):
+        self.descriptor = descriptor
+        self.thread_locks = thread_locks
+        self.start = start
+        self.length = length
+
+    def __enter__(self):
+        # Always in stripe order, so two threads locking several stripes can't deadlock.
+        for thread_lock in self.thread_locks:
+            thread_lock.acquire()
+        try:
+            while True:
+                try:
+                    fcntl.lockf(self.descriptor, fcntl.LOCK_EX, self.length, self.start)
+                    break
+                except OSError as e:
+                    # The kernel looks for deadlocks between processes, not threads: a thread waiting for a stripe
+                    #   another process holds while that process waits for a stripe a sibling thread holds looks like
+                    #   one. No thread waits while holding a stripe, so it never is, and the lock is asked for again.
+                    if e.errno != errno.EDEADLK:
+                        raise
+                    time.sleep(0)
+        except BaseException:
+            self.__release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.lockf(self.descriptor, fcntl.LOCK_UN, self.length, self.start)
+        finally:
+            self.__release()
+
+    def __release(self):
+        for thread_lock in reversed(self.thread_locks):
+            thread_lock.release()
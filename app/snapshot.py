@@ -0,0 +1,133 @@
+"""
+Prebuilt snapshot of the parse engine, for fast cold starts. Starting the engine from scratch means reading and
+validating every carrier definition, expanding their dispatch keys and lookup tables, indexing the formats, describing
+the carriers and building the typeahead automaton. A snapshot holds the result, written once at image build time:
+
+    python -m app.snapshot -o engine.snapshot
+
+and loaded at startup when ENGINE_SNAPSHOT points at it. A snapshot is only used when it was written by the same
+snapshot version and Python version from the same carrier definitions and engine code, otherwise the engine is built
+from the definitions as usual. The format patterns are recompiled when it is loaded, compiled regexes can't be
+serialized. Snapshots are pickles and are trusted like the code: only load snapshots built from this image.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+from app.carrier_registry import CarrierRegistry
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+from app.suggest import SuggestIndex
+
+# Path of the engine snapshot loaded at startup, empty to always build the engine from the carrier definitions.
+ENGINE_SNAPSHOT = os.environ.get("ENGINE_SNAPSHOT", "")
+# Version of the snapshot layout, bumped whenever it changes.
+SNAPSHOT_VERSION = 2
+# Files the engine is built from, relative to the app package. A snapshot taken from other versions of them is stale.
+SNAPSHOT_SOURCES = (
+    "carriers/*.json",
+    "parsers/*.py",
+    "carrier_registry.py",
+    "checksum_kernels.py",
+    "format_definitions.py",
+    "parser_manager.py",
+    "snapshot.py",
+    "suggest.py",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class EngineSnapshot(NamedTuple):
+    """
+    Everything the engine builds at startup from the carrier definitions.
+    """
+    parsers: list
+    # ParseManager.dispatch_index and ParseManager.prefix_lengths, referencing the parsers above.
+    dispatch_index: dict
+    prefix_lengths: dict
+    registry: CarrierRegistry
+    # Fully determinized, see SuggestIndex.determinize.
+    suggest_index: SuggestIndex
+
+
+def source_digest() -> str:
+    """
+    Fingerprint the engine's sources, along with the snapshot and Python versions.
+    :return: Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256(f"{SNAPSHOT_VERSION} {sys.version}".encode())
+    directory = Path(__file__).parent
+    for pattern in SNAPSHOT_SOURCES:
+        for path in sorted(directory.glob(pattern)):
+            digest.update(path.relative_to(directory).as_posix().encode() + b"\0")
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def build_snapshot() -> EngineSnapshot:
+    """
+    Build the engine from the carrier definitions.
+    :return: EngineSnapshot of it.
+    """
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    suggest_index = SuggestIndex(parse_manager.parsers)
+    suggest_index.determinize()
+    return EngineSnapshot(
+        parse_manager.parsers,
+        parse_manager.dispatch_index,
+        parse_manager.prefix_lengths,
+        CarrierRegistry(parse_manager.parsers),
+        suggest_index
+    )
+
+
+def save_snapshot(snapshot: EngineSnapshot, path: str):
+    """
+    Write a snapshot to a file, preceded by the digest of the sources it was built from. The fields are pickled as a
+    plain tuple, so the file doesn't depend on the module EngineSnapshot was loaded as (__main__ under -m).
+    :param snapshot: The snapshot.
+    :param path: Path of the file.
+    :return: None
+    """
+    with open(path, "wb") as file:
+        pickle.dump(source_digest(), file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(tuple(snapshot), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_snapshot(path: str = ENGINE_SNAPSHOT) -> EngineSnapshot or None:
+    """
+    Load a snapshot written by save_snapshot.
+    :param path: Path of the file, empty for none.
+    :return: The snapshot, or None when there is no path or the snapshot is missing, unreadable or stale.
+    """
+    if not path:
+        return None
+    try:
+        with open(path, "rb") as file:
+            if pickle.load(file) != source_digest():
+                logger.warning("Engine snapshot %s is stale, building the engine from the carrier definitions", path)
+                return None
+            return EngineSnapshot(*pickle.load(file))
+    except Exception as e:
+        logger.warning("Engine snapshot %s could not be loaded (%r), building the engine from the carrier definitions",
+                       path, e)
+        return None
+
+
+def main(argv: list = None):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m app.snapshot", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    arg_parser.add_argument("-o", "--output", default="engine.snapshot", help="Snapshot file to write")
+    args = arg_parser.parse_args(argv)
+    save_snapshot(build_snapshot(), args.output)
+
+
+if __name__ == "__main__":
+    main()
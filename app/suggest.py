@@ -0,0 +1,314 @@
+"""
+Typeahead for partial tracking numbers. The patterns of every format are compiled into one automaton over the canonical
+characters of a tracking number, so the formats a partial number could still grow into are found by following one
+transition per character instead of trying regexes:
+
+- Each pattern becomes a nondeterministic automaton whose transitions are labelled with the set of characters the
+  pattern accepts at that point, such as {"1"} then {"Z"} for "1Z", or the digits for [0-9].
+- The automata are determinized lazily: a state of the typeahead is the set of pattern states reachable with the
+  characters typed so far, and the transition for a character is computed the first time it is followed, then cached.
+  Prefixes people type share their states, so after warming up a lookup is a dictionary access per character.
+- Each state knows the formats it is still part of and the lengths they can complete at, which are combined with the
+  lengths the formats are dispatched on.
+"""
+import string
+from typing import NamedTuple
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Characters of canonical tracking numbers the patterns are written against, see canonicalize.
+ALPHABET = frozenset(string.ascii_uppercase + string.digits)
+_CATEGORY_CHARACTERS = {
+    sre_constants.CATEGORY_DIGIT: frozenset(string.digits),
+    sre_constants.CATEGORY_WORD: ALPHABET,
+}
+
+
+class Suggestion(NamedTuple):
+    """
+    Formats a partial tracking number could still be completed into.
+    """
+    # Distinct carrier names of the candidates, in parser order.
+    carriers: list
+    # One dictionary per candidate format with its carrier, format name, the lengths it can still complete at and
+    #   whether the partial number already has one of them.
+    candidates: list
+
+
+class _State:
+    """
+    State of the typeahead automaton: the pattern states reachable with the characters typed so far.
+    """
+    __slots__ = ("depth", "nfa_states", "transitions", "suggestion")
+
+    def __init__(self, depth: int, nfa_states: frozenset):
+        self.depth = depth
+        self.nfa_states = nfa_states
+        self.transitions = {}
+        self.suggestion = None
+
+
+class SuggestIndex:
+    """
+    Finds the carriers and formats a partial tracking number can belong to. The automaton grows as it is used and is
+    not locked, lookups have to come from one thread, such as the event loop.
+    """
+
+    def __init__(self, parsers: list):
+        # Pattern states: per state, its (characters, state) transitions, its epsilon transitions and the format it
+        #   belongs to.
+        self.edges = []
+        self.epsilon = []
+        self.state_format = []
+        self.formats = []
+        self.accepting = set()
+        starts = []
+        for parser in parsers:
+            for tracking_format in parser.formats:
+                index = len(self.formats)
+                dispatch_lengths = frozenset(length for length, prefix in tracking_format.dispatch_keys)
+                self.formats.append((parser, tracking_format, dispatch_lengths))
+                start = self.__add_state(index)
+                try:
+                    end = self.__compile(sre_parse.parse(tracking_format.regex.pattern), start, index)
+                except ValueError:
+                    # Patterns using constructs the automaton doesn't model are suggested from their dispatch keys,
+                    #   starting over from a new state so the states compiled so far are unreachable.
+                    start = self.__add_state(index)
+                    end = self.__compile_dispatch_keys(tracking_format.dispatch_keys, start, index)
+                starts.append(start)
+                self.accepting.add(end)
+        self.max_length = max((max(lengths) for parser, tracking_format, lengths in self.formats if lengths), default=0)
+        self.distances = self.__accept_distances()
+        self.states = {}
+        self.root = self.__intern(0, self.__closure(starts))
+        self.dead = self.__intern(-1, frozenset())
+        # Whether every state and transition has been computed, see determinize.
+        self.determinized = False
+
+    def __add_state(self, format_index: int) -> int:
+        self.edges.append([])
+        self.epsilon.append([])
+        self.state_format.append(format_index)
+        return len(self.edges) - 1
+
+    def __compile(self, tokens, start: int, format_index: int) -> int:
+        """
+        Add the states of a parsed pattern.
+        :param tokens: Parsed pattern as returned by sre_parse.parse.
+        :param start: State the pattern starts from.
+        :param format_index: Index of the format in self.formats.
+        :return: State the pattern ends in.
+        :raises ValueError: If the pattern uses a construct that isn't supported.
+        """
+        state = start
+        for op, value in tokens:
+            if op == sre_constants.LITERAL:
+                state = self.__add_edge(state, frozenset(chr(value)), format_index)
+            elif op == sre_constants.IN:
+                state = self.__add_edge(state, self.__character_set(value), format_index)
+            elif op == sre_constants.ANY:
+                state = self.__add_edge(state, ALPHABET, format_index)
+            elif op == sre_constants.SUBPATTERN:
+                state = self.__compile(value[-1], state, format_index)
+            elif op == sre_constants.BRANCH:
+                end = self.__add_state(format_index)
+                for branch in value[1]:
+                    self.epsilon[self.__compile(branch, state, format_index)].append(end)
+                state = end
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                low, high, body = value
+                for _ in range(low):
+                    state = self.__compile(body, state, format_index)
+                if high == sre_constants.MAXREPEAT:
+                    loop = self.__add_state(format_index)
+                    self.epsilon[state].append(loop)
+                    self.epsilon[self.__compile(body, loop, format_index)].append(loop)
+                    state = loop
+                else:
+                    end = self.__add_state(format_index)
+                    for _ in range(high - low):
+                        self.epsilon[state].append(end)
+                        state = self.__compile(body, state, format_index)
+                    self.epsilon[state].append(end)
+                    state = end
+            elif op == sre_constants.AT:
+                continue
+            else:
+                raise ValueError(f"Unsupported regex construct {op}")
+        return state
+
+    def __compile_dispatch_keys(self, dispatch_keys: list, start: int, format_index: int) -> int:
+        end = self.__add_state(format_index)
+        for length, prefix in dispatch_keys:
+            state = start
+            for char in prefix:
+                state = self.__add_edge(state, frozenset(char), format_index)
+            for _ in range(length - len(prefix)):
+                state = self.__add_edge(state, ALPHABET, format_index)
+            self.epsilon[state].append(end)
+        return end
+
+    def __add_edge(self, state: int, characters: frozenset, format_index: int) -> int:
+        target = self.__add_state(format_index)
+        self.edges[state].append((characters, target))
+        return target
+
+    @staticmethod
+    def __character_set(items) -> frozenset:
+        """
+        Characters of the alphabet a parsed character set accepts.
+        :param items: Parsed items of the set, eg. [(RANGE, (48, 57))].
+        :return: Frozenset of characters.
+        :raises ValueError: If the set uses a construct that isn't supported.
+        """
+        characters = set()
+        negate = False
+        for op, value in items:
+            if op == sre_constants.LITERAL:
+                characters.add(chr(value))
+            elif op == sre_constants.RANGE:
+                characters.update(chr(code) for code in range(value[0], value[1] + 1))
+            elif op == sre_constants.CATEGORY and value in _CATEGORY_CHARACTERS:
+                characters.update(_CATEGORY_CHARACTERS[value])
+            elif op == sre_constants.NEGATE:
+                negate = True
+            else:
+                raise ValueError(f"Unsupported character set construct {op}")
+        return ALPHABET - characters if negate else ALPHABET & characters
+
+    def __accept_distances(self) -> list:
+        """
+        Find how many more characters take each pattern state to the end of its pattern.
+        :return: List with a bit mask per state, bit n set when the pattern can end n characters further.
+        """
+        limit = (1 << (self.max_length + 1)) - 1
+        distances = [1 if state in self.accepting else 0 for state in range(len(self.edges))]
+        changed = True
+        while changed:
+            changed = False
+            for state in reversed(range(len(self.edges))):
+                mask = distances[state]
+                for characters, target in self.edges[state]:
+                    mask |= (distances[target] << 1) & limit
+                for target in self.epsilon[state]:
+                    mask |= distances[target]
+                if mask != distances[state]:
+                    distances[state] = mask
+                    changed = True
+        return distances
+
+    def __closure(self, states) -> frozenset:
+        reached = set(states)
+        pending = list(reached)
+        while pending:
+            for target in self.epsilon[pending.pop()]:
+                if target not in reached:
+                    reached.add(target)
+                    pending.append(target)
+        return frozenset(reached)
+
+    def __intern(self, depth: int, nfa_states: frozenset) -> _State:
+        key = (depth, nfa_states)
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = _State(depth, nfa_states)
+        return state
+
+    def __step(self, state: _State, char: str) -> _State:
+        """
+        Compute the state a character leads to and cache the transition.
+        :param state: State the character is typed in.
+        :param char: The character.
+        :return: The next state, self.dead when no pattern accepts the character there.
+        """
+        if char not in ALPHABET:
+            # Not cached, so arbitrary input can't grow the transition tables.
+            return self.dead
+        targets = [
+            target for nfa_state in state.nfa_states for characters, target in self.edges[nfa_state]
+            if char in characters
+        ]
+        if targets and state.depth < self.max_length:
+            target = self.__intern(state.depth + 1, self.__closure(targets))
+        else:
+            target = self.dead
+        state.transitions[char] = target
+        return target
+
+    def __suggestion(self, state: _State) -> Suggestion:
+        """
+        Describe the candidate formats of a state.
+        :param state: The state.
+        :return: Suggestion, also cached on the state.
+        """
+        masks = {}
+        for nfa_state in state.nfa_states:
+            format_index = self.state_format[nfa_state]
+            masks[format_index] = masks.get(format_index, 0) | self.distances[nfa_state]
+        carriers = []
+        candidates = []
+        for format_index in sorted(masks):
+            parser, tracking_format, dispatch_lengths = self.formats[format_index]
+            mask = masks[format_index]
+            lengths = [
+                state.depth + distance for distance in range(mask.bit_length())
+                if mask >> distance & 1 and state.depth + distance in dispatch_lengths
+            ]
+            if not lengths:
+                continue
+            if parser.carrier_name not in carriers:
+                carriers.append(parser.carrier_name)
+            candidates.append({
+                "carrier": parser.carrier_name,
+                "format": tracking_format.name,
+                "lengths": lengths,
+                "complete": lengths[0] == state.depth,
+            })
+        state.suggestion = Suggestion(carriers, candidates)
+        return state.suggestion
+
+    def determinize(self):
+        """
+        Compute every state and transition up front, eg. before the index is saved in an engine snapshot, so no lookup
+        has to. Only the transitions to live states are kept, a missing transition leads to the dead state from then on,
+        and the pattern states are dropped, which makes the index three times faster to load.
+        :return: None
+        """
+        pending = [self.root]
+        seen = {self.root}
+        while pending:
+            state = pending.pop()
+            if state.suggestion is None:
+                self.__suggestion(state)
+            for char in sorted(ALPHABET):
+                target = state.transitions.get(char) or self.__step(state, char)
+                if target is not self.dead and target not in seen:
+                    seen.add(target)
+                    pending.append(target)
+        self.__suggestion(self.dead)
+        for state in seen:
+            state.transitions = {char: target for char, target in state.transitions.items() if target is not self.dead}
+            state.nfa_states = None
+        self.states = {}
+        self.determinized = True
+
+    def suggest(self, key: str) -> Suggestion:
+        """
+        Find the formats a partial tracking number could be completed into.
+        :param key: The partial tracking number in canonical form, see canonicalize.
+        :return: Suggestion, shared between calls so it must not be modified.
+        """
+        state = self.root
+        for char in key:
+            next_state = state.transitions.get(char)
+            if next_state is None:
+                next_state = self.dead if self.determinized else self.__step(state, char)
+            state = next_state
+            if state is self.dead:
+                break
+        return state.suggestion or self.__suggestion(state)
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the tracking number parsing engine. Run a benchmark from the repository root with
+`python -m benchmarks.<name>`.
+"""
@@ -0,0 +1,71 @@
+"""
+Compare the scalar checksums in BaseParser with the vectorized kernels in app.checksum_kernels, checking they agree
+on every row.
+
+    python -m benchmarks.checksum_kernels [--size 100000]
+"""
+import argparse
+import random
+import time
+from functools import partial
+
+from app import checksum_kernels
+from app.parsers.base_parser import BaseParser
+
+CASES = [
+    (
+        "mod10",
+        14,
+        lambda serial, check: BaseParser.calculate_checksum_mod10([int(x) for x in serial], int(check), 1, 3),
+        partial(checksum_kernels.checksum_mod10, evens_multiplier=1, odds_multiplier=3),
+    ),
+    (
+        "mod7",
+        10,
+        lambda serial, check: BaseParser.calculate_checksum_mod7([int(x) for x in serial], int(check), 1, 1),
+        partial(checksum_kernels.checksum_mod7, even_multiplier=1, odd_multiplier=1),
+    ),
+    (
+        "weighted mod11",
+        11,
+        partial(BaseParser.sum_product_with_weightings_and_modulo, weightings=[3, 1, 7, 3, 1, 7, 3, 1, 7, 3, 1],
+                modulo1=11, modulo2=10),
+        partial(checksum_kernels.sum_product_with_weightings_and_modulo, weightings=[3, 1, 7, 3, 1, 7, 3, 1, 7, 3, 1],
+                modulo1=11, modulo2=10),
+    ),
+    (
+        "s10",
+        8,
+        lambda serial, check: BaseParser.s10_checksum(int(serial), int(check)),
+        checksum_kernels.s10_checksum,
+    ),
+]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=100_000, help="Number of candidates per checksum")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'checksum':<16}{'scalar (s)':>12}{'kernel (s)':>12}{'speedup':>10}")
+    for name, length, scalar, kernel in CASES:
+        serials = ["".join(rng.choices("0123456789", k=length)) for _ in range(args.size)]
+        checks = rng.choices("0123456789", k=args.size)
+
+        start = time.perf_counter()
+        expected = [scalar(serial, check) for serial, check in zip(serials, checks)]
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = kernel(checksum_kernels.digit_matrix(serials), checksum_kernels.check_digit_vector(checks))
+        kernel_time = time.perf_counter() - start
+
+        if actual.tolist() != expected:
+            raise SystemExit(f"{name}: kernel results differ from the scalar checksum")
+        print(f"{name:<16}{scalar_time:>12.4f}{kernel_time:>12.4f}{scalar_time / kernel_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
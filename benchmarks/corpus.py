@@ -0,0 +1,234 @@
+"""
+Generate corpora of checksum-valid tracking numbers for every format of every parser, plus realistic invalid noise.
+
+    python -m benchmarks.corpus --size 100000 -o corpus.tsv
+
+Numbers are generated from the formats' own patterns, so every pattern variant registered with add_format is covered
+without a hand written generator per carrier. The check digit of each candidate is then searched for with the
+format's checksum. Every valid number is checked to be dispatched to its format by the ParseManager. With --spaces,
+the valid numbers are written the way people type them, with spaces or hyphens between some of the characters.
+"""
+import argparse
+import random
+import string
+from typing import NamedTuple
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+
+# Characters picked from for regex categories.
+_CATEGORY_CHARACTERS = {
+    sre_constants.CATEGORY_DIGIT: string.digits,
+    sre_constants.CATEGORY_WORD: string.ascii_uppercase + string.digits,
+}
+# Repeats without an upper bound, such as \d+, stop at this many extra repetitions.
+_MAX_UNBOUNDED_REPEAT = 3
+# Separators put between characters of the valid numbers with --spaces, and the chance of one after each character.
+_SEPARATORS = [" ", " ", "-"]
+_SEPARATOR_RATE = 0.15
+
+
+class CorpusEntry(NamedTuple):
+    tracking_number: str
+    # Name of the carrier and format the number was generated for, empty for noise.
+    carrier: str
+    format_name: str
+    valid: bool
+
+
+def _generate(tokens, rng: random.Random) -> str:
+    """
+    Build a random string matching a parsed regex.
+    :param tokens: Parsed pattern as returned by sre_parse.parse.
+    :param rng: Random number generator.
+    :return: String matching the pattern.
+    """
+    out = []
+    for op, value in tokens:
+        if op == sre_constants.LITERAL:
+            out.append(chr(value))
+        elif op == sre_constants.IN:
+            out.append(_pick_from_set(value, rng))
+        elif op == sre_constants.ANY:
+            out.append(rng.choice(string.ascii_uppercase + string.digits))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, high, body = value
+            count = rng.randint(low, high if high != sre_constants.MAXREPEAT else low + _MAX_UNBOUNDED_REPEAT)
+            out.extend(_generate(body, rng) for _ in range(count))
+        elif op == sre_constants.SUBPATTERN:
+            out.append(_generate(value[-1], rng))
+        elif op == sre_constants.BRANCH:
+            out.append(_generate(rng.choice(value[1]), rng))
+        elif op == sre_constants.AT:
+            continue
+        else:
+            raise ValueError(f"Unsupported regex construct {op}")
+    return "".join(out)
+
+
+def _pick_from_set(items, rng: random.Random) -> str:
+    """
+    Pick a random character from a parsed character set.
+    :param items: Parsed items of the set, eg. [(RANGE, (48, 57))].
+    :param rng: Random number generator.
+    :return: String of one character.
+    """
+    choices = []
+    for op, value in items:
+        if op == sre_constants.LITERAL:
+            choices.append(chr(value))
+        elif op == sre_constants.RANGE:
+            choices.extend(chr(code) for code in range(value[0], value[1] + 1))
+        elif op == sre_constants.CATEGORY:
+            choices.extend(_CATEGORY_CHARACTERS[value])
+        else:
+            raise ValueError(f"Unsupported character set construct {op}")
+    return rng.choice(choices)
+
+
+def _add_separators(tracking_number: str, rng: random.Random) -> str:
+    """
+    Put random separators between the characters of a tracking number, which canonicalization removes again.
+    :param tracking_number: Canonical tracking number.
+    :param rng: Random number generator.
+    :return: The tracking number with separators.
+    """
+    out = [tracking_number[0]]
+    for char in tracking_number[1:]:
+        if rng.random() < _SEPARATOR_RATE:
+            out.append(rng.choice(_SEPARATORS))
+        out.append(char)
+    return "".join(out)
+
+
+def valid_numbers(parser, tracking_format, count: int, rng: random.Random, spaces: bool = False,
+                  attempts: int = 100) -> list:
+    """
+    Generate checksum-valid tracking numbers for one format.
+    :param parser: Parser the format belongs to.
+    :param tracking_format: The format to generate numbers for.
+    :param count: Number of tracking numbers to generate.
+    :param rng: Random number generator.
+    :param spaces: Whether to put separators between some of the characters of the numbers.
+    :param attempts: Candidates tried per number before giving up on the format.
+    :return: List of tracking number strings.
+    """
+    tokens = sre_parse.parse(tracking_format.regex.pattern)
+    numbers = []
+    while len(numbers) < count:
+        for _ in range(attempts):
+            candidate = _generate(tokens, rng)
+            match = tracking_format.regex.fullmatch(candidate)
+            if match is None:
+                continue
+            if "CheckDigit" not in tracking_format.regex.groupindex or match.group("CheckDigit") is None:
+                if parser.match(candidate, [tracking_format]):
+                    break
+                continue
+            position = match.start("CheckDigit")
+            for digit in rng.sample(string.digits, 10):
+                fixed = candidate[:position] + digit + candidate[position + 1:]
+                if parser.match(fixed, [tracking_format]):
+                    candidate = fixed
+                    break
+            else:
+                continue
+            break
+        else:
+            raise ValueError(f"Could not generate a valid {tracking_format.name} tracking number")
+        numbers.append(_add_separators(candidate, rng) if spaces else candidate)
+    return numbers
+
+
+def noise(count: int, rng: random.Random, valid: list = ()) -> list:
+    """
+    Generate tracking numbers that shouldn't parse: random digit runs of common tracking number lengths, random
+    alphanumerics, and valid numbers with a corrupted check digit.
+    :param count: Number of strings to generate.
+    :param rng: Random number generator.
+    :param valid: List of valid numbers to corrupt.
+    :return: List of strings.
+    """
+    strings = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4 or not valid:
+            length = rng.choice([10, 11, 12, 13, 15, 18, 20, 22, 26, 30, 34])
+            strings.append("".join(rng.choices(string.digits, k=length)))
+        elif kind < 0.7:
+            length = rng.randint(4, 40)
+            strings.append("".join(rng.choices(string.ascii_uppercase + string.digits, k=length)))
+        else:
+            number = list(rng.choice(valid))
+            digits = [index for index, char in enumerate(number) if char.isdigit()]
+            index = rng.choice(digits)
+            number[index] = str((int(number[index]) + rng.randint(1, 9)) % 10)
+            strings.append("".join(number))
+    return strings
+
+
+def build_corpus(parse_manager: ParseManager, size: int, noise_ratio: float = 0.3, spaces: bool = False,
+                 seed: int = 0) -> list:
+    """
+    Generate a shuffled corpus with valid numbers spread evenly over every format, plus noise.
+    :param parse_manager: ParseManager whose parsers' formats are generated.
+    :param size: Total number of entries.
+    :param noise_ratio: Fraction of the entries that are noise.
+    :param spaces: Whether to put separators between some of the characters of the valid numbers.
+    :param seed: Seed of the random number generator.
+    :return: List of CorpusEntry.
+    """
+    rng = random.Random(seed)
+    formats = [(parser, tracking_format) for parser in parse_manager.parsers for tracking_format in parser.formats]
+    valid_count = size - int(size * noise_ratio)
+    corpus = []
+    for index, (parser, tracking_format) in enumerate(formats):
+        count = valid_count // len(formats) + (index < valid_count % len(formats))
+        for number in valid_numbers(parser, tracking_format, count, rng, spaces):
+            corpus.append(CorpusEntry(number, parser.carrier_name, tracking_format.name, True))
+    # Noise isn't checked against the parsers, a corrupted number can still be valid for some other format.
+    for number in noise(size - len(corpus), rng, [entry.tracking_number for entry in corpus]):
+        corpus.append(CorpusEntry(number, "", "", False))
+    rng.shuffle(corpus)
+    return corpus
+
+
+def check_dispatch(parse_manager: ParseManager, corpus: list):
+    """
+    Make sure every valid corpus entry is parsed as its carrier, catching formats missing from the dispatch index.
+    :param parse_manager: ParseManager to check.
+    :param corpus: List of CorpusEntry.
+    :return: None
+    :raises AssertionError: If a valid number isn't recognised as the carrier it was generated for.
+    """
+    for entry in corpus:
+        if entry.valid:
+            carriers = [result.carrier for result in parse_manager.parse(entry.tracking_number)]
+            assert entry.carrier in carriers, f"{entry.format_name} number {entry.tracking_number!r} parsed as {carriers}"
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=100_000, help="Number of entries")
+    arg_parser.add_argument("--noise", type=float, default=0.3, help="Fraction of invalid entries")
+    arg_parser.add_argument("--spaces", action="store_true", help="Put separators inside the valid numbers")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("-o", "--output", default="corpus.tsv", help="Tab separated output file")
+    args = arg_parser.parse_args()
+
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    corpus = build_corpus(parse_manager, args.size, args.noise, args.spaces, args.seed)
+    check_dispatch(parse_manager, corpus)
+    with open(args.output, "w") as out:
+        for entry in corpus:
+            out.write(f"{entry.tracking_number}\t{entry.carrier}\t{entry.format_name}\t{int(entry.valid)}\n")
+
+
+if __name__ == "__main__":
+    main()
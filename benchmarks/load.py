@@ -0,0 +1,422 @@
+"""
+Load test the API end to end over HTTP: start it locally, drive it with an asyncio client at a given concurrency and
+request mix, and report the throughput, latency percentiles and error rate of every kind of request. Unlike the
+microbenchmarks this sees everything a request goes through: the event loop, the parse threads and their admission,
+request validation, response encoding and the HTTP server.
+
+    python -m benchmarks.load [--server uvicorn|gunicorn] [--concurrency 32] [--duration 20] [--rate 500]
+                              [--mix track=70,multi=5,batch=2,invalid=15,carriers=5,status=3] [-o load.json]
+                              [--compare previous.json]
+
+Request kinds, drawn from a corpus with the weights of --mix:
+- track: `POST /track/` with one valid tracking number.
+- multi: `POST /track/` with --multi-size tracking numbers, valid and noise.
+- batch: `POST /track/batch` with --batch-size tracking numbers, the response stream read to its end.
+- invalid: `POST /track/` with noise (404) or a tracking number over the length limit (422).
+- carriers: `GET /carriers`.
+- status: `GET /status`.
+
+Without --rate every connection sends its next request as soon as the previous one is answered (closed loop), which
+measures the throughput the server can sustain. With --rate requests are scheduled at that many per second across the
+connections (open loop) and latencies count from the scheduled time, so a server falling behind shows in the
+percentiles instead of slowing the client down. A response with another status than its kind expects, 429 and 503
+included, or a failed connection counts as an error. Event loop stalls show as tail latency of the light requests,
+carriers and status, under a mix with batches.
+
+The client runs on the same machine as the server and takes CPU from it, use --url to load a server running elsewhere.
+-o saves the results, with the git commit and the settings, as JSON, --compare prints the change from such a file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlsplit
+
+from app.parser_manager import MAX_TRACKING_NUMBER_LENGTH, ParseManager
+from app.result_cache import ResultCache
+from benchmarks.corpus import build_corpus
+from benchmarks.startup import ROOT, free_port
+from benchmarks.suite import percentile
+
+DEFAULT_MIX = "track=70,multi=5,batch=2,invalid=15,carriers=5,status=3"
+KINDS = ("track", "multi", "batch", "invalid", "carriers", "status")
+# Percentiles reported, as fractions.
+PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99, "p999": 0.999}
+
+
+class HTTPConnection:
+    """
+    Minimal HTTP/1.1 client connection over asyncio streams, kept alive between requests. Reads Content-Length and
+    chunked response bodies, which is all the API sends.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method: str, target: str, body: bytes = b"", content_type: str = "text/plain") -> tuple:
+        """
+        Send a request and read the whole response.
+        :param method: HTTP method.
+        :param target: Path and query string.
+        :param body: Request body.
+        :param content_type: Content type of the body.
+        :return: Tuple of the status code and the length of the response body.
+        :raises OSError: If the connection fails, it is closed and reopened by the next request.
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            head = f"{method} {target} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+            if body:
+                head += f"Content-Type: {content_type}\r\n"
+            self.writer.write(head.encode() + b"\r\n" + body)
+            await self.writer.drain()
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionResetError("Connection closed by the server")
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = await self.__read_body(headers)
+            if headers.get("connection", "").lower() == "close":
+                self.close()
+            return status, length
+        except BaseException:
+            self.close()
+            raise
+
+    async def __read_body(self, headers: dict) -> int:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            length = 0
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Trailers, up to the blank line ending the message.
+                    while (await self.reader.readline()) not in (b"\r\n", b""):
+                        pass
+                    return length
+                await self.reader.readexactly(size + 2)
+                length += size
+        length = int(headers.get("content-length", 0))
+        if length:
+            await self.reader.readexactly(length)
+        return length
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class RequestMix:
+    """
+    Builds the requests of every kind from a corpus, and draws kinds with the weights of the mix.
+    """
+
+    def __init__(self, mix: dict, multi_size: int, batch_size: int, size: int, seed: int):
+        parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+        corpus = build_corpus(parse_manager, size, seed=seed)
+        self.valid = [entry.tracking_number for entry in corpus if entry.valid]
+        # Noise that still looks like some carrier's number is answered with 200, only keep what nothing recognises.
+        self.noise = [
+            entry.tracking_number for entry in corpus
+            if not entry.valid and entry.tracking_number.strip() and not parse_manager.parse(entry.tracking_number)
+        ]
+        self.everything = [entry.tracking_number for entry in corpus]
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.multi_size = multi_size
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+
+    def draw(self) -> tuple:
+        """
+        Draw the next request.
+        :return: Tuple of the kind, method, target, body and the set of status codes expected.
+        """
+        rng = self.rng
+        kind = rng.choices(self.kinds, self.weights)[0]
+        if kind == "track":
+            return kind, "POST", f"/track/?tracking_number={quote(rng.choice(self.valid))}", b"", {200}
+        if kind == "multi":
+            numbers = rng.sample(self.everything, self.multi_size)
+            query = "&".join(f"tracking_number={quote(number)}" for number in numbers)
+            return kind, "POST", f"/track/?{query}", b"", {200, 404}
+        if kind == "batch":
+            start = rng.randrange(max(len(self.everything) - self.batch_size, 1))
+            body = "\n".join(self.everything[start:start + self.batch_size]).encode()
+            return kind, "POST", "/track/batch", body, {200}
+        if kind == "invalid":
+            if rng.random() < 0.8:
+                return kind, "POST", f"/track/?tracking_number={quote(rng.choice(self.noise))}", b"", {404}
+            return kind, "POST", f"/track/?tracking_number={'1' * (MAX_TRACKING_NUMBER_LENGTH + 1)}", b"", {422}
+        if kind == "carriers":
+            return kind, "GET", "/carriers", b"", {200}
+        return kind, "GET", "/status", b"", {200}
+
+
+class Recorder:
+    """
+    Latencies, status codes and errors per kind of request.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.response_bytes = {}
+
+    def record(self, kind: str, latency: float, status: int or str, error: bool, length: int = 0):
+        self.latencies.setdefault(kind, []).append(latency)
+        statuses = self.statuses.setdefault(kind, {})
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        self.errors[kind] = self.errors.get(kind, 0) + error
+        self.response_bytes[kind] = self.response_bytes.get(kind, 0) + length
+
+    def summary(self, duration: float) -> dict:
+        """
+        Summarize the recorded requests.
+        :param duration: Seconds the requests were recorded over.
+        :return: Dictionary of kind, and "all" for every request, to its request count, requests per second, error
+            count and rate, latency percentiles and maximum in milliseconds, and status code counts.
+        """
+        results = {}
+        everything = sorted(latency for latencies in self.latencies.values() for latency in latencies)
+        for kind in sorted(self.latencies, key=KINDS.index) + ["all"]:
+            if kind == "all":
+                latencies = everything
+                statuses = {}
+                for kind_statuses in self.statuses.values():
+                    for status, count in kind_statuses.items():
+                        statuses[status] = statuses.get(status, 0) + count
+                errors = sum(self.errors.values())
+            else:
+                latencies = sorted(self.latencies[kind])
+                statuses = self.statuses[kind]
+                errors = self.errors[kind]
+            results[kind] = {
+                "requests": len(latencies),
+                "requests_per_sec": len(latencies) / duration,
+                "errors": errors,
+                "error_rate": errors / len(latencies),
+                **{f"{name}_ms": percentile(latencies, fraction) * 1e3 for name, fraction in PERCENTILES.items()},
+                "max_ms": latencies[-1] * 1e3,
+                "statuses": statuses,
+            }
+        return results
+
+
+async def run_load(host: str, port: int, mix: RequestMix, concurrency: int, duration: float, warmup: float,
+                   rate: float or None) -> tuple:
+    """
+    Send requests from concurrency connections until the duration is over.
+    :param host: Host of the server.
+    :param port: Port of the server.
+    :param mix: RequestMix drawing the requests.
+    :param concurrency: Number of connections, each with one request in flight at a time.
+    :param duration: Seconds to record requests for, after the warmup.
+    :param warmup: Seconds of requests sent first and not recorded.
+    :param rate: Requests per second to schedule, None to send as fast as the server answers.
+    :return: Tuple of the Recorder and the seconds requests were recorded over.
+    """
+    recorder = Recorder()
+    clock = time.perf_counter
+    started = clock()
+    record_from = started + warmup
+    end = record_from + duration
+    scheduled = 0
+
+    async def user():
+        nonlocal scheduled
+        connection = HTTPConnection(host, port)
+        try:
+            while True:
+                if rate:
+                    send_at = started + scheduled / rate
+                    scheduled += 1
+                    delay = send_at - clock()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    send_at = clock()
+                if send_at >= end:
+                    return
+                kind, method, target, body, expected = mix.draw()
+                try:
+                    status, length = await connection.request(method, target, body)
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    status, length = type(e).__name__, 0
+                finished = clock()
+                if send_at >= record_from:
+                    recorder.record(kind, finished - send_at, status, status not in expected, length)
+        finally:
+            connection.close()
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return recorder, min(clock(), end) - record_from
+
+
+async def wait_until_up(host: str, port: int, server: subprocess.Popen or None, timeout: float = 60):
+    """
+    Wait for the server to answer /status.
+    :raises RuntimeError: If the server exits or doesn't answer in time.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}")
+        connection = HTTPConnection(host, port)
+        try:
+            if (await connection.request("GET", "/status"))[0] == 200:
+                return
+        except OSError:
+            await asyncio.sleep(0.05)
+        finally:
+            connection.close()
+    raise RuntimeError("Server didn't answer in time")
+
+
+def start_server(kind: str, port: int, workers: int or None, directory: str) -> subprocess.Popen:
+    """
+    Start the API locally.
+    :param kind: "uvicorn" for a single process, "gunicorn" for the pre-fork server of gunicorn.conf.py.
+    :param port: Port to listen on.
+    :param workers: Number of gunicorn workers, None for its default.
+    :param directory: Directory for the job database, bulk job workers aren't started.
+    :return: The server process.
+    """
+    env = dict(os.environ, JOB_WORKERS="0", JOB_DATABASE=os.path.join(directory, "jobs.sqlite3"))
+    if kind == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "app.main:app", "--bind", f"127.0.0.1:{port}",
+                   "--log-level", "warning"]
+        if workers:
+            command += ["--workers", str(workers)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def git_commit() -> str or None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(spec: str) -> dict:
+    """
+    Parse a request mix.
+    :param spec: Comma separated kind=weight pairs, eg. "track=90,status=10".
+    :return: Dictionary of kind to weight.
+    :raises argparse.ArgumentTypeError: If a kind is unknown or a weight isn't a positive number.
+    """
+    mix = {}
+    for item in spec.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown request kind {kind!r}, expected one of {', '.join(KINDS)}")
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight {weight!r} for {kind}")
+        if mix[kind] <= 0:
+            raise argparse.ArgumentTypeError(f"Invalid weight {weight!r} for {kind}")
+    return mix
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--server", choices=("uvicorn", "gunicorn"), default="uvicorn", help="Server to start")
+    arg_parser.add_argument("--workers", type=int, help="Number of gunicorn workers, the CPUs available by default")
+    arg_parser.add_argument("--url", help="Load a running server instead, eg. http://127.0.0.1:8000")
+    arg_parser.add_argument("--concurrency", type=int, default=32, help="Number of connections")
+    arg_parser.add_argument("--duration", type=float, default=20, help="Seconds of recorded load")
+    arg_parser.add_argument("--warmup", type=float, default=3, help="Seconds of load before recording")
+    arg_parser.add_argument("--rate", type=float, help="Requests per second to schedule, as fast as possible if omitted")
+    arg_parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="Weights of the request kinds")
+    arg_parser.add_argument("--multi-size", type=int, default=10, help="Tracking numbers per multi request")
+    arg_parser.add_argument("--batch-size", type=int, default=1_000, help="Tracking numbers per batch request")
+    arg_parser.add_argument("--size", type=int, default=20_000, help="Number of corpus entries")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    arg_parser.add_argument("--compare", help="Results file of an earlier run to compare with")
+    args = arg_parser.parse_args()
+
+    mix = RequestMix(args.mix, args.multi_size, args.batch_size, args.size, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            host, port = "127.0.0.1", free_port()
+            server = start_server(args.server, port, args.workers, directory)
+        try:
+            asyncio.run(wait_until_up(host, port, server))
+            recorder, duration = asyncio.run(
+                run_load(host, port, mix, args.concurrency, args.duration, args.warmup, args.rate)
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    results = recorder.summary(duration)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)["results"]
+    print(f"{'kind':<10}{'requests':>10}{'req/s':>10}{'errors':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'p99.9 ms':>10}{'max ms':>9}{'vs req/s':>10}{'vs p99':>9}")
+    for kind, result in results.items():
+        changes = ["", ""]
+        if kind in previous:
+            changes = [
+                f"{result['requests_per_sec'] / previous[kind]['requests_per_sec'] - 1:+.1%}",
+                f"{result['p99_ms'] / previous[kind]['p99_ms'] - 1:+.1%}",
+            ]
+        print(f"{kind:<10}{result['requests']:>10}{result['requests_per_sec']:>10.1f}{result['error_rate']:>9.2%}"
+              f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['p999_ms']:>10.2f}"
+              f"{result['max_ms']:>9.1f}{changes[0]:>10}{changes[1]:>9}")
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "server": args.url or args.server,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "duration": duration,
+            "rate": args.rate,
+            "mix": args.mix,
+            "multi_size": args.multi_size,
+            "batch_size": args.batch_size,
+            "corpus_size": args.size,
+            "seed": args.seed,
+            "results": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
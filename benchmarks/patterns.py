@@ -0,0 +1,83 @@
+"""
+Time the format patterns on their own, per format, over the numbers the dispatch index hands to them, along with the
+canonicalization every number goes through first.
+
+    python -m benchmarks.patterns [--size 20000] [--spaces]
+
+Loop overhead is measured separately and subtracted, so the per call times are the time spent inside the regex engine.
+"""
+import argparse
+import time
+from collections import defaultdict
+
+from app.parser_manager import ParseManager
+from app.parsers.base_parser import canonicalize
+from app.result_cache import ResultCache
+from benchmarks.corpus import build_corpus
+
+
+def best_of(repeat: int, func) -> float:
+    """
+    Run a function several times.
+    :param repeat: Number of runs.
+    :param func: Callable without arguments.
+    :return: Fastest run in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def time_calls(calls: list, repeat: int) -> float:
+    """
+    Time a list of single argument calls, minus the cost of looping over them.
+    :param calls: List of (callable, argument) tuples.
+    :param repeat: Number of runs, the fastest is kept.
+    :return: Seconds spent inside the calls.
+    """
+    def run():
+        for func, argument in calls:
+            func(argument)
+
+    def loop():
+        for func, argument in calls:
+            pass
+
+    return max(0.0, best_of(repeat, run) - best_of(repeat, loop))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=20_000, help="Number of corpus entries")
+    arg_parser.add_argument("--spaces", action="store_true", help="Put separators inside the valid numbers")
+    arg_parser.add_argument("--repeat", type=int, default=7, help="Runs per measurement, the fastest is kept")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    tracking_numbers = [
+        entry.tracking_number for entry in build_corpus(parse_manager, args.size, spaces=args.spaces, seed=args.seed)
+    ]
+    calls_by_format = defaultdict(list)
+    for tracking_number in tracking_numbers:
+        key = canonicalize(tracking_number)
+        for parser, formats in parse_manager.candidate_formats(key):
+            for tracking_format in formats:
+                calls_by_format[tracking_format.name].append((tracking_format.regex.fullmatch, key))
+
+    canonicalize_time = time_calls([(canonicalize, number) for number in tracking_numbers], args.repeat)
+    print(f"{'format':<26}{'calls':>8}{'us/call':>10}")
+    print(f"{'(canonicalize)':<26}{len(tracking_numbers):>8}{canonicalize_time * 1e6 / len(tracking_numbers):>10.3f}")
+    total = canonicalize_time
+    for name, calls in sorted(calls_by_format.items()):
+        elapsed = time_calls(calls, args.repeat)
+        total += elapsed
+        print(f"{name:<26}{len(calls):>8}{elapsed * 1e6 / len(calls):>10.3f}")
+    print(f"total {total * 1e3:.1f} ms, {total * 1e6 / len(tracking_numbers):.3f} us per tracking number")
+
+
+if __name__ == "__main__":
+    main()
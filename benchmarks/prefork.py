@@ -0,0 +1,145 @@
+"""
+Measure how much memory the workers of the pre-fork server share, see gunicorn.conf.py. The server is started with
+gunicorn.conf.py, with the app preloaded but without gc.freeze, and without preloading, where every worker builds its
+own engine. The memory of the workers is read from /proc once they have booted and again after they parsed some
+batches, so Linux only.
+
+    python -m benchmarks.prefork [--workers 4] [--requests 40] [--snapshot engine.snapshot]
+
+Reported per configuration and moment, averaged over the workers: the resident memory, the proportional share of it
+(PSS, shared pages split between the processes mapping them), the pages the worker has to itself and the pages it
+shares. Bulk job workers are left out (JOB_WORKERS=0).
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+from benchmarks.corpus import build_corpus
+from benchmarks.startup import ROOT, free_port
+
+# Gunicorn settings of the configurations compared with gunicorn.conf.py.
+_BASE_CONFIG = 'import os\nos.environ.setdefault("PARSE_WORKERS", "1")\nworker_class = "app.server.TrackingWorker"\n'
+CONFIGS = {
+    "prefork": None,
+    "no freeze": _BASE_CONFIG + "preload_app = True\n",
+    "no preload": _BASE_CONFIG + "preload_app = False\n",
+}
+
+
+def memory(pid: int) -> dict:
+    """
+    Read the memory of a process.
+    :param pid: The process id.
+    :return: Dictionary with the rss, pss, private and shared memory in MB.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+        "shared": fields["Shared_Clean"] + fields["Shared_Dirty"],
+    }
+
+
+def workers_memory(master: int) -> dict:
+    """
+    Average the memory of the workers of a gunicorn master.
+    :param master: Pid of the master.
+    :return: Dictionary like memory's, averaged over the workers.
+    """
+    with open(f"/proc/{master}/task/{master}/children") as file:
+        children = [memory(int(pid)) for pid in file.read().split()]
+    return {key: sum(child[key] for child in children) / len(children) for key in children[0]}
+
+
+def request(port: int, method: str, path: str, body: bytes = None, timeout: float = 60) -> int:
+    """
+    Send a request to the server and read the whole response.
+    :return: Status code of the response.
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        connection.request(method, path, body, {"Content-Type": "text/plain"})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def measure(config: str or None, workers: int, body: bytes, requests: int, env: dict, timeout: float = 120) -> tuple:
+    """
+    Start the server, measure its workers after boot and after parsing some batches.
+    :param config: Contents of the gunicorn configuration, None for gunicorn.conf.py.
+    :param workers: Number of workers.
+    :param body: Body of the batch requests.
+    :param requests: Number of batch requests sent.
+    :param env: Environment of the server.
+    :param timeout: Seconds to wait for the server to boot.
+    :return: Tuple of the workers' memory after boot and after the batches, see workers_memory.
+    """
+    port = free_port()
+    with tempfile.NamedTemporaryFile("w", suffix=".py") as config_file:
+        config_file.write(config or "")
+        config_file.flush()
+        command = [sys.executable, "-m", "gunicorn", "app.main:app", "--workers", str(workers),
+                   "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+        if config is not None:
+            command += ["--config", config_file.name]
+        server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            started = time.perf_counter()
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"Server exited with {server.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError("Server didn't answer in time")
+                try:
+                    if request(port, "GET", "/status") == 200:
+                        break
+                except OSError:
+                    time.sleep(0.05)
+            # The other workers boot alongside the one that answered, give them time to settle.
+            time.sleep(2)
+            booted = workers_memory(server.pid)
+            for _ in range(requests):
+                request(port, "POST", "/track/batch", body)
+            return booted, workers_memory(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--workers", type=int, default=4)
+    arg_parser.add_argument("--requests", type=int, default=40, help="Batch requests sent after boot")
+    arg_parser.add_argument("--size", type=int, default=20_000, help="Tracking numbers per batch")
+    arg_parser.add_argument("--snapshot", default="", help="Engine snapshot to load, the definitions if omitted")
+    args = arg_parser.parse_args()
+
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    body = "\n".join(entry.tracking_number for entry in build_corpus(parse_manager, args.size)).encode()
+    env = dict(os.environ, JOB_WORKERS="0", ENGINE_SNAPSHOT=args.snapshot)
+    print(f"{args.workers} workers, MB per worker")
+    print(f"{'server':<12}{'moment':<10}{'rss':>8}{'pss':>8}{'private':>9}{'shared':>8}")
+    for name, config in CONFIGS.items():
+        booted, loaded = measure(config, args.workers, body, args.requests, env)
+        for moment, usage in (("boot", booted), ("batches", loaded)):
+            print(f"{name:<12}{moment:<10}{usage['rss']:>8.1f}{usage['pss']:>8.1f}{usage['private']:>9.1f}"
+                  f"{usage['shared']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Search every format pattern, and the ParseManager and free text scanner as a whole, for inputs whose matching time
+grows faster than their length, the signature of catastrophic backtracking.
+
+    python -m benchmarks.regex_fuzz [--rounds 200]
+
+Each target is timed on families of adversarial inputs of two lengths: runs of a single character class, the format's
+prefixes followed by such runs with a mismatching last character, valid numbers repeated, and mutations searched for
+at random that maximize the growth. The growth exponent of the time between the two lengths is reported, and the run
+exits with 1 if any target grows faster than --max-exponent.
+"""
+import argparse
+import math
+import random
+import string
+import sys
+import time
+
+from app.extraction import TrackingNumberScanner
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+from benchmarks.corpus import valid_numbers
+
+LENGTHS = (1024, 4096)
+_ALPHABET = string.digits + string.ascii_uppercase + " -"
+
+
+def time_call(func, argument, repeat: int = 5) -> float:
+    """
+    Time a single call.
+    :param func: Callable taking one argument.
+    :param argument: The argument.
+    :param repeat: Number of runs, the fastest is kept.
+    :return: Seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(argument)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def stretch(seed: str, length: int) -> str:
+    """
+    Repeat a string up to a length.
+    :param seed: Non empty string.
+    :param length: Length of the result.
+    :return: String of the given length.
+    """
+    return (seed * (length // len(seed) + 1))[:length]
+
+
+def seed_inputs(prefixes: list, samples: list) -> list:
+    """
+    Build the seeds the adversarial inputs are stretched from.
+    :param prefixes: Dispatch prefixes of the target.
+    :param samples: Valid numbers of the target.
+    :return: List of (prefix, body, tail) tuples, the body being repeated to reach the wanted length.
+    """
+    seeds = [("", "0", ""), ("", "0", "!"), ("", "0 ", "X"), ("", "A0", "")]
+    for prefix in prefixes:
+        seeds.append((prefix, "0", "!"))
+        seeds.append((prefix, "9 ", "A"))
+    for sample in samples:
+        seeds.append(("", sample, ""))
+        seeds.append(("", sample[:-1], "!"))
+    return seeds
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    """
+    Apply a random edit: replace, insert or delete a character, or duplicate a slice.
+    :param text: String to mutate.
+    :param rng: Random number generator.
+    :return: The mutated string.
+    """
+    position = rng.randrange(len(text) + 1)
+    kind = rng.random()
+    if kind < 0.4 and position < len(text):
+        return text[:position] + rng.choice(_ALPHABET) + text[position + 1:]
+    if kind < 0.7:
+        return text[:position] + rng.choice(_ALPHABET) + text[position:]
+    if kind < 0.8 and position < len(text):
+        return text[:position] + text[position + 1:]
+    end = min(len(text), position + rng.randint(1, 8))
+    return text[:end] + text[position:end] + text[end:]
+
+
+def growth(func, seed: tuple) -> tuple:
+    """
+    Measure how the time of a target grows over inputs stretched from a seed.
+    :param func: Target callable taking one string.
+    :param seed: (prefix, body, tail) tuple.
+    :return: Tuple of the growth exponent and the seconds taken at the longest length.
+    """
+    prefix, body, tail = seed
+    # Measured between the two longest lengths, short inputs are dominated by constant costs.
+    times = [time_call(func, prefix + stretch(body, length) + tail) for length in LENGTHS[-2:]]
+    # Floor the times at a microsecond so timer noise on trivially fast calls doesn't read as growth.
+    exponent = math.log(max(times[1], 1e-6) / max(times[0], 1e-6)) / math.log(LENGTHS[-1] / LENGTHS[-2])
+    return exponent, times[1]
+
+
+def search(func, seeds: list, rounds: int, rng: random.Random) -> tuple:
+    """
+    Hill climb from the seeds towards inputs that maximize the growth of the target's time.
+    :param func: Target callable taking one string.
+    :param seeds: Seeds as built by seed_inputs.
+    :param rounds: Number of mutations tried.
+    :param rng: Random number generator.
+    :return: Tuple of the worst growth exponent, the seconds it took at the longest length and its seed.
+    """
+    worst = max(((growth(func, seed), seed) for seed in seeds), key=lambda item: item[0][0])
+    (exponent, elapsed), seed = worst
+    for _ in range(rounds):
+        prefix, body, tail = seed
+        candidate = (prefix, mutate(body, rng) or body, mutate(tail, rng) if rng.random() < 0.3 else tail)
+        candidate_exponent, candidate_elapsed = growth(func, candidate)
+        if candidate_exponent > exponent:
+            exponent, elapsed, seed = candidate_exponent, candidate_elapsed, candidate
+    return exponent, elapsed, seed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--rounds", type=int, default=200, help="Mutations tried per target")
+    arg_parser.add_argument("--max-exponent", type=float, default=1.5, help="Largest growth exponent tolerated")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(args.seed)
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1, max_length=sys.maxsize)
+    scanner = TrackingNumberScanner(parse_manager)
+    targets = []
+    all_prefixes = set()
+    all_samples = []
+    for parser in parse_manager.parsers:
+        for tracking_format in parser.formats:
+            prefixes = sorted({prefix for length, prefix in tracking_format.dispatch_keys if prefix})[:5]
+            samples = valid_numbers(parser, tracking_format, 2, rng)
+            all_prefixes.update(prefixes)
+            all_samples.extend(samples)
+            targets.append((f"{tracking_format.name} fullmatch", tracking_format.regex.fullmatch, prefixes, samples))
+            targets.append((f"{tracking_format.name} search", tracking_format.regex.search, prefixes, samples))
+    all_prefixes = sorted(all_prefixes)[:10]
+    targets.append(("ParseManager.parse", parse_manager.parse, all_prefixes, all_samples[:10]))
+    targets.append(("TrackingNumberScanner.extract", scanner.extract, all_prefixes, all_samples[:10]))
+
+    failed = False
+    print(f"{'target':<40}{'exponent':>10}{f'ms @ {LENGTHS[-1]}':>12}  worst seed")
+    for name, func, prefixes, samples in targets:
+        exponent, elapsed, seed = search(func, seed_inputs(prefixes, samples), args.rounds, rng)
+        flag = ""
+        if exponent > args.max_exponent:
+            flag = "  SUPER-LINEAR"
+            failed = True
+        print(f"{name:<40}{exponent:>10.2f}{elapsed * 1e3:>12.3f}  {seed!r:.60}{flag}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Compare ParseResult with the result dictionaries the parsers used to build, on the valid numbers of a corpus: the
+memory each result holds on to, and the time to encode the /track responses and /batch lines made of them.
+
+    python -m benchmarks.results [--size 20000]
+
+The dictionaries are encoded the way FastAPI encodes a response_model route, validating the response against
+TrackingResponse before json.dumps, and the batch lines with json.dumps. ParseResult goes through
+app.serialization.dumps on both paths.
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from pydantic import TypeAdapter
+
+from app.models import TrackingResponse
+from app.parser_manager import ParseManager
+from app.parsers.base_parser import canonicalize
+from app.result_cache import ResultCache
+from app.serialization import dumps
+from benchmarks.corpus import build_corpus
+from benchmarks.patterns import best_of
+
+
+def dict_result(format_match) -> dict:
+    """
+    Build the result dictionary of a match the way the parsers did before ParseResult.
+    :param format_match: The validated match.
+    :return: Dictionary of the result.
+    """
+    parser = format_match.parser
+    tracking_number = format_match.match.string
+    ret = {
+        "carrier": parser.carrier_name,
+        "trackingNumber": tracking_number,
+    }
+    if parser.tracking_url_template:
+        ret["trackingUrl"] = parser.tracking_url_template % tracking_number
+    groups = format_match.match.groupdict()
+    for constructor in parser.constructors:
+        if groups.get(constructor):
+            ret[constructor] = groups[constructor]
+    for group, table in getattr(parser, "lookups", ()):
+        decoded = table.get(ret.get(group))
+        if decoded:
+            ret.update(zip(*decoded))
+    return ret
+
+
+def retained_bytes(build, format_matches: list) -> float:
+    """
+    Measure the memory held by the results built from some matches.
+    :param build: Callable building a result from a FormatMatch.
+    :param format_matches: List of FormatMatch.
+    :return: Bytes allocated and still referenced per result, the list holding them included.
+    """
+    gc.collect()
+    tracemalloc.start()
+    results = [build(format_match) for format_match in format_matches]
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return current / len(results)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=20_000, help="Number of corpus entries")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the fastest is kept")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    format_matches = []
+    for entry in build_corpus(parse_manager, args.size, seed=args.seed):
+        key = canonicalize(entry.tracking_number)
+        for parser, formats in parse_manager.candidate_formats(key):
+            format_match = parser.match_canonical(key, formats)
+            if format_match is not None:
+                format_matches.append(format_match)
+
+    print(f"{'result':<14}{'bytes/result':>14}")
+    for name, build in (("dict", dict_result), ("ParseResult", lambda match: match.parser.build_result(match))):
+        print(f"{name:<14}{retained_bytes(build, format_matches):>14.1f}")
+
+    parse_results = [format_match.parser.build_result(format_match) for format_match in format_matches]
+    dict_results = [result.to_dict() for result in parse_results]
+    adapter = TypeAdapter(TrackingResponse)
+
+    def track_response(tracking_number: str, results: list, carriers: list, urls: list) -> dict:
+        return {
+            "detail": "Tracking number parsed successfully",
+            "tracking_number": [tracking_number],
+            "carriers": carriers,
+            "results": results,
+            "trackingUrl": urls,
+        }
+
+    def track_dicts():
+        for result in dict_results:
+            content = track_response(
+                result["trackingNumber"], [result], [result["carrier"]],
+                [result["trackingUrl"]] if "trackingUrl" in result else []
+            )
+            json.dumps(
+                adapter.dump_python(adapter.validate_python(content), mode="json"),
+                ensure_ascii=False, allow_nan=False, separators=(",", ":")
+            ).encode()
+
+    def track_parse_results():
+        for result in parse_results:
+            dumps(track_response(
+                result.tracking_number, [result], [result.carrier],
+                [result.tracking_url] if result.tracking_url_template else []
+            ))
+
+    def batch_dicts():
+        for index, result in enumerate(dict_results):
+            json.dumps({"index": index, "tracking_number": result["trackingNumber"], "carriers": [result["carrier"]],
+                        "results": [result]}) + "\n"
+
+    def batch_parse_results():
+        for index, result in enumerate(parse_results):
+            dumps({"index": index, "tracking_number": result.tracking_number, "carriers": [result.carrier],
+                   "results": [result]}) + b"\n"
+
+    print(f"{'encoding':<14}{'dict us':>10}{'ParseResult us':>16}{'speedup':>10}")
+    for name, legacy, current in (("/track", track_dicts, track_parse_results),
+                                  ("/batch line", batch_dicts, batch_parse_results)):
+        legacy_time = best_of(args.repeat, legacy) / len(parse_results)
+        current_time = best_of(args.repeat, current) / len(parse_results)
+        print(f"{name:<14}{legacy_time * 1e6:>10.3f}{current_time * 1e6:>16.3f}{legacy_time / current_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
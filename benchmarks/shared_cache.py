@@ -0,0 +1,118 @@
+"""
+Compare a parse result cache per worker process with one SharedResultCache for all of them, as the number of workers
+grows. A stream of requests with repeat traffic, the corpus numbers drawn with a Zipf distribution, is dealt round robin
+to the workers the way a load balancer would, and every worker parses its share with ParseManager.parse.
+
+    python -m benchmarks.shared_cache [--size 20000] [--requests 200000] [--workers 1 2 4]
+
+Reported per cache and worker count: the hit rate across the workers, the requests each worker parsed per second, the
+results held and the memory they take. Per process caches are sized with tracemalloc, the shared cache by the pages of
+its file plus the front caches of the workers.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+from app.shared_cache import SharedResultCache
+from benchmarks.corpus import build_corpus
+
+
+def run_worker(tracking_numbers: list, capacity: int, path: str or None) -> dict:
+    """
+    Parse a worker's share of the requests.
+    :param tracking_numbers: The worker's requests, in order.
+    :param capacity: Capacity of the cache.
+    :param path: Path of the shared cache file, None for a cache of the worker's own.
+    :return: Dictionary with the worker's hits, misses, seconds spent and the results its cache holds.
+    """
+    cache = SharedResultCache(path, capacity) if path else ResultCache(capacity)
+    parse_manager = ParseManager(cache=cache, workers=1)
+    started = time.perf_counter()
+    for tracking_number in tracking_numbers:
+        parse_manager.parse(tracking_number)
+    return {
+        "hits": cache.hits,
+        "misses": cache.misses,
+        "seconds": time.perf_counter() - started,
+        "size": len(cache),
+        "local": len(cache.local) if path else 0,
+    }
+
+
+def result_size(tracking_numbers: list, capacity: int) -> float:
+    """
+    Measure the memory a per process cache takes per result.
+    :param tracking_numbers: Numbers to fill the cache with.
+    :param capacity: Capacity of the cache.
+    :return: Average bytes per cached result.
+    """
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    cache = ResultCache(capacity)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for tracking_number in tracking_numbers:
+        cache.put(tracking_number, parse_manager.parse(tracking_number))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / max(len(cache), 1)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=20_000, help="Number of corpus entries")
+    arg_parser.add_argument("--requests", type=int, default=200_000, help="Number of requests across the workers")
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    arg_parser.add_argument("--capacity", type=int, default=100_000, help="Capacity of the cache")
+    arg_parser.add_argument("--skew", type=float, default=1.0, help="Exponent of the Zipf distribution")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    population = list(dict.fromkeys(entry.tracking_number for entry in build_corpus(parse_manager, args.size,
+                                                                                      seed=args.seed)))
+    rng = random.Random(args.seed)
+    rng.shuffle(population)
+    requests = rng.choices(population, weights=[1 / rank ** args.skew for rank in range(1, len(population) + 1)],
+                           k=args.requests)
+    bytes_per_result = result_size(population, args.capacity)
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    path = os.path.join(directory, f"benchmark-cache-{os.getpid()}")
+
+    print(f"{len(requests)} requests over {len(population)} distinct numbers, "
+          f"{len(set(requests))} of them requested")
+    print(f"{'cache':<10}{'workers':>8}{'hit rate':>10}{'req/s':>10}{'results':>10}{'memory MB':>11}")
+    context = multiprocessing.get_context("spawn")
+    for workers in args.workers:
+        shares = [requests[worker::workers] for worker in range(workers)]
+        for name in ("process", "shared"):
+            if name == "shared":
+                for stale in (path, path + ".lock"):
+                    if os.path.exists(stale):
+                        os.unlink(stale)
+            with context.Pool(workers) as pool:
+                reports = pool.starmap(
+                    run_worker, [(share, args.capacity, path if name == "shared" else None) for share in shares]
+                )
+            hits = sum(report["hits"] for report in reports)
+            lookups = hits + sum(report["misses"] for report in reports)
+            throughput = len(requests) / max(report["seconds"] for report in reports) / workers
+            if name == "shared":
+                results = len(SharedResultCache(path, args.capacity))
+                memory = os.stat(path).st_blocks * 512 + sum(report["local"] for report in reports) * bytes_per_result
+                os.unlink(path)
+                os.unlink(path + ".lock")
+            else:
+                results = sum(report["size"] for report in reports)
+                memory = results * bytes_per_result
+            print(f"{name:<10}{workers:>8}{hits / lookups:>10.3f}{throughput:>10.0f}{results:>10}"
+                  f"{memory / 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure cold start: the time a fresh interpreter takes to import the app, and the time from launching uvicorn to the
+first answered tracking request, with the engine built from the carrier definitions and loaded from a snapshot.
+
+    python -m benchmarks.startup [--runs 5] [--snapshot engine.snapshot]
+
+Without --snapshot a snapshot is built into a temporary directory first. Every run starts a new process, the median
+and the fastest run are reported.
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from app.snapshot import build_snapshot, save_snapshot
+
+ROOT = Path(__file__).resolve().parent.parent
+# Tracking request sent to the server once it is up.
+FIRST_REQUEST = "/track/?tracking_number=1Z999AA10123456784"
+_IMPORT_SCRIPT = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def import_time(env: dict) -> float:
+    """
+    Import the app in a fresh interpreter.
+    :param env: Environment of the interpreter.
+    :return: Seconds the import took.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    """
+    Find a TCP port nothing listens on.
+    :return: The port.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_request_time(env: dict, timeout: float = 60) -> float:
+    """
+    Launch the API with uvicorn and send it a tracking request until one is answered.
+    :param env: Environment of the server.
+    :param timeout: Seconds to wait for the server before giving up.
+    :return: Seconds from launching the server to the first successful response.
+    :raises RuntimeError: If the server exits or doesn't answer in time.
+    """
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with {server.returncode}")
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            try:
+                connection.request("POST", FIRST_REQUEST)
+                if connection.getresponse().status == 200:
+                    return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+            finally:
+                connection.close()
+        raise RuntimeError("Server didn't answer in time")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=5, help="Processes started per measurement")
+    arg_parser.add_argument("--snapshot", help="Engine snapshot to load, built into a temporary directory if omitted")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = args.snapshot
+        if snapshot is None:
+            snapshot = os.path.join(directory, "engine.snapshot")
+            save_snapshot(build_snapshot(), snapshot)
+        print(f"{'engine':<14}{'import ms':>12}{'(fastest)':>11}{'first request ms':>19}{'(fastest)':>11}")
+        for name, path in (("definitions", ""), ("snapshot", snapshot)):
+            env = dict(os.environ, ENGINE_SNAPSHOT=path)
+            imports = [import_time(env) for _ in range(args.runs)]
+            first_requests = [first_request_time(env) for _ in range(args.runs)]
+            print(f"{name:<14}{statistics.median(imports) * 1e3:>12.1f}{min(imports) * 1e3:>11.1f}"
+                  f"{statistics.median(first_requests) * 1e3:>19.1f}{min(first_requests) * 1e3:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
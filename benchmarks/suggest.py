@@ -0,0 +1,100 @@
+"""
+Measure the /track/suggest typeahead the way it is used: every valid number of a corpus is typed one character at a
+time, and the partial number is looked up after every keystroke.
+
+    python -m benchmarks.suggest [--size 20000]
+
+The SuggestIndex is measured built lazily, as when the engine is built from the carrier definitions and the automaton
+grows with the first lookups, and determinized up front, as when it is loaded from an engine snapshot. The route is
+measured on the determinized index, response encoding included. Every keystroke is also checked to still suggest the
+format the number was generated for.
+"""
+import argparse
+import asyncio
+import pickle
+import time
+
+from app.parser_manager import ParseManager
+from app.parsers.base_parser import canonicalize
+from app.result_cache import ResultCache
+from app.suggest import SuggestIndex
+from benchmarks.corpus import build_corpus
+from benchmarks.suite import percentile
+
+
+def measure_keystrokes(lookup, keystrokes: list) -> dict:
+    """
+    Time a lookup per keystroke.
+    :param lookup: Callable taking a partial tracking number.
+    :param keystrokes: List of partial tracking numbers, in typing order.
+    :return: Dictionary with the p50, p99 and slowest latencies in microseconds.
+    """
+    latencies = []
+    clock = time.perf_counter_ns
+    for partial in keystrokes:
+        started = clock()
+        lookup(partial)
+        latencies.append(clock() - started)
+    latencies.sort()
+    return {
+        "p50_us": percentile(latencies, 0.50) / 1e3,
+        "p99_us": percentile(latencies, 0.99) / 1e3,
+        "max_us": latencies[-1] / 1e3,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=20_000, help="Number of corpus entries")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    entries = [entry for entry in build_corpus(parse_manager, args.size, seed=args.seed) if entry.valid]
+    keystrokes = [
+        canonicalize(entry.tracking_number)[:length]
+        for entry in entries for length in range(1, len(canonicalize(entry.tracking_number)) + 1)
+    ]
+
+    started = time.perf_counter()
+    lazy = SuggestIndex(parse_manager.parsers)
+    build_time = time.perf_counter() - started
+    lazy_latency = measure_keystrokes(lazy.suggest, keystrokes)
+
+    determinized = SuggestIndex(parse_manager.parsers)
+    started = time.perf_counter()
+    determinized.determinize()
+    determinize_time = time.perf_counter() - started
+    data = pickle.dumps(determinized, protocol=pickle.HIGHEST_PROTOCOL)
+    started = time.perf_counter()
+    determinized = pickle.loads(data)
+    load_time = time.perf_counter() - started
+    determinized_latency = measure_keystrokes(determinized.suggest, keystrokes)
+
+    from app.routers import tracking
+    tracking.suggest_index = determinized
+    loop = asyncio.new_event_loop()
+    route_latency = measure_keystrokes(
+        lambda partial: loop.run_until_complete(tracking.suggest_carriers(partial)), keystrokes
+    )
+    loop.close()
+
+    missed = 0
+    for entry in entries:
+        key = canonicalize(entry.tracking_number)
+        for length in range(len(key) + 1):
+            candidates = determinized.suggest(key[:length]).candidates
+            if not any(candidate["format"] == entry.format_name for candidate in candidates):
+                missed += 1
+                break
+
+    print(f"{len(keystrokes)} keystrokes over {len(entries)} valid numbers, {missed} numbers lost their format")
+    print(f"build {build_time * 1e3:.1f} ms, determinize {determinize_time * 1e3:.1f} ms, "
+          f"load determinized {load_time * 1e3:.1f} ms ({len(data)} bytes)")
+    print(f"{'index':<14}{'p50 us':>10}{'p99 us':>10}{'max us':>10}")
+    for name, latency in (("lazy", lazy_latency), ("determinized", determinized_latency), ("route", route_latency)):
+        print(f"{name:<14}{latency['p50_us']:>10.2f}{latency['p99_us']:>10.2f}{latency['max_us']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Measure the throughput and latency of every parser and of the ParseManager end to end over a synthetic corpus, and
+compare them against a stored baseline.
+
+    python -m benchmarks.suite                       # print the results
+    python -m benchmarks.suite --save-baseline       # store them in benchmarks/baseline.json
+    python -m benchmarks.suite --check               # exit with 1 if anything is slower than the baseline allows
+
+Baselines are only comparable on the machine they were recorded on, so record a fresh one before comparing commits on
+a different machine.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+from benchmarks.corpus import build_corpus
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """
+    Nearest rank percentile of an already sorted list.
+    :param sorted_values: Sorted list of numbers.
+    :param fraction: Percentile as a fraction, eg. 0.99.
+    :return: The percentile value.
+    """
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def measure_calls(func, tracking_numbers: list) -> dict:
+    """
+    Call a function once per tracking number, timing every call.
+    :param func: Callable taking a tracking number.
+    :param tracking_numbers: List of tracking number strings.
+    :return: Dictionary with the numbers/sec and the p50 and p99 latencies in microseconds.
+    """
+    latencies = []
+    clock = time.perf_counter_ns
+    started = clock()
+    for tracking_number in tracking_numbers:
+        call_started = clock()
+        try:
+            func(tracking_number)
+        except Exception:
+            pass
+        latencies.append(clock() - call_started)
+    elapsed = (clock() - started) / 1e9
+    latencies.sort()
+    return {
+        "numbers_per_sec": len(tracking_numbers) / elapsed,
+        "p50_us": percentile(latencies, 0.50) / 1e3,
+        "p99_us": percentile(latencies, 0.99) / 1e3,
+    }
+
+
+def measure_batches(func, tracking_numbers: list, batch_size: int) -> dict:
+    """
+    Call a batch function over consecutive slices of the tracking numbers.
+    :param func: Callable taking a list of tracking numbers.
+    :param tracking_numbers: List of tracking number strings.
+    :param batch_size: Number of tracking numbers per call.
+    :return: Dictionary with the numbers/sec and the p50 and p99 latencies per batch in microseconds.
+    """
+    batches = [tracking_numbers[start:start + batch_size] for start in range(0, len(tracking_numbers), batch_size)]
+    result = measure_calls(func, batches)
+    result["numbers_per_sec"] *= len(tracking_numbers) / len(batches)
+    return result
+
+
+def run(size: int, seed: int, batch_size: int, repeat: int) -> dict:
+    """
+    Run every benchmark, keeping the fastest of the repeated runs to damp noise from the rest of the machine.
+    :param size: Number of corpus entries.
+    :param seed: Seed of the corpus generator.
+    :param batch_size: Number of tracking numbers per parse_batch call.
+    :param repeat: Number of times every benchmark is run.
+    :return: Dictionary of benchmark name to its measurements.
+    """
+    parse_manager = ParseManager(cache=ResultCache(0), workers=1)
+    tracking_numbers = [entry.tracking_number for entry in build_corpus(parse_manager, size, seed=seed)]
+    # Warm up the regex and dispatch paths before timing.
+    parse_manager.parse_batch(tracking_numbers[:1000])
+
+    benchmarks = {
+        f"parser/{parser.name}": lambda parser=parser: measure_calls(parser.parse, tracking_numbers)
+        for parser in parse_manager.parsers
+    }
+    benchmarks["manager/parse"] = lambda: measure_calls(parse_manager.parse, tracking_numbers)
+    benchmarks["manager/parse_batch"] = lambda: measure_batches(
+        parse_manager.parse_batch, tracking_numbers, batch_size
+    )
+
+    results = {}
+    for name, benchmark in benchmarks.items():
+        results[name] = max((benchmark() for _ in range(repeat)), key=lambda result: result["numbers_per_sec"])
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Find the benchmarks whose throughput dropped below the baseline by more than the tolerance.
+    :param results: Current results.
+    :param baseline: Baseline results.
+    :param tolerance: Allowed slowdown as a fraction, eg. 0.2.
+    :return: List of (name, current numbers/sec, baseline numbers/sec) tuples of the regressions.
+    """
+    regressions = []
+    for name, measurement in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]["numbers_per_sec"]
+        if measurement["numbers_per_sec"] < expected * (1 - tolerance):
+            regressions.append((name, measurement["numbers_per_sec"], expected))
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--size", type=int, default=20_000, help="Number of corpus entries")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark, the fastest is kept")
+    arg_parser.add_argument("--batch-size", type=int, default=1_000, help="Tracking numbers per parse_batch call")
+    arg_parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline")
+    arg_parser.add_argument("--check", action="store_true", help="Fail if slower than the baseline")
+    arg_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown as a fraction")
+    arg_parser.add_argument("-o", "--output", help="Also write the results as JSON to this file")
+    args = arg_parser.parse_args()
+
+    results = run(args.size, args.seed, args.batch_size, args.repeat)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+
+    print(f"{'benchmark':<32}{'numbers/s':>12}{'p50 us':>10}{'p99 us':>10}{'vs baseline':>13}")
+    for name, measurement in results.items():
+        change = ""
+        if name in baseline:
+            change = f"{measurement['numbers_per_sec'] / baseline[name]['numbers_per_sec'] - 1:+.1%}"
+        print(
+            f"{name:<32}{measurement['numbers_per_sec']:>12.0f}{measurement['p50_us']:>10.1f}"
+            f"{measurement['p99_us']:>10.1f}{change:>13}"
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus_size": args.size,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.check:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, current, expected in regressions:
+            print(f"REGRESSION {name}: {current:.0f} numbers/s, baseline {expected:.0f}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
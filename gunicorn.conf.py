@@ -0,0 +1,76 @@
+"""
+Pre-fork server mode: `gunicorn app.main:app` from the repository root, as the Docker image does, runs one uvicorn
+worker process per available CPU behind a gunicorn master.
+
+The master imports the app before forking (preload_app), so the parse engine, the typeahead automaton and the carrier
+documents are built or loaded from the snapshot once and the workers share their memory pages copy-on-write. The
+master then moves everything it allocated to the permanent generation of the garbage collector (gc.freeze), so the
+collections of the workers never write to the headers of those objects and copy their pages. Pages of objects a worker
+changes the reference counts of, eg. the compiled patterns it parses with, are still copied.
+
+Reloads are graceful: `kill -HUP <master pid>` forks new workers from the master, then stops the old ones, which stop
+accepting connections and finish their in-flight requests, streamed batches included, within GRACEFUL_TIMEOUT. New
+workers run the code and engine the master preloaded, deploying new code takes a new master.
+
+Every worker publishes its metrics to a file of METRICS_DIR, a temporary directory of the master unless set, so GET
+/metrics answers for all of them whichever worker it reaches, see app.metrics.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+from app.server import available_cpus
+
+# Number of worker processes, 0 sizes it to the CPUs the container may use.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 0))
+# Seconds a stopping worker gets to finish its in-flight requests before it is killed, on reload and shutdown.
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", 120))
+# Each worker already takes a CPU, a process pool per worker for large batches would oversubscribe them. Set before the
+#   master imports the app.
+os.environ.setdefault("PARSE_WORKERS", "1")
+# Also read when the master imports the app. Reloads read this file again and keep the directory.
+_METRICS_DIR_PREFIX = "tracking-metrics-"
+if "METRICS_DIR" not in os.environ:
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix=_METRICS_DIR_PREFIX)
+
+bind = [f"0.0.0.0:{os.environ.get('PORT', 8080)}"]
+workers = WEB_CONCURRENCY or available_cpus()
+worker_class = "app.server.TrackingWorker"
+preload_app = True
+graceful_timeout = GRACEFUL_TIMEOUT
+
+
+def when_ready(server):
+    """
+    Start the bulk job workers once, in the master rather than in every worker, then freeze what the master allocated
+    before the first workers are forked.
+    """
+    from app import main
+    from app.jobs import JOB_WORKERS, JobWorkers
+
+    main.start_job_workers = False
+    if JOB_WORKERS:
+        server.job_workers = JobWorkers(JOB_WORKERS)
+        server.job_workers.start()
+    # Metrics a previous server left in a directory that was given.
+    for name in os.listdir(os.environ["METRICS_DIR"]):
+        if name.endswith(".prom"):
+            os.remove(os.path.join(os.environ["METRICS_DIR"], name))
+    gc.collect()
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    # Objects the master allocated since the last fork, eg. on a reload.
+    gc.freeze()
+
+
+def on_exit(server):
+    job_workers = getattr(server, "job_workers", None)
+    if job_workers is not None:
+        job_workers.stop()
+    # Only the temporary directory created above, a directory that was given is left in place.
+    parent, name = os.path.split(os.environ["METRICS_DIR"])
+    if parent == tempfile.gettempdir() and name.startswith(_METRICS_DIR_PREFIX):
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
@@ -0,0 +1,153 @@
+"""
+Regression tests of the carrier definitions: known tracking numbers of every carrier and format, and the corpus
+generators of benchmarks.corpus, parsed through the ParseManager. The expected carriers, service types and tracking
+URLs are those of the hand-written parsers the JSON definitions of app/carriers replaced.
+"""
+import pytest
+
+from app.parser_manager import MODE_FIRST, ParseManager
+from app.parsers.base_parser import canonicalize
+from app.result_cache import ResultCache
+from app.snapshot import build_snapshot, load_snapshot, save_snapshot
+from benchmarks.corpus import build_corpus, check_dispatch
+
+UPS_URL = "https://wwwapps.ups.com/WebTracking/track?track=yes&trackNums=%s"
+FEDEX_URL = "https://www.fedex.com/apps/fedextrack/?tracknumbers=%s"
+USPS_URL = "https://tools.usps.com/go/TrackConfirmAction?tLabels=%s"
+DHL_URL = "http://www.dhl.com/en/express/tracking.html?brand=DHL&AWB=%s"
+ONTRAC_URL = "http://www.ontrac.com/tracking/?number=%s"
+AMAZON_URL = "https://track.amazon.com/tracking/0?trackingId=%s"
+USPS = "United States Postal Service"
+
+# Tracking number, then the carrier, service type and tracking URL template of every result, in order. Published
+#   sample numbers first, then a generated number per format.
+KNOWN = [
+    ("1Z999AA10123456784", [("UPS", "UPS United States Next Day Air (Red)", UPS_URL)]),
+    ("1Z12345E0205271688", [("UPS", "UPS United States Second Day Air (Blue)", UPS_URL)]),
+    ("1Z12345E6605272234", [("UPS", "UPS United States Worldwide Express", UPS_URL)]),
+    ("1Z12345E1305277940", [("UPS", "UPS United States Next Day Air Saver (Red Saver)", UPS_URL)]),
+    ("986578788855", [("FedEx", None, FEDEX_URL)]),
+    ("449044304137821", [("FedEx", None, FEDEX_URL)]),
+    ("9611020987654312345672", [("FedEx", "020", FEDEX_URL)]),
+    ("9205590164917312751089", [(USPS, "59", USPS_URL)]),
+    ("EE123456785US", [("International", "EMS", None)]),
+    ("RB123456785GB", [("International", "Letter Post Registered", None)]),
+    ("CP123456785DE", [("International", "Parcel Post", None)]),
+    ("LX123456785CN", [("International", "Letter Post Express", None)]),
+    ("3318810025", [("DHL", None, DHL_URL)]),
+    ("C11031500001879", [("OnTrac", None, ONTRAC_URL)]),
+    ("TBA012345678901", [("Amazon", None, AMAZON_URL)]),
+    ("TBA080230025315", [("Amazon", None, AMAZON_URL)]),
+    ("54645335531", [("DHL", None, DHL_URL)]),
+    ("IN5761703282904872116017846832", [("DHL", None, DHL_URL)]),
+    ("134425675710", [("FedEx", None, FEDEX_URL)]),
+    ("101074279708071973974191", [("FedEx", None, FEDEX_URL)]),
+    ("602996802437539575095356", [("FedEx", "29", FEDEX_URL), (USPS, "29", USPS_URL)]),
+    ("557989791690122", [("FedEx", None, FEDEX_URL)]),
+    ("790452452079311430", [("FedEx", None, FEDEX_URL)]),
+    ("9625827779261673075624", [("FedEx", "827", FEDEX_URL)]),
+    ("9676257758133288616574246143429440", [("FedEx", None, FEDEX_URL)]),
+    ("LH29467673", [("LaserShip", None, None)]),
+    ("1LS725565127339", [("LaserShip", None, None)]),
+    ("1LS71840133747231", [("LaserShip", None, None)]),
+    ("C52838895919043", [("OnTrac", None, ONTRAC_URL)]),
+    ("D68607936126218", [("OnTrac", None, ONTRAC_URL)]),
+    ("CE584880781AS", [("International", "Parcel Post", None)]),
+    ("1Z5DH8LZUGJ7APQ2J4", [("UPS", None, UPS_URL)]),
+    ("H1145232942", [("UPS", None, UPS_URL)]),
+    ("59580707599365796561", [(USPS, "59", USPS_URL)]),
+    ("42016530368690021175867801162028", [(USPS, None, USPS_URL)]),
+    ("4208764874053654103148340025", [(USPS, "05", USPS_URL)]),
+]
+
+# Known numbers with a wrong check digit or length, and the carrier that must not recognise them.
+INVALID = [
+    ("1Z999AA1012345678", "UPS"),
+    ("986578788856", "FedEx"),
+    ("449044304137822", "FedEx"),
+    ("9611020987654312345673", "FedEx"),
+    ("9205590164917312751088", USPS),
+    ("59580707599365796562", USPS),
+    ("EE123456784US", "International"),
+    ("RB123456786GB", "International"),
+    ("CE584880782AS", "International"),
+    ("3318810026", "DHL"),
+    ("54645335532", "DHL"),
+    ("C11031500001878", "OnTrac"),
+    ("D68607936126219", "OnTrac"),
+    ("1LS71840133747232", "LaserShip"),
+    ("TBA01234567890", "Amazon"),
+]
+
+
+@pytest.fixture(scope="module")
+def parse_manager():
+    return ParseManager(cache=ResultCache(0), workers=1)
+
+
+def describe(results: list) -> list:
+    """
+    Reduce parse results to what the tests compare.
+    :param results: List of ParseResult.
+    :return: List of (carrier, service type, tracking URL template) tuples.
+    """
+    return [(result.carrier, result.get("ServiceType"), result.tracking_url_template or None) for result in results]
+
+
+@pytest.mark.parametrize("tracking_number, expected", KNOWN)
+def test_known_numbers(parse_manager, tracking_number, expected):
+    results = parse_manager.parse(tracking_number)
+    assert describe(results) == expected
+    for result in results:
+        assert result.tracking_number == tracking_number
+        if result.tracking_url_template:
+            assert result.tracking_url == result.tracking_url_template % tracking_number
+
+
+@pytest.mark.parametrize("tracking_number, expected", KNOWN)
+def test_known_numbers_with_separators(parse_manager, tracking_number, expected):
+    spaced = " ".join(tracking_number[start:start + 4] for start in range(0, len(tracking_number), 4))
+    assert describe(parse_manager.parse(spaced)) == expected
+    assert describe(parse_manager.parse(f" {tracking_number.lower()}\n")) == expected
+
+
+@pytest.mark.parametrize("tracking_number, carrier", INVALID)
+def test_invalid_numbers(parse_manager, tracking_number, carrier):
+    assert carrier not in [result.carrier for result in parse_manager.parse(tracking_number)]
+
+
+def test_first_match_precedence(parse_manager):
+    # SmartPost numbers are valid USPS IMpb numbers too, FedEx takes precedence.
+    assert describe(parse_manager.parse("602996802437539575095356", MODE_FIRST)) == [("FedEx", "29", FEDEX_URL)]
+
+
+def test_corpus_covers_every_format(parse_manager):
+    corpus = build_corpus(parse_manager, 2_000)
+    generated = {(entry.carrier, entry.format_name) for entry in corpus if entry.valid}
+    formats = {(parser.carrier_name, tracking_format.name) for parser in parse_manager.parsers
+               for tracking_format in parser.formats}
+    assert generated == formats
+
+
+@pytest.mark.parametrize("spaces", [False, True])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_corpus(parse_manager, spaces, seed):
+    corpus = build_corpus(parse_manager, 4_000, spaces=spaces, seed=seed)
+    check_dispatch(parse_manager, corpus)
+    batch = parse_manager.parse_batch([entry.tracking_number for entry in corpus])
+    for entry, results in zip(corpus, batch):
+        assert describe(results) == describe(parse_manager.parse(entry.tracking_number)), entry
+        for result in results:
+            assert result.tracking_number == canonicalize(entry.tracking_number)
+            if result.tracking_url_template:
+                assert result.tracking_url == result.tracking_url_template % result.tracking_number
+
+
+def test_snapshot(parse_manager, tmp_path):
+    path = str(tmp_path / "engine.snapshot")
+    save_snapshot(build_snapshot(), path)
+    loaded = ParseManager(cache=ResultCache(0), workers=1, snapshot=load_snapshot(path))
+    tracking_numbers = [tracking_number for tracking_number, _ in KNOWN + INVALID]
+    tracking_numbers += [entry.tracking_number for entry in build_corpus(parse_manager, 2_000, spaces=True)]
+    for tracking_number in tracking_numbers:
+        assert describe(loaded.parse(tracking_number)) == describe(parse_manager.parse(tracking_number))
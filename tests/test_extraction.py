@@ -0,0 +1,91 @@
+"""
+Tests of the free text scanner behind POST /track/extract: what counts as a tracking number in prose, and the streamed
+extraction giving the same results as the whole text.
+"""
+import random
+import time
+
+import pytest
+
+from app.extraction import TrackingNumberScanner
+from app.parser_manager import ParseBudgetExceeded, ParseManager
+from app.result_cache import ResultCache
+from benchmarks.corpus import build_corpus
+
+# Text without a tracking number, although digits in it read as one once joined to the words or lines around them.
+NO_TRACKING_NUMBERS = [
+    "Shipped in 5761703282904872 boxes",
+    "my 1234567890 ok",
+    "Totals: 100 200 300 400 500 600",
+    "qty\n1\n2\n3\n4\n5\n6\n7\n8\n9\n0\n1\n2",
+]
+
+# Text, then the carrier, tracking number and text of every tracking number found, in order.
+EXTRACTED = [
+    ("Your UPS 1Z 999 AA1 0123 4567 84 arrives", [("UPS", "1Z999AA10123456784", "1Z 999 AA1 0123 4567 84")]),
+    ("ref 123 1Z999AA10123456784.", [("UPS", "1Z999AA10123456784", "1Z999AA10123456784")]),
+    ("Label: 1Z-999-AA1-01234567-84, see", [("UPS", "1Z999AA10123456784", "1Z-999-AA1-01234567-84")]),
+    ("EE123456785US and TBA012345678901", [
+        ("International", "EE123456785US", "EE123456785US"),
+        ("Amazon", "TBA012345678901", "TBA012345678901"),
+    ]),
+    ("9205 5901 6491 7312 7510 89\n986578788855 (DHL 3318810025)", [
+        ("United States Postal Service", "9205590164917312751089", "9205 5901 6491 7312 7510 89"),
+        ("FedEx", "986578788855", "986578788855"),
+        ("DHL", "3318810025", "3318810025"),
+    ]),
+    ("X1Z999AA10123456784 is glued to its prefix", []),
+]
+
+
+@pytest.fixture(scope="module")
+def scanner():
+    return TrackingNumberScanner(ParseManager(cache=ResultCache(0), workers=1))
+
+
+@pytest.fixture(scope="module")
+def text(scanner):
+    # Corpus numbers, some written with separators, between words, punctuation, line breaks and the texts above.
+    rng = random.Random(0)
+    words = ["Order", "ref", "in", "qty 12", "-", "--", ", ", "\n", "\n\n", "Tracking:", "1 2 3"]
+    words += NO_TRACKING_NUMBERS + [text for text, _ in EXTRACTED]
+    parts = []
+    for entry in build_corpus(scanner.parse_manager, 600, spaces=True):
+        parts.append(entry.tracking_number)
+        parts.extend(rng.choice(words) for _ in range(rng.randint(0, 3)))
+    return "".join(part + rng.choice([" ", " ", "\n", ". ", "\t"]) for part in parts)
+
+
+def describe(text: str, results: list) -> list:
+    """
+    Reduce extraction results to what the tests compare.
+    :param text: Text the results were extracted from.
+    :param results: List of extraction result dictionaries.
+    :return: List of (carrier, tracking number, matched text) tuples.
+    """
+    return [(result["carrier"], result["trackingNumber"], text[result["start"]:result["end"]]) for result in results]
+
+
+@pytest.mark.parametrize("text", NO_TRACKING_NUMBERS)
+def test_no_false_positives(scanner, text):
+    assert scanner.extract(text) == []
+
+
+@pytest.mark.parametrize("text, expected", EXTRACTED)
+def test_extract(scanner, text, expected):
+    assert describe(text, scanner.extract(text)) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_extract_stream(scanner, text, chunk_size):
+    expected = scanner.extract(text)
+    assert len(expected) > 300
+    chunks = (text[start:start + chunk_size] for start in range(0, len(text), chunk_size))
+    assert list(scanner.extract_stream(chunks)) == expected
+
+
+def test_deadline_within_run(scanner):
+    # A single word of hyphenated digits has a candidate at every hyphen, the deadline has to stop it midway.
+    text = "-".join("1234" for _ in range(200_000))
+    with pytest.raises(ParseBudgetExceeded):
+        list(scanner.scan(text, deadline=time.perf_counter() + 0.01))
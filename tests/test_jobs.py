@@ -0,0 +1,185 @@
+"""
+Tests of bulk jobs: the SQLite job store, workers taking over the chunks of a worker that died, and paging through the
+results of POST /track/jobs.
+"""
+import time
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from app import jobs
+from app.batch import batch_lines
+from app.jobs import JobStore, JobWorkers
+from app.main import app
+from app.parser_manager import ParseManager
+from app.result_cache import ResultCache
+from app.routers.jobs import get_job_store
+
+NUMBERS = ["1Z999AA10123456784", "986578788855", "3318810025", "EE123456785US", "not a number",
+           "9205590164917312751089", "TBA012345678901", "1Z999AA10123456784", "C11031500001879", "LH29467673"]
+
+
+@pytest.fixture(scope="module")
+def parse_manager():
+    return ParseManager(cache=ResultCache(0), workers=1)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def queue_job(store: JobStore, numbers: list, chunk_size: int) -> str:
+    """
+    Queue a job the way upload_job does.
+    :param store: The JobStore.
+    :param numbers: Tracking numbers of the job.
+    :param chunk_size: Tracking numbers per chunk.
+    :return: Id of the job.
+    """
+    job_id = store.create_job()
+    for chunk, start in enumerate(range(0, len(numbers), chunk_size)):
+        store.add_chunk(job_id, chunk, start, numbers[start:start + chunk_size])
+    store.finish_upload(job_id)
+    return job_id
+
+
+def work(store: JobStore, parse_manager: ParseManager, chunks: int = None, worker: str = "worker") -> int:
+    """
+    Parse the chunks waiting in a store the way run_worker does.
+    :param store: The JobStore.
+    :param parse_manager: ParseManager to parse them with.
+    :param chunks: Largest number of chunks to parse, all of them if None.
+    :param worker: Id of the worker.
+    :return: Number of chunks parsed.
+    """
+    parsed = 0
+    while chunks is None or parsed < chunks:
+        claim = store.claim_chunk(worker)
+        if claim is None:
+            break
+        results, found = batch_lines(claim.numbers, claim.start, parse_manager)
+        assert store.complete_chunk(claim, worker, results, found, 0.01)
+        parsed += 1
+    return parsed
+
+
+def test_job_store(store, parse_manager):
+    job_id = queue_job(store, NUMBERS, 4)
+    job = store.get_job(job_id)
+    assert (job["status"], job["total"], job["processed"]) == ("queued", 10, 0)
+    assert store.pending_numbers() == 10
+    assert [(chunk.start, chunk.size, chunk.status) for chunk in store.chunk_infos(job_id)] == [
+        (0, 4, "pending"), (4, 4, "pending"), (8, 2, "pending")
+    ]
+
+    assert work(store, parse_manager, chunks=1) == 1
+    job = store.get_job(job_id)
+    assert (job["status"], job["processed"], job["found"]) == ("running", 4, 4)
+    assert store.chunk_results(job_id, 1) is None
+
+    assert work(store, parse_manager) == 2
+    job = store.get_job(job_id)
+    assert (job["status"], job["processed"], job["found"]) == ("done", 10, 9)
+    assert store.pending_numbers() == 0
+    lines = [orjson.loads(line) for chunk in range(3) for line in store.chunk_results(job_id, chunk).splitlines()]
+    assert [line["index"] for line in lines] == list(range(10))
+    assert [line["tracking_number"] for line in lines] == NUMBERS
+    assert lines[4]["error"] == "Tracking number not found"
+
+    assert store.purge(time.time() - 60) == 0
+    assert store.delete_job(job_id)
+    assert store.get_job(job_id) is None
+    assert not store.delete_job(job_id)
+
+
+def test_failed_job(store):
+    job_id = queue_job(store, NUMBERS, 4)
+    store.claim_chunk("worker")
+    store.fail_job(job_id, "Chunk 0 failed")
+    job = store.get_job(job_id)
+    assert (job["status"], job["error"]) == ("failed", "Chunk 0 failed")
+    assert store.claim_chunk("worker") is None
+    assert store.purge(time.time() + 1) == 1
+
+
+def test_lease_takeover(store, parse_manager, monkeypatch):
+    job_id = queue_job(store, NUMBERS, 10)
+    crashed = store.claim_chunk("crashed")
+    assert crashed.numbers == NUMBERS
+    # The chunk stays with its worker as long as the lease runs.
+    assert store.claim_chunk("worker") is None
+
+    monkeypatch.setattr(jobs, "JOB_LEASE", 0)
+    time.sleep(0.01)
+    claim = store.claim_chunk("worker")
+    assert (claim.job_id, claim.chunk, claim.numbers) == (job_id, 0, NUMBERS)
+    results, found = batch_lines(claim.numbers, claim.start, parse_manager)
+    assert store.complete_chunk(claim, "worker", results, found, 0.01)
+    # The worker that lost its lease comes back too late.
+    assert not store.complete_chunk(crashed, "crashed", b"", 0, 0.01)
+    assert store.get_job(job_id)["status"] == "done"
+    assert store.chunk_results(job_id, 0) == results
+
+
+def test_workers_resume_after_crash(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = JobStore(path)
+    job_id = queue_job(store, NUMBERS, 3)
+    store.claim_chunk("crashed")
+    # Spawned workers read the lease from the environment.
+    monkeypatch.setenv("JOB_LEASE", "0")
+    workers = JobWorkers(2, path)
+    workers.start()
+    try:
+        deadline = time.monotonic() + 120
+        while store.get_job(job_id)["status"] != "done" and time.monotonic() < deadline:
+            time.sleep(0.1)
+    finally:
+        workers.stop()
+    job = store.get_job(job_id)
+    assert (job["status"], job["processed"], job["found"]) == ("done", 10, 9)
+    assert [chunk.status for chunk in store.chunk_infos(job_id)] == ["done"] * 4
+
+
+def test_results_pagination(store, parse_manager, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CHUNK_SIZE", 3)
+    app.dependency_overrides[get_job_store] = lambda: store
+    try:
+        client = TestClient(app)
+        response = client.post("/track/jobs", content="\n".join(NUMBERS).encode())
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+        assert response.headers["Location"] == f"/track/jobs/{job_id}"
+
+        response = client.get(f"/track/jobs/{job_id}/results")
+        assert (response.text, response.headers["X-Next-Offset"]) == ("", "0")
+        assert response.headers["X-Job-Status"] == "queued"
+
+        # Results are returned up to the first chunk that isn't parsed.
+        work(store, parse_manager, chunks=2)
+        pages = []
+        offset = 0
+        while True:
+            response = client.get(f"/track/jobs/{job_id}/results", params={"offset": offset, "limit": 4})
+            pages.append([orjson.loads(line)["index"] for line in response.text.splitlines()])
+            next_offset = int(response.headers["X-Next-Offset"])
+            if next_offset == offset:
+                break
+            offset = next_offset
+        assert pages == [[0, 1, 2, 3], [4, 5], []]
+
+        work(store, parse_manager)
+        pages = []
+        while "X-Next-Offset" in response.headers:
+            offset = int(response.headers["X-Next-Offset"])
+            response = client.get(f"/track/jobs/{job_id}/results", params={"offset": offset, "limit": 3})
+            pages.append([orjson.loads(line)["tracking_number"] for line in response.text.splitlines()])
+        assert pages == [NUMBERS[6:9], NUMBERS[9:]]
+        assert response.headers["X-Job-Status"] == "done"
+
+        assert client.delete(f"/track/jobs/{job_id}").status_code == 204
+        assert client.get(f"/track/jobs/{job_id}/results").status_code == 404
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,79 @@
+"""
+Tests of the metrics of several worker processes being added up by whichever process renders them.
+"""
+import os
+import time
+
+from app.metrics import CallbackMetric, Counter, Histogram, Registry, publish_metrics, render_metrics
+
+
+def build_registry(calls: int, in_flight: int, pending: int) -> Registry:
+    """
+    Build the registry of a worker process.
+    :param calls: Count of the counter.
+    :param in_flight: Value of the gauge.
+    :param pending: Value of the shared gauge.
+    :return: The Registry.
+    """
+    registry = Registry()
+    registry.register(Counter("calls_total", "Calls.", ("parser",))).labels("UPS").inc(calls)
+    registry.register(Histogram("duration_seconds", "Duration.", buckets=(0.1, 1.0))).observe(0.5)
+    registry.register(CallbackMetric("in_flight", "In flight.", "gauge", lambda: in_flight))
+    registry.register(CallbackMetric("pending", "Pending.", "gauge", lambda: pending, shared=True))
+    return registry
+
+
+def publish_as(registry: Registry, directory: str, pid: int, exiting: bool = False):
+    """
+    Publish metrics as another process would.
+    :param registry: Registry of the process.
+    :param directory: The metrics directory.
+    :param pid: Process id of the process.
+    :param exiting: Whether the process is exiting.
+    :return: Path of the file.
+    """
+    publish_metrics(registry, directory, exiting)
+    path = os.path.join(directory, f"{pid}.prom")
+    os.replace(os.path.join(directory, f"{os.getpid()}.prom"), path)
+    return path
+
+
+def samples(text: str) -> dict:
+    """
+    Read the samples of an exposition.
+    :param text: The exposition.
+    :return: Dictionary of the series to their value, as rendered.
+    """
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_single_process():
+    registry = build_registry(1, 2, 3)
+    assert render_metrics(registry, "") == registry.render()
+
+
+def test_workers_added_up(tmp_path):
+    directory = str(tmp_path)
+    publish_as(build_registry(10, 1, 7), directory, 1)
+    publish_as(build_registry(100, 1, 7), directory, 2, exiting=True)
+    stale = publish_as(build_registry(1000, 1, 7), directory, 3)
+    old = time.time() - 3600
+    os.utime(stale, (old, old))
+    own = build_registry(1, 4, 7)
+    publish_metrics(own, directory)
+
+    rendered = render_metrics(own, directory)
+    assert samples(rendered) == {
+        # Counts of every process, the exited ones included.
+        'calls_total{parser="UPS"}': "1111",
+        'duration_seconds_bucket{le="0.1"}': "0",
+        'duration_seconds_bucket{le="1.0"}': "4",
+        'duration_seconds_bucket{le="+Inf"}': "4",
+        "duration_seconds_sum": "2.0",
+        "duration_seconds_count": "4",
+        # Gauges of the processes still publishing.
+        "in_flight": "5",
+        # Shared gauges once.
+        "pending": "7",
+    }
+    assert "# HELP calls_total Calls.\n# TYPE calls_total counter\n" in rendered
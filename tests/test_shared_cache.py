@@ -0,0 +1,89 @@
+"""
+Tests of the parse result cache shared between processes: results written by several processes at once read back
+from any of them, and the file being replaced when it was written for another size or engine.
+"""
+import multiprocessing
+import os
+import threading
+
+from app.shared_cache import SharedResultCache
+
+CAPACITY = 100_000
+KEYS = 1_000
+
+
+def open_cache(path: str, capacity: int = CAPACITY, generation: str = "test") -> SharedResultCache:
+    # Without a front cache every lookup reads the table.
+    return SharedResultCache(path, capacity, local_capacity=0, generation=generation)
+
+
+def write(path: str, writer: str):
+    """
+    Fill the cache from two threads of a process, the keys of the writer and keys every writer writes.
+    :param path: Path of the cache file.
+    :param writer: Name of the writer, part of its keys and values.
+    :return: None
+    """
+    cache = open_cache(path)
+
+    def put(start: int):
+        for index in range(start, KEYS, 2):
+            cache.put(f"{writer}{index}", [f"{writer}{index}", writer])
+            cache.put(("first", f"SHARED{index}"), [f"SHARED{index}", writer])
+
+    threads = [threading.Thread(target=put, args=(start,)) for start in (0, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_processes_share_results(tmp_path):
+    path = str(tmp_path / "cache")
+    open_cache(path)
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=write, args=(path, writer)) for writer in ("A", "B")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    cache = open_cache(path)
+    for index in range(KEYS):
+        for writer in ("A", "B"):
+            assert cache.get(f"{writer}{index}") == [f"{writer}{index}", writer]
+        # Whichever writer came last, never a mix of both.
+        assert cache.get(("first", f"SHARED{index}")) in ([f"SHARED{index}", "A"], [f"SHARED{index}", "B"])
+    assert cache.get("C0") is None
+    assert len(cache) == 3 * KEYS
+    assert cache.stats()["misses"] == 1
+
+
+def test_file_replaced_on_resize(tmp_path):
+    path = str(tmp_path / "cache")
+    cache = open_cache(path, 1_000)
+    cache.put("1Z999AA10123456784", ["UPS"])
+    inode = os.stat(path).st_ino
+    size = os.path.getsize(path)
+
+    # Same size and engine: the table is reused.
+    assert open_cache(path, 1_000).get("1Z999AA10123456784") == ["UPS"]
+    assert os.stat(path).st_ino == inode
+
+    resized = open_cache(path, 2_000)
+    assert os.stat(path).st_ino != inode
+    assert os.path.getsize(path) > size
+    assert resized.capacity == 2_000
+    assert resized.get("1Z999AA10123456784") is None
+    assert len(resized) == 0
+    # A process still mapping the old file keeps its copy, the new table is unaffected by it.
+    assert cache.get("1Z999AA10123456784") == ["UPS"]
+    cache.put("986578788855", ["FedEx"])
+    assert resized.get("986578788855") is None
+
+    inode = os.stat(path).st_ino
+    other_engine = open_cache(path, 2_000, generation="other")
+    assert os.stat(path).st_ino != inode
+    assert other_engine.get("1Z999AA10123456784") is None
+    assert sorted(os.listdir(tmp_path)) == ["cache", "cache.lock"]
@@ -0,0 +1,105 @@
+"""
+Tests of the tracking endpoints under concurrency: requests turned away once parsing is saturated, identical concurrent
+requests sharing a parse, and repeated numbers of a batch answered once.
+"""
+import asyncio
+import time
+
+import httpx
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from app.executor import PARSE_RETRY_AFTER, ParseExecutor
+from app.main import app
+from app.metrics import REQUEST_COALESCED
+from app.routers import tracking
+
+
+@pytest.fixture
+def slow_parses(monkeypatch):
+    """
+    Make every /track parse take a while, and record the tracking numbers parsed.
+    :return: List the tracking numbers of every parse are appended to.
+    """
+    parses = []
+    parse_tracking_numbers = tracking.parse_tracking_numbers
+
+    def slow_parse(tracking_numbers, mode):
+        parses.append(tracking_numbers)
+        time.sleep(0.3)
+        return parse_tracking_numbers(tracking_numbers, mode)
+
+    monkeypatch.setattr(tracking, "parse_tracking_numbers", slow_parse)
+    return parses
+
+
+async def concurrently(*requests: tuple) -> list:
+    """
+    Send requests to the app at the same time, each a little after the previous one.
+    :param requests: Tuples of the method, URL and keyword arguments of each request.
+    :return: List of the responses, in order.
+    """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        async def send(delay, method, url, kwargs):
+            await asyncio.sleep(delay)
+            return await client.request(method, url, **kwargs)
+
+        return await asyncio.gather(*(
+            send(index * 0.05, method, url, kwargs) for index, (method, url, kwargs) in enumerate(requests)
+        ))
+
+
+def test_saturated(slow_parses, monkeypatch):
+    executor = ParseExecutor(threads=2, max_pending=2)
+    monkeypatch.setattr(tracking, "parse_executor", executor)
+    try:
+        responses = asyncio.run(concurrently(
+            ("POST", "/track/", {"params": {"tracking_number": "1Z999AA10123456784"}}),
+            ("POST", "/track/", {"params": {"tracking_number": "986578788855"}}),
+            ("POST", "/track/", {"params": {"tracking_number": "3318810025"}}),
+            ("POST", "/track/batch", {"content": b"3318810025\n"}),
+        ))
+        assert [response.status_code for response in responses] == [200, 200, 429, 429]
+        assert responses[2].headers["Retry-After"] == str(PARSE_RETRY_AFTER)
+        assert slow_parses == [["1Z999AA10123456784"], ["986578788855"]]
+        assert executor.pending == 0
+
+        # The slots are given back once the requests are done.
+        response = TestClient(app).post("/track/", params={"tracking_number": "3318810025"})
+        assert response.status_code == 200
+    finally:
+        executor.shutdown()
+
+
+def test_identical_requests_coalesced(slow_parses):
+    coalesced = REQUEST_COALESCED.labels("track").value
+    request = ("POST", "/track/", {"params": {"tracking_number": ["1Z12345E0205271688", "1Z12345E0205271688"]}})
+    responses = asyncio.run(concurrently(request, request))
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[0].json() == responses[1].json()
+    assert responses[0].json()["carriers"] == ["UPS", "UPS"]
+    assert responses[0].json()["deduplicated"] == 1
+    assert slow_parses == [["1Z12345E0205271688", "1Z12345E0205271688"]]
+    assert REQUEST_COALESCED.labels("track").value == coalesced + 1
+
+    # Requests that aren't in flight at the same time are parsed each.
+    asyncio.run(concurrently(request))
+    assert len(slow_parses) == 2
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"1Z999AA10123456784\n986578788855\n1Z999AA10123456784\n1z999aa1 0123456784\nnot a number\nnot a number\n",
+     "text/plain"),
+    (orjson.dumps(["1Z999AA10123456784", "986578788855", "1Z999AA10123456784", "1z999aa1 0123456784",
+                   "not a number", "not a number"]), "application/json"),
+])
+def test_batch_duplicates(body, content_type):
+    response = TestClient(app).post("/track/batch", content=body, headers={"Content-Type": content_type})
+    lines = [orjson.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == list(range(6))
+    assert [line.get("duplicate", False) for line in lines] == [False, False, True, True, False, True]
+    assert [line.get("carriers") for line in lines] == [["UPS"], ["FedEx"], ["UPS"], ["UPS"], None, None]
+    assert lines[3]["results"] == lines[0]["results"]
+    assert lines[5]["error"] == "Tracking number not found"